@@ -0,0 +1,124 @@
+"""
+Measures how long the event loop is blocked while charts of a testrun are rendered, how long a few
+concurrent requests for the same chart take and how long a repeated request takes, and the size of
+the chart as HTML, which embeds the data.
+
+    python benchmarks/bench_chart_render.py [steps] [concurrent requests] [columns] [max points]
+
+The chart shows one of the measurement columns for half of the steps, decimated to max points if given.
+
+Needs the charts extra (altair and vl-convert-python). altair 5 refuses data with more than 5000 rows
+by default, so keep steps below that unless the data is decimated.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+SPEC = {
+    "data": {"values": []},
+    "transform": [{"filter": {"field": "fc_setpoint", "lt": 20}}],
+    "mark": "line",
+    "encoding": {
+        "x": {"field": "fc_setpoint", "type": "quantitative"},
+        "y": {"field": "mc_value_0", "type": "quantitative"},
+    },
+}
+
+
+def fill(path: str, steps: int, columns: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO users (id, subject, displayname, groups, roles, disabled) "
+        "VALUES (1, 'bench', 'bench', '[]', '[]', 0)"
+    )
+    conn.execute("INSERT INTO projects (id, short_code, name, groups, user_id) VALUES (1, 'BENCH', 'bench', '[]', 1)")
+    conn.execute(
+        "INSERT INTO testruns (id, short_code, dut_id, machine_hostname, user_name, test_name, state, project_id, "
+        "user_id, data) VALUES (1, 'CHART', 'bench', 'bench', 'bench', 'chart', 'COMPLETE', 1, 1, ?)",
+        (json.dumps({"vega_lite": SPEC}),),
+    )
+    conn.executemany(
+        "INSERT INTO measurement_columns (id, name, measurement_unit, flags, project_id) VALUES (?, ?, 'V', 0, 1)",
+        [(c + 1, f"value_{c}") for c in range(columns)] + [(columns + 1, "setpoint")],
+    )
+    conn.executemany(
+        "INSERT INTO forcing_conditions (sequence_number, value_hidden, numeric_value, column_id, testrun_id) "
+        "VALUES (?, 0, ?, ?, 1)",
+        ((i, i * 40 / steps, columns + 1) for i in range(steps)),
+    )
+    conn.executemany(
+        "INSERT INTO measurement_entries (sequence_number, numeric_value, flags, column_id, testrun_id) "
+        "VALUES (?, ?, 0, ?, 1)",
+        ((i, (i % 97) * 0.1 + c, c + 1) for i in range(steps) for c in range(columns)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def max_loop_lag(done: asyncio.Event) -> float:
+    lag = 0.0
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lag = max(lag, time.perf_counter() - start - 0.005)
+    return lag
+
+
+async def main(steps: int, concurrent: int, columns: int, max_points: int) -> None:
+    # the database needs to be configured before edea_ms.db gets imported
+    tmp = tempfile.TemporaryDirectory()
+    path = f"{tmp.name}/bench.sqlite"
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    os.environ["SNAPSHOT_DIR"] = f"{tmp.name}/snapshots"
+
+    from httpx import ASGITransport, AsyncClient
+
+    from edea_ms.db import engine, reader_engine
+    from edea_ms.db.models import Model
+    from edea_ms.main import app
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all)
+
+    fill(path, steps, columns)
+
+    transport = ASGITransport(app=app)  # type: ignore
+    async with AsyncClient(
+        transport=transport, base_url="http://bench", headers={"X-Webauth-User": "bench"}, timeout=None
+    ) as client:
+        url = "/api/testruns/plot/1?format=svg" + (f"&max_points={max_points}" if max_points else "")
+        # starts the render workers and imports the plotting libraries once
+        r = await client.get(url.replace("svg", "html"))
+        assert r.status_code == 200, r.text
+        html = len(r.content)
+
+        done = asyncio.Event()
+        lag = asyncio.create_task(max_loop_lag(done))
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(client.get(url) for _ in range(concurrent)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        assert all(r.status_code == 200 for r in responses), responses[0].text
+
+        start = time.perf_counter()
+        await client.get(url)
+        repeated = time.perf_counter() - start
+
+    print(f"{concurrent} concurrent SVG renders of {steps} steps: {elapsed:.3f} s")
+    print(f"max event loop lag: {await lag * 1000:.0f} ms")
+    print(f"repeated: {repeated * 1000:.1f} ms")
+    print(f"HTML: {html / 1024:.0f} KiB")
+
+    await reader_engine.dispose()
+    await engine.dispose()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    args = [int(n) for n in sys.argv[1:]]
+    asyncio.run(main(*(args + [4000, 4, 10, 0][len(args):])))
@@ -0,0 +1,132 @@
+"""
+Measures time and peak memory of loading a testrun into a DataFrame for exports (frame) and of
+exporting it as CSV through the API, buffered or streamed.
+
+    python benchmarks/bench_export_frame.py [frame|buffered|stream] [steps] [columns]
+
+httpx' ASGITransport only returns a response once the app sent all of it, so the streamed export
+is iterated directly to see when the first part is ready.
+
+The database is filled with the stdlib sqlite3 module from generators so that setting it up doesn't
+raise the peak RSS, the reported memory is the growth of the peak RSS while loading the run.
+"""
+
+import asyncio
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+
+def fill(path: str, steps: int, columns: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO users (id, subject, displayname, groups, roles, disabled) "
+        "VALUES (1, 'bench', 'bench', '[]', '[]', 0)"
+    )
+    conn.execute("INSERT INTO projects (id, short_code, name, groups, user_id) VALUES (1, 'BENCH', 'bench', '[]', 1)")
+    conn.execute(
+        "INSERT INTO testruns (id, short_code, dut_id, machine_hostname, user_name, test_name, state, project_id, "
+        "user_id) VALUES (1, 'EXPORT', 'bench', 'bench', 'bench', 'export', 'COMPLETE', 1, 1)"
+    )
+    conn.executemany(
+        "INSERT INTO measurement_columns (id, name, measurement_unit, flags, project_id) VALUES (?, ?, 'V', 0, 1)",
+        [(c + 1, f"value_{c}") for c in range(columns)] + [(columns + 1, "setpoint"), (columns + 2, "mode")],
+    )
+    conn.executemany(
+        "INSERT INTO forcing_conditions (sequence_number, value_hidden, numeric_value, string_value, column_id, "
+        "testrun_id) VALUES (?, 0, ?, ?, ?, 1)",
+        (
+            row
+            for i in range(steps)
+            for row in ((i, i * 0.01, None, columns + 1), (i, None, f"mode_{i % 4}", columns + 2))
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO measurement_entries (sequence_number, numeric_value, string_value, flags, column_id, "
+        "testrun_id) VALUES (?, ?, NULL, 0, ?, 1)",
+        ((i, i * 0.1 + c, c + 1) for i in range(steps) for c in range(columns)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def main(mode: str, steps: int, columns: int) -> None:
+    # the database needs to be configured before edea_ms.db gets imported
+    tmp = tempfile.TemporaryDirectory()
+    path = f"{tmp.name}/bench.sqlite"
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+    os.environ["SNAPSHOT_DIR"] = f"{tmp.name}/snapshots"
+
+    from httpx import ASGITransport, AsyncClient
+    from sqlalchemy import select
+
+    from edea_ms.db import engine, read_session, reader_engine
+    from edea_ms.db.models import Model, TestRun
+    from edea_ms.main import app
+    from edea_ms.routers.testruns import _get_testrun_df
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all)
+
+    fill(path, steps, columns)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    first_byte = None
+    repeated = 0.0
+    size = 0
+
+    if mode == "frame":
+        async with read_session() as session:
+            run = (await session.scalars(select(TestRun))).one()
+            df = await _get_testrun_df(run, session)
+        result = f"{df.height} rows x {df.width} columns"
+    elif mode == "stream":
+        from edea_ms.routers.testruns import EXPORT_WINDOW_STEPS, DataExportFormat, _iter_testrun_df, _stream_export
+
+        async with read_session() as session:
+            run = (await session.scalars(select(TestRun))).one()
+            frames = _iter_testrun_df(run, session, EXPORT_WINDOW_STEPS)
+            async for chunk in _stream_export(frames, DataExportFormat.CSV):
+                first_byte = first_byte or time.perf_counter() - start
+                size += len(chunk)
+        result = f"{size / 2**20:.0f} MiB of CSV"
+    else:
+        transport = ASGITransport(app=app)  # type: ignore
+        async with AsyncClient(
+            transport=transport, base_url="http://bench", headers={"X-Webauth-User": "bench"}, timeout=None
+        ) as client:
+            r = await client.get("/api/testruns/measurements/1?format=csv")
+            size = len(r.content)
+
+            # the run is complete, so these can be served from a snapshot
+            again = time.perf_counter()
+            for _ in range(3):
+                await client.get("/api/testruns/measurements/1?format=csv")
+            repeated = (time.perf_counter() - again) / 3
+            start += time.perf_counter() - again
+        result = f"{size / 2**20:.0f} MiB of CSV"
+
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"{mode}: {result} from {steps * (columns + 2)} entries")
+    if first_byte is not None:
+        print(f"first byte: {first_byte:.3f} s")
+    print(f"total:  {elapsed:.3f} s")
+    if mode == "buffered":
+        print(f"repeated: {repeated:.3f} s")
+    print(f"memory: peak RSS +{(peak - rss) / 1024:.0f} MiB")
+
+    await reader_engine.dispose()
+    await engine.dispose()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "frame"
+    args = [int(n) for n in sys.argv[2:]]
+    asyncio.run(main(mode, *(args + [100_000, 20][len(args):])))
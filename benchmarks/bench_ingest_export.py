@@ -0,0 +1,111 @@
+"""
+Measures concurrent ingest through the batch endpoint, exports running at the same time and the
+export of the resulting run.
+
+    DB_PRAGMA_PROFILE=sqlite python benchmarks/bench_ingest_export.py [stations] [steps] [columns]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+
+async def main(stations: int, steps: int, columns: int) -> None:
+    # the database needs to be configured before edea_ms.db gets imported
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tmp.name}/bench.sqlite"
+
+    from edea_ms.db import PRAGMA_PROFILE, engine, reader_engine
+    from edea_ms.db.models import Model
+    from edea_ms.main import app
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all)
+
+    transport = ASGITransport(app=app)  # type: ignore
+    async with AsyncClient(
+        transport=transport, base_url="http://bench", headers={"X-Webauth-User": "bench"}, timeout=None
+    ) as client:
+        r = await client.post("/api/projects", json={"short_code": "BENCH", "name": "bench", "groups": []})
+        project_id = r.json()["id"]
+
+        run_ids = []
+        for station in range(stations):
+            r = await client.post(
+                "/api/testruns",
+                json={
+                    "project_id": project_id,
+                    "short_code": f"INGEST_{station}",
+                    "dut_id": "bench",
+                    "machine_hostname": f"station-{station}",
+                    "user_name": "bench",
+                    "test_name": "ingest",
+                },
+            )
+            run_id = r.json()["id"]
+            setup = {
+                "steps": [{"sequence_number": i, "setpoint": float(i)} for i in range(steps)],
+                "columns": {"setpoint": {"measurement_unit": "V"}},
+            }
+            await client.post(f"/api/testruns/setup/{run_id}", json=setup)
+            await client.put(f"/api/testruns/start/{run_id}")
+            run_ids.append(run_id)
+
+        async def station(run_id: int) -> None:
+            for i in range(steps):
+                r = await client.post(
+                    "/api/measurement_entries/batch",
+                    json={
+                        "testrun_id": run_id,
+                        "sequence_number": i,
+                        "payload": {f"value_{c}": i * 0.1 + c for c in range(columns)},
+                    },
+                )
+                assert r.status_code == 201, r.text
+
+        ingest_done = asyncio.Event()
+        export_latencies: list[float] = []
+
+        async def exporter() -> None:
+            while not ingest_done.is_set():
+                start = time.perf_counter()
+                r = await client.get(f"/api/testruns/measurements/{run_ids[0]}?format=csv")
+                assert r.status_code == 200, r.text
+                export_latencies.append(time.perf_counter() - start)
+
+        exporting = asyncio.create_task(exporter())
+
+        start = time.perf_counter()
+        await asyncio.gather(*[station(run_id) for run_id in run_ids])
+        ingest = time.perf_counter() - start
+
+        ingest_done.set()
+        await exporting
+
+        start = time.perf_counter()
+        for fmt in ["json", "csv", "parquet"]:
+            r = await client.get(f"/api/testruns/measurements/{run_ids[0]}?format={fmt}")
+            assert r.status_code == 200
+        export = (time.perf_counter() - start) / 3
+
+    entries = stations * steps * columns
+    print(f"profile:  {PRAGMA_PROFILE}")
+    print(f"ingest:   {stations} stations x {steps} steps x {columns} columns in {ingest:.3f} s "
+          f"({stations * steps / ingest:.0f} requests/s, {entries / ingest:.0f} entries/s)")
+    print(f"export:   {export:.3f} s per format for {steps * columns} entries")
+    export_latencies.sort()
+    print(f"exports during ingest: {len(export_latencies)}, "
+          f"median {export_latencies[len(export_latencies) // 2]:.3f} s, max {export_latencies[-1]:.3f} s")
+
+    await reader_engine.dispose()
+    await engine.dispose()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    args = [int(n) for n in sys.argv[1:]]
+    asyncio.run(main(*(args + [8, 500, 20][len(args):])))
@@ -0,0 +1,85 @@
+"""
+Measures listing testruns through the API: all runs at once, and single pages of a paginated list at
+the start and deep into it, with and without a filter.
+
+    python benchmarks/bench_list_testruns.py [runs] [page size]
+
+Trees without pagination ignore the page parameters, the page timings then show the full list too.
+"""
+
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+
+def fill(path: str, runs: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO users (id, subject, displayname, groups, roles, disabled) "
+        "VALUES (1, 'bench', 'bench', '[]', '[]', 0)"
+    )
+    conn.execute("INSERT INTO projects (id, short_code, name, groups, user_id) VALUES (1, 'BENCH', 'bench', '[]', 1)")
+    conn.executemany(
+        "INSERT INTO testruns (id, short_code, dut_id, machine_hostname, user_name, test_name, state, project_id, "
+        "user_id, data) VALUES (?, ?, ?, 'bench', 'bench', 'list', 'COMPLETE', 1, 1, '{}')",
+        ((i + 1, f"RUN_{i}", f"device_{i % 100}") for i in range(runs)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def main(runs: int, page_size: int) -> None:
+    # the database needs to be configured before edea_ms.db gets imported
+    tmp = tempfile.TemporaryDirectory()
+    path = f"{tmp.name}/bench.sqlite"
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+
+    from httpx import ASGITransport, AsyncClient
+
+    from edea_ms.db import engine, reader_engine
+    from edea_ms.db.models import Model
+    from edea_ms.main import app
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all)
+
+    fill(path, runs)
+
+    transport = ASGITransport(app=app)  # type: ignore
+    async with AsyncClient(
+        transport=transport, base_url="http://bench", headers={"X-Webauth-User": "bench"}, timeout=None
+    ) as client:
+
+        async def timed(url: str, repeat: int = 5) -> tuple[float, int]:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                r = await client.get(url)
+                times.append(time.perf_counter() - start)
+                assert r.status_code == 200, r.text
+            return statistics.median(times), len(r.json())
+
+        cases = {
+            "all runs": "/api/testruns",
+            "first page": f"/api/testruns?limit={page_size}",
+            "deep page": f"/api/testruns?limit={page_size}&after={runs * 9 // 10}",
+            "filtered page": f"/api/testruns?limit={page_size}&dut_id=device_7&after={runs // 2}",
+        }
+        # warm up
+        await client.get("/api/testruns?limit=1")
+        for name, url in cases.items():
+            elapsed, items = await timed(url, 1 if name == "all runs" else 5)
+            print(f"{name}: {items} runs in {elapsed * 1000:.1f} ms")
+
+    await reader_engine.dispose()
+    await engine.dispose()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    args = [int(n) for n in sys.argv[1:]]
+    asyncio.run(main(*(args + [100_000, 100][len(args):])))
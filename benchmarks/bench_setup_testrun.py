@@ -0,0 +1,72 @@
+"""
+Measures how long setting up a testrun takes depending on the number of steps.
+
+    python benchmarks/bench_setup_testrun.py [step counts...]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+CONDITIONS = 8
+
+
+async def main(step_counts: list[int]) -> None:
+    # the database needs to be configured before edea_ms.db gets imported
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tmp.name}/bench.sqlite"
+
+    from edea_ms.db import engine
+    from edea_ms.db.models import Model
+    from edea_ms.main import app
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all)
+
+    transport = ASGITransport(app=app)  # type: ignore
+    async with AsyncClient(
+        transport=transport, base_url="http://bench", headers={"X-Webauth-User": "bench"}
+    ) as client:
+        r = await client.post("/api/projects", json={"short_code": "BENCH", "name": "bench", "groups": []})
+        project_id = r.json()["id"]
+
+        print(f"{'steps':>8} {'conditions':>11} {'seconds':>9}")
+        for steps in step_counts:
+            r = await client.post(
+                "/api/testruns",
+                json={
+                    "project_id": project_id,
+                    "short_code": f"SETUP_{steps}",
+                    "dut_id": "bench",
+                    "machine_hostname": "bench",
+                    "user_name": "bench",
+                    "test_name": f"setup {steps}",
+                },
+            )
+            testrun_id = r.json()["id"]
+
+            setup = {
+                "steps": [
+                    {"sequence_number": i, **{f"cond_{c}": float(i * c) for c in range(CONDITIONS)}}
+                    for i in range(steps)
+                ],
+                "columns": {f"cond_{c}": {"measurement_unit": "V"} for c in range(CONDITIONS)},
+            }
+
+            start = time.perf_counter()
+            r = await client.post(f"/api/testruns/setup/{testrun_id}", json=setup)
+            elapsed = time.perf_counter() - start
+            assert r.status_code == 200, r.text
+
+            print(f"{steps:>8} {steps * CONDITIONS:>11} {elapsed:>9.3f}")
+
+    await engine.dispose()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(n) for n in sys.argv[1:]] or [100, 1000, 5000, 10000]))
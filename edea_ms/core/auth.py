@@ -1,18 +1,25 @@
+import hashlib
 import os
+import time
 from contextvars import ContextVar
-from typing import Annotated
+from typing import Annotated, Any
 
 import jwt
 from fastapi import Depends, HTTPException, status
-from jwt import InvalidTokenError, MissingRequiredClaimError, PyJWKClient
+from jwt import InvalidTokenError, MissingRequiredClaimError, PyJWKClientError
 from sqlalchemy import select
-from sqlalchemy.exc import MultipleResultsFound
+from sqlalchemy.exc import IntegrityError, MultipleResultsFound
+from sqlalchemy.orm import make_transient_to_detached
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.requests import Request
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
 from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.websockets import WebSocketClose
 
-from edea_ms.db import async_session
+from edea_ms.core.cache import LRUCache
+from edea_ms.core.jwks import AsyncJWKSClient
+from edea_ms.db import current_session_scope
 from edea_ms.db.models import User
 
 REQUEST_USER_CTX_KEY = "request_user"
@@ -21,8 +28,22 @@ _request_user_ctx_var: ContextVar[User | None] = ContextVar(
     REQUEST_USER_CTX_KEY, default=None
 )
 
-jwks_client = PyJWKClient(
-    os.getenv("JWKS_URL", "http://test/.well-known/jwks.json"), cache_keys=True
+# (subject, groups, roles) -> column values of the user, any change of the identity is a cache miss.
+# other workers may change a user too, e.g. disable it, the ttl bounds how long that goes unnoticed.
+user_cache: LRUCache[tuple[str, tuple[str, ...], tuple[str, ...]], dict[str, Any]] = LRUCache(
+    "users",
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+)
+
+jwks_client = AsyncJWKSClient(
+    os.getenv("JWKS_URL", "http://test/.well-known/jwks.json"),
+    refresh_interval=float(os.getenv("JWKS_REFRESH_INTERVAL", "300")),
+)
+
+# sha256 of a token -> its verified claims, used until the token expires
+claims_cache: LRUCache[bytes, dict[str, Any]] = LRUCache(
+    "jwt_claims", maxsize=int(os.getenv("JWT_CLAIMS_CACHE_SIZE", "1024"))
 )
 
 credentials_exception = HTTPException(
@@ -105,7 +126,12 @@ async def manage_user_data(
             disabled=False,
         )
         session.add(u)
-        await session.commit()
+        try:
+            await session.commit()
+        except IntegrityError:
+            # another worker created the user at the same time
+            await session.rollback()
+            return await manage_user_data(session, username, displayname, groups, roles)
     elif u.groups != groups or u.roles != roles:
         u.groups = MutableList(groups)
         u.roles = MutableList(roles)
@@ -115,8 +141,12 @@ async def manage_user_data(
     return u
 
 
+def _copy_lists(values: dict[str, Any]) -> dict[str, Any]:
+    return {k: list(v) if isinstance(v, list) else v for k, v in values.items()}
+
+
 async def get_current_user(
-    request: Request,
+    request: HTTPConnection,
     token: str | None = None,
     authorization: str | None = None,
     x_webauth_user: str | None = None,
@@ -167,31 +197,80 @@ async def get_current_user(
                 # use token or authentication header, strip off "Bearer " part for header
                 p_tok = token or authorization.split(" ")[-1] if authorization else ""
 
-                groups, roles, username = _parse_jwt(p_tok)
+                groups, roles, username = await _parse_jwt(p_tok)
 
-    async with async_session() as session:
-        return await manage_user_data(session, username, displayname, groups, roles)
+    key = (username, tuple(groups), tuple(roles))
+    if (values := user_cache.get(key)) is None:
+        u = await _load_user(request, username, displayname, groups, roles)
+        user_cache.put(key, _copy_lists({c.key: getattr(u, c.key) for c in User.__table__.columns}))
+        return u
+
+    # every request gets its own detached instance and lists, routes can't change the cached ones
+    u = User(**_copy_lists(values))
+    make_transient_to_detached(u)
+    return u
 
 
-def _parse_jwt(token: str) -> tuple[list[str], list[str], str]:
+async def _load_user(
+    request: HTTPConnection,
+    username: str,
+    displayname: str,
+    groups: list[str],
+    roles: list[str],
+) -> User:
+    # most requests come from known users, the lookup shares the read session with the route and only
+    # goes through the writer if something changed
+    scope = current_session_scope()
+    session = scope.reader()
     try:
-        signing_key = jwks_client.get_signing_key_from_jwt(token)
-        payload = jwt.decode(
-            token,
-            signing_key.key,
-            algorithms=["HS256", "ES256", "ES256K", "EdDSA"],
-            options={"require": ["exp", "iss", "sub", "groups"]},
-        )
-        # sub and groups are required for decoding, should always be some
-        username = payload.get("sub") or ""
-
-        # groups and roles are registered claims according to RFC 9068
-        groups = payload.get("groups") or []
-        roles = payload.get("roles") or []
-    except MissingRequiredClaimError as e:
-        raise claims_exception from e
-    except InvalidTokenError as e:
-        raise credentials_exception from e
+        u = (
+            await session.scalars(select(User).where(User.subject == username))
+        ).one_or_none()
+    except MultipleResultsFound:
+        u = None  # manage_user_data reports it
+
+    if u is None or u.groups != groups or u.roles != roles:
+        session = scope.writer()
+        u = await manage_user_data(session, username, displayname, groups, roles)
+
+    # the user outlives the transactions of the route
+    session.expunge(u)
+
+    if request.scope.get("method") not in ("GET", "HEAD"):
+        # only GET routes continue on the read session, don't hold on to its connection otherwise
+        await scope.reader().close()
+
+    return u
+
+
+async def _parse_jwt(token: str) -> tuple[list[str], list[str], str]:
+    token_hash = hashlib.sha256(token.encode()).digest()
+    payload = claims_cache.get(token_hash)
+
+    # repeated requests with the same token skip the signature verification until it expires
+    if payload is None or payload["exp"] <= time.time():
+        try:
+            signing_key = await jwks_client.get_signing_key_from_jwt(token)
+            payload = jwt.decode(
+                token,
+                signing_key.key,
+                algorithms=["HS256", "ES256", "ES256K", "EdDSA"],
+                options={"require": ["exp", "iss", "sub", "groups"]},
+            )
+        except MissingRequiredClaimError as e:
+            raise claims_exception from e
+        except (InvalidTokenError, PyJWKClientError) as e:
+            raise credentials_exception from e
+
+        claims_cache.put(token_hash, payload)
+
+    # sub and groups are required for decoding, should always be some
+    username = payload.get("sub") or ""
+
+    # groups and roles are registered claims according to RFC 9068
+    groups = payload.get("groups") or []
+    roles = payload.get("roles") or []
+
     return groups, roles, username
 
 
@@ -213,7 +292,7 @@ class AuthenticationMiddleware:
             await self.app(scope, receive, send)
             return
 
-        request = Request(scope)
+        request = HTTPConnection(scope)
 
         authorization = request.headers.get("authorization")
         x_webauth_user = request.headers.get("x-webauth-user")
@@ -221,14 +300,24 @@ class AuthenticationMiddleware:
         x_webauth_roles = request.headers.getlist("x-webauth-roles")
         token = request.cookies.get("token")
 
-        u = await get_current_user(
-            request,
-            token,
-            authorization,
-            x_webauth_user,
-            x_webauth_groups,
-            x_webauth_roles,
-        )
+        try:
+            u = await get_current_user(
+                request,
+                token,
+                authorization,
+                x_webauth_user,
+                x_webauth_groups,
+                x_webauth_roles,
+            )
+        except HTTPException as e:
+            # we're outside of FastAPI's exception handling here
+            response: ASGIApp
+            if scope["type"] == "websocket":
+                response = WebSocketClose(status.WS_1008_POLICY_VIOLATION, str(e.detail))
+            else:
+                response = JSONResponse({"detail": e.detail}, e.status_code, e.headers)
+            await response(scope, receive, send)
+            return
         ctx_token = _request_user_ctx_var.set(u)
 
         await self.app(scope, receive, send)
@@ -0,0 +1,123 @@
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Protocol, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class Cache(Protocol):
+    name: str
+
+    def clear(self) -> None: ...
+
+    def stats(self) -> dict[str, int]: ...
+
+
+# all caches register themselves here so they can be listed and cleared together
+_caches: "weakref.WeakValueDictionary[str, Cache]" = weakref.WeakValueDictionary()
+
+
+def register_cache(cache: Cache) -> None:
+    _caches[cache.name] = cache
+
+
+class LRUCache(Generic[K, V]):
+    """
+    LRUCache is a small bounded in-process cache which evicts the least recently used entries
+    first. With a ttl, entries also expire that many seconds after they were put. With maxbytes,
+    entries are also evicted once the sizes of all values (as returned by sizeof) add up to more.
+    It keeps hit and miss counters so the effectiveness of a cache can be monitored.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = 1024,
+        ttl: float | None = None,
+        maxbytes: int | None = None,
+        sizeof: Callable[[V], int] = len,  # type: ignore[assignment]
+    ) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self._expires: dict[K, float] = {}
+        self._sizes: dict[K, int] = {}
+        self._bytes = 0
+
+        register_cache(self)
+
+    def get(self, key: K) -> V | None:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        if self.ttl is not None and self._expires[key] < time.monotonic():
+            self.pop(key)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self.pop(key)
+        self._data[key] = value
+        if self.ttl is not None:
+            self._expires[key] = time.monotonic() + self.ttl
+        if self.maxbytes is not None:
+            self._sizes[key] = self.sizeof(value)
+            self._bytes += self._sizes[key]
+
+        while len(self._data) > self.maxsize or (self.maxbytes is not None and self._bytes > self.maxbytes):
+            self.pop(next(iter(self._data)))
+
+    def pop(self, key: K) -> V | None:
+        self._expires.pop(key, None)
+        self._bytes -= self._sizes.pop(key, 0)
+        return self._data.pop(key, None)
+
+    def invalidate(self, predicate: Callable[[K], bool]) -> None:
+        for key in [k for k in self._data if predicate(k)]:
+            self.pop(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._expires.clear()
+        self._sizes.clear()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, int]:
+        stats = {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+        if self.maxbytes is not None:
+            stats |= {"bytes": self._bytes, "maxbytes": self.maxbytes}
+        return stats
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def clear_caches() -> None:
+    """
+    clear_caches empties all registered caches, e.g. when the database they're derived from changes.
+    """
+    for cache in _caches.values():
+        cache.clear()
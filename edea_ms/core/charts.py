@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Awaitable, Callable, NamedTuple
+
+import polars as pl
+
+from edea_ms.core.cache import LRUCache
+from edea_ms.core.downsample import decimate
+from edea_ms.core.vegalite import evaluate_transforms, project
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(64 * 1024**2)))
+
+# the plotting libraries are only imported by the render processes
+has_altair = importlib.util.find_spec("altair") is not None
+has_vl_convert = importlib.util.find_spec("vl_convert") is not None
+
+
+class ChartKey(NamedTuple):
+    run_id: int
+    spec_hash: str
+    data_version: str
+    data_format: str
+    dpi: int
+    # 0 plots all points
+    max_points: int = 0
+    x: str = "sequence_number"
+
+
+class Chart(NamedTuple):
+    content: bytes
+    decimated_rows: int
+
+
+def spec_hash(spec: dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def _prepare(spec: dict[str, Any], df: pl.DataFrame, key: ChartKey) -> tuple[dict[str, Any], pl.DataFrame, int]:
+    spec, df = evaluate_transforms(spec, df)
+    rows = df.height
+    plotted = project(spec, df)
+    if key.max_points:
+        # only the plotted series are decimated, the extremes of the other columns would keep most rows
+        if key.x not in df.columns:
+            raise ValueError(f"unknown x field {key.x!r}")
+        extra = [] if key.x in plotted.columns else [df[key.x]]
+        plotted = decimate(plotted.with_columns(extra), key.max_points, key.x)
+        plotted = plotted.drop([s.name for s in extra])
+    return spec, plotted, rows - plotted.height
+
+
+def _render(spec: dict[str, Any], df: pl.DataFrame, data_format: str, dpi: int) -> bytes:
+    import altair as alt
+
+    try:
+        chart = alt.Chart.from_dict(spec)
+    except Exception as e:
+        # the validation errors of altair can't be pickled to be sent back to the server
+        raise ValueError(f"invalid vega-lite chart specification: {e}") from None
+    chart.data = df
+
+    if data_format == "png":
+        out = io.BytesIO()
+        chart.save(fp=out, format="png", ppi=dpi)
+        return out.getvalue()
+
+    text = io.StringIO()
+    chart.save(fp=text, format=data_format)
+    return text.getvalue().encode()
+
+
+class ChartRenderer:
+    """
+    ChartRenderer renders vega-lite charts in a pool of worker processes so that a slow render doesn't block
+    the event loop. The rendered charts are kept in a cache bounded by their size, concurrent requests for the
+    same chart wait for a single render.
+    """
+
+    def __init__(self, workers: int, max_bytes: int) -> None:
+        self.workers = workers
+        self.cache: LRUCache[ChartKey, Chart] = LRUCache(
+            "rendered_charts", maxsize=4096, maxbytes=max_bytes, sizeof=lambda chart: len(chart.content)
+        )
+        self.renders = 0
+        # bumped on every invalidation, charts rendered from data read before aren't cached
+        self.generation = 0
+        self._pool: Executor | None = None
+        self._pending: dict[ChartKey, asyncio.Task[Chart]] = {}
+
+    def _executor(self) -> Executor:
+        if self._pool is None:
+            # spawned workers don't inherit the event loop, database connections or threads of the server
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def _render(
+        self,
+        key: ChartKey,
+        spec: dict[str, Any],
+        load: Callable[[], Awaitable[pl.DataFrame]],
+    ) -> Chart:
+        generation = self.generation
+        try:
+            # only the data the chart shows is sent to the render process and embedded in the chart
+            spec, df, decimated = await asyncio.to_thread(_prepare, spec, await load(), key)
+            content = await self._run(spec, df, key)
+            self.renders += 1
+            chart = Chart(content, decimated)
+            if generation == self.generation:
+                self.cache.put(key, chart)
+            return chart
+        finally:
+            del self._pending[key]
+
+    async def _submit(self, spec: dict[str, Any], df: pl.DataFrame, key: ChartKey) -> bytes:
+        pool = self._executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                pool, _render, spec, df, key.data_format, key.dpi
+            )
+        except BrokenProcessPool:
+            # a worker died, e.g. killed for running out of memory, the pool can't be used anymore
+            if self._pool is pool:
+                self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    async def _run(self, spec: dict[str, Any], df: pl.DataFrame, key: ChartKey) -> bytes:
+        try:
+            return await self._submit(spec, df, key)
+        except BrokenProcessPool:
+            # once more in a new pool, a chart which breaks that one too fails
+            return await self._submit(spec, df, key)
+
+    async def render(
+        self,
+        key: ChartKey,
+        spec: dict[str, Any],
+        load: Callable[[], Awaitable[pl.DataFrame]],
+    ) -> Chart:
+        """
+        render returns the chart for key from the cache, or loads its data and renders it. The key needs to
+        change with the data, e.g. by including its data version.
+        """
+        if (chart := self.cache.get(key)) is not None:
+            return chart
+
+        if key not in self._pending:
+            self._pending[key] = asyncio.get_running_loop().create_task(self._render(key, spec, load))
+
+        # shield so a cancelled request doesn't cancel the render for everyone else
+        return await asyncio.shield(self._pending[key])
+
+    def invalidate(self, run_id: int) -> None:
+        self.generation += 1
+        self.cache.invalidate(lambda key: key.run_id == run_id)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.cache.clear()
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+chart_renderer = ChartRenderer(RENDER_WORKERS, RENDER_CACHE_MAX_BYTES)
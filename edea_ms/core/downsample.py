@@ -0,0 +1,56 @@
+import polars as pl
+
+_ROW = "__row"
+_BUCKET = "__bucket"
+
+
+def decimate(df: pl.DataFrame, max_points: int, x: str = "sequence_number") -> pl.DataFrame:
+    """
+    decimate reduces a frame for plotting to at most max_points rows along x. The rows are split into buckets
+    of consecutive x values, of each bucket the first and last row and the rows with the minimum and maximum of
+    every numeric series are kept (M4 aggregation). A line drawn through the kept rows looks the same as one
+    through all of them, peaks and spikes included.
+
+    A bucket keeps up to 2 + 2 * series rows, so the more numeric series a frame has, the fewer buckets fit into
+    max_points. There's always at least one bucket, with too many series for max_points the first and last row
+    and the extremes of every series are kept, which can be more rows.
+
+    Whole rows are kept, so every kept row still has the values of all columns. Rows without an x value
+    can't be placed along x and are kept as they are, in addition to max_points.
+    """
+    if x not in df.columns:
+        raise ValueError(f"unknown x field {x!r}")
+    if max_points < 4:
+        raise ValueError("max_points needs to be at least 4")
+    if df.height <= max_points:
+        return df
+
+    series = [name for name, dtype in df.schema.items() if name != x and dtype.is_numeric()]
+
+    lf = df.lazy().with_row_index(_ROW)
+    placed = lf.filter(pl.col(x).is_not_null()).sort(x, maintain_order=True)
+    buckets = max(max_points // (2 + 2 * len(series)), 1)
+    placed = placed.with_columns((pl.int_range(pl.len()) * buckets // pl.len()).alias(_BUCKET))
+
+    def extreme(name: str, value: pl.Expr) -> pl.Expr:
+        # NaN isn't plotted either
+        col = pl.col(name).fill_nan(None) if df.schema[name].is_float() else pl.col(name)
+        return pl.col(_ROW).filter(col == value(col)).first().alias(f"{name}_{value.__name__}")
+
+    keep = (
+        placed.group_by(_BUCKET)
+        .agg(
+            pl.col(_ROW).first().alias("first"),
+            pl.col(_ROW).last().alias("last"),
+            *(extreme(name, pl.Expr.min) for name in series),
+            *(extreme(name, pl.Expr.max) for name in series),
+        )
+        .drop(_BUCKET)
+        .melt()
+        .select(pl.col("value").drop_nulls().unique())
+    )
+
+    kept = placed.join(keep, left_on=_ROW, right_on="value", how="semi").drop(_BUCKET)
+    missing = lf.filter(pl.col(x).is_null())
+
+    return pl.concat([kept, missing]).drop(_ROW).collect()
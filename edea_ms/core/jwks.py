@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+from typing import Any
+
+import httpx
+import jwt
+from jwt import PyJWK, PyJWKClientError, PyJWKSet
+from jwt.exceptions import PyJWKSetError
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncJWKSClient:
+    """
+    AsyncJWKSClient fetches the signing keys of the identity provider without blocking the event loop.
+
+    Keys older than refresh_interval are still used while a background task fetches the current set
+    (stale-while-revalidate). Only a token with an unknown key id waits for a fetch, at most once per
+    min_refresh_interval so tokens with made up key ids can't be used to hammer the provider.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        refresh_interval: float = 300,
+        min_refresh_interval: float = 10,
+        timeout: float = 10,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.transport = transport
+
+        self.fetches = 0
+        self._keys: dict[str, PyJWK] = {}
+        self._fetched_at: float | None = None
+        self._refresh: asyncio.Task[None] | None = None
+
+    async def _fetch(self) -> None:
+        async with httpx.AsyncClient(transport=self.transport, timeout=self.timeout) as client:
+            r = await client.get(self.url)
+            r.raise_for_status()
+            data: dict[str, Any] = r.json()
+
+        self.fetches += 1
+        try:
+            jwk_set = PyJWKSet.from_dict(data)
+        except PyJWKSetError:
+            jwk_set = None  # the set is empty or has no usable keys
+
+        self._keys = {k.key_id: k for k in jwk_set.keys if k.key_id} if jwk_set else {}
+        self._fetched_at = time.monotonic()
+
+    async def _run_refresh(self) -> None:
+        try:
+            await self._fetch()
+        except (httpx.HTTPError, ValueError) as e:
+            # keep the keys we have, count the attempt so retries are rate limited while the provider is down
+            self._fetched_at = time.monotonic()
+            logger.warning("could not refresh JWKS from %s: %s", self.url, e)
+
+    def refresh(self) -> asyncio.Task[None]:
+        """
+        refresh starts fetching the key set unless a fetch is already running and returns its task.
+        """
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.get_running_loop().create_task(self._run_refresh())
+        return self._refresh
+
+    def _age(self) -> float:
+        return float("inf") if self._fetched_at is None else time.monotonic() - self._fetched_at
+
+    async def get_signing_key(self, kid: str) -> PyJWK:
+        if kid not in self._keys and self._age() >= self.min_refresh_interval:
+            # shield so a cancelled request doesn't cancel the fetch for everyone else
+            await asyncio.shield(self.refresh())
+        elif self._age() >= self.refresh_interval:
+            self.refresh()
+
+        try:
+            return self._keys[kid]
+        except KeyError:
+            raise PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"') from None
+
+    async def get_signing_key_from_jwt(self, token: str) -> PyJWK:
+        header = jwt.get_unverified_header(token)
+        return await self.get_signing_key(header.get("kid") or "")
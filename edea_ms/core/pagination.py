@@ -0,0 +1,45 @@
+import os
+from typing import Annotated, Any, Callable, Sequence, TypeVar
+
+from fastapi import Query, Request, Response
+from sqlalchemy import Select
+from sqlalchemy.orm import InstrumentedAttribute
+
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+T = TypeVar("T", bound=tuple[Any, ...])
+M = TypeVar("M")
+
+# without a limit all (matching) items are returned at once, like before pagination
+Limit = Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE, description="maximum number of items of a page")]
+After = Annotated[int | None, Query(description="id of the last item of the previous page")]
+
+
+def paginate(q: Select[T], id_column: InstrumentedAttribute[int], after: int | None, limit: int | None) -> Select[T]:
+    """
+    paginate orders a query by id and selects the page after the given id (keyset pagination). One item more
+    than the limit is selected to tell whether there's another page, next_page removes it again.
+    """
+    if after is not None:
+        q = q.where(id_column > after)
+    q = q.order_by(id_column)
+    return q if limit is None else q.limit(limit + 1)
+
+
+def next_page(
+    request: Request, response: Response, items: Sequence[M], limit: int | None, cursor: Callable[[M], int]
+) -> Sequence[M]:
+    """
+    next_page returns the items of the page selected with paginate. If there are more, the cursor for the next page
+    is set as X-Next-Cursor header and the link to it as Link header with rel="next".
+    """
+    if limit is None or len(items) <= limit:
+        return items
+
+    items = items[:limit]
+    after = cursor(items[-1])
+    url = request.url.include_query_params(after=after)
+    response.headers["X-Next-Cursor"] = str(after)
+    response.headers["Link"] = f'<{url.path}?{url.query}>; rel="next"'
+
+    return items
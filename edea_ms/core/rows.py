@@ -0,0 +1,59 @@
+from typing import Any, Generic, Mapping, Sequence, TypeVar
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing_extensions import TypedDict
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class RawJSONResponse(Response):
+    """
+    RawJSONResponse sends content that's already encoded as JSON, like an ORJSONResponse with the encoding
+    done beforehand.
+    """
+
+    media_type = "application/json"
+
+
+class Rows(Generic[M]):
+    """
+    Rows reads the columns for the fields of a response model and encodes the rows to JSON in the shape of a
+    list of that model, without an ORM instance or model instance per row. Rows read from the database are
+    trusted, so they're only serialised with the model's field types and not validated.
+
+    Routes using it return the RawJSONResponse and declare the model as response_model for the API schema.
+    """
+
+    def __init__(self, model: type[M], entity: type[Any]) -> None:
+        fields = {name: field.annotation for name, field in model.model_fields.items()}
+        self.model = model
+        self.columns = [getattr(entity, name) for name in fields]
+        row = TypedDict(f"{model.__name__}Row", fields)  # type: ignore[misc]
+        self._adapter: TypeAdapter[list[Any]] = TypeAdapter(list[row])  # type: ignore[valid-type]
+
+    def select(self, q: Select[Any]) -> Select[Any]:
+        """
+        select replaces the selected entity of a query with the columns of the model's fields.
+        """
+        return q.with_only_columns(*self.columns)
+
+    async def all(self, session: AsyncSession, q: Select[Any]) -> list[dict[str, Any]]:
+        result = await session.execute(self.select(q))
+        keys = list(result.keys())
+        return [dict(zip(keys, row)) for row in result]
+
+    def dump_json(self, rows: Sequence[Mapping[str, Any]]) -> bytes:
+        return self._adapter.dump_json(rows)
+
+    def response(self, rows: Sequence[Mapping[str, Any]], response: Response | None = None) -> RawJSONResponse:
+        """
+        response encodes the rows as response, with the headers set on the response of the route, e.g. by
+        next_page.
+        """
+        raw = RawJSONResponse(self.dump_json(rows))
+        if response is not None:
+            raw.headers.raw.extend(response.headers.raw)
+        return raw
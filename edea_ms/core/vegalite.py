@@ -0,0 +1,345 @@
+import math
+from typing import Any, Callable
+
+import polars as pl
+
+
+class Unsupported(Exception):
+    """
+    Unsupported is raised for transforms (or parameters of them) which can't be evaluated with polars the way
+    vega-lite would evaluate them.
+    """
+
+
+def _column(df: pl.DataFrame, field: Any) -> str:
+    if not isinstance(field, str):
+        raise Unsupported(f"field {field!r}")
+
+    # dots and brackets access nested values in vega-lite unless they're escaped
+    name = field.replace("\\.", ".").replace("\\[", "[").replace("\\]", "]")
+    if name not in df.columns:
+        raise Unsupported(f"unknown field {field!r}")
+    return name
+
+
+def _literal(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    # date times, expressions and parameters
+    raise Unsupported(f"value {value!r}")
+
+
+def _compare(df: pl.DataFrame, name: str, value: Any) -> pl.Expr:
+    col = pl.col(name)
+    # javascript compares null like 0 with numbers
+    if df.schema[name].is_numeric() and isinstance(value, (int, float)) and not isinstance(value, bool):
+        col = col.fill_null(0)
+    return col
+
+
+def _predicate(df: pl.DataFrame, p: Any) -> pl.Expr:
+    # javascript comparisons are never null
+    return _field_predicate(df, p).fill_null(False)
+
+
+def _field_predicate(df: pl.DataFrame, p: Any) -> pl.Expr:
+    if not isinstance(p, dict):
+        # expression strings would need a vega expression parser
+        raise Unsupported(f"predicate {p!r}")
+
+    if "and" in p:
+        return pl.all_horizontal([_predicate(df, q) for q in p["and"]])
+    if "or" in p:
+        return pl.any_horizontal([_predicate(df, q) for q in p["or"]])
+    if "not" in p:
+        return ~_predicate(df, p["not"])
+
+    if set(p) - {"field", "equal", "lt", "lte", "gt", "gte", "range", "oneOf", "valid"} or len(p) != 2:
+        raise Unsupported(f"predicate {p!r}")
+
+    name = _column(df, p.get("field"))
+    col = pl.col(name)
+    if "equal" in p:
+        return col == _literal(p["equal"])
+    if "oneOf" in p:
+        values = [_literal(v) for v in p["oneOf"]]
+        if None in values:
+            raise Unsupported(f"predicate {p!r}")
+        return col.is_in(values)
+    if "valid" in p:
+        valid = col.is_not_null()
+        if df.schema[name].is_float():
+            valid &= col.is_not_nan()
+        return valid if p["valid"] else ~valid
+    if "range" in p:
+        low, high = (_literal(v) for v in p["range"])
+        expr = pl.lit(True)
+        if low is not None:
+            expr &= _compare(df, name, low) >= low
+        if high is not None:
+            expr &= _compare(df, name, high) <= high
+        return expr
+
+    op, value = next((k, _literal(v)) for k, v in p.items() if k != "field")
+    col = _compare(df, name, value)
+    return {"lt": col < value, "lte": col <= value, "gt": col > value, "gte": col >= value}[op]
+
+
+def _filter(df: pl.DataFrame, t: dict[str, Any]) -> pl.DataFrame:
+    return df.filter(_predicate(df, t["filter"]))
+
+
+_aggregates: dict[str, Callable[[pl.Expr], pl.Expr]] = {
+    "sum": lambda c: c.sum(),
+    "mean": lambda c: c.mean(),
+    "average": lambda c: c.mean(),
+    "median": lambda c: c.median(),
+    "min": lambda c: c.min(),
+    "max": lambda c: c.max(),
+    "stdev": lambda c: c.std(),
+    "stdevp": lambda c: c.std(ddof=0),
+    "variance": lambda c: c.var(),
+    "variancep": lambda c: c.var(ddof=0),
+    "q1": lambda c: c.quantile(0.25, interpolation="linear"),
+    "q3": lambda c: c.quantile(0.75, interpolation="linear"),
+}
+
+
+def _aggregate(df: pl.DataFrame, t: dict[str, Any]) -> pl.DataFrame:
+    if set(t) - {"aggregate", "groupby"}:
+        raise Unsupported(f"aggregate {t!r}")
+
+    exprs = []
+    for a in t["aggregate"]:
+        op, alias = a.get("op"), a.get("as")
+        if not isinstance(alias, str):
+            raise Unsupported(f"aggregate {a!r}")
+        if op == "count":
+            exprs.append(pl.len().alias(alias))
+            continue
+
+        name = _column(df, a.get("field"))
+        col = pl.col(name)
+        # vega only aggregates valid values, NaN is as invalid as null
+        if df.schema[name].is_float():
+            col = col.fill_nan(None)
+
+        if op == "valid":
+            exprs.append(col.count().alias(alias))
+        elif op == "missing":
+            exprs.append(col.null_count().alias(alias))
+        elif op == "distinct":
+            exprs.append(pl.col(name).n_unique().alias(alias))
+        elif op in _aggregates and df.schema[name].is_numeric():
+            exprs.append(_aggregates[op](col).alias(alias))
+        else:
+            raise Unsupported(f"aggregate {a!r}")
+
+    groupby = [_column(df, f) for f in t.get("groupby", [])]
+    if not groupby:
+        return df.select(exprs)
+    return df.group_by(groupby, maintain_order=True).agg(exprs)
+
+
+def _bin_extent(params: dict[str, Any], low: float, high: float) -> tuple[float, float, float]:
+    """
+    _bin_extent returns start, stop and step of the bins the same way as vega-statistics' bin.
+    """
+    maxbins = params.get("maxbins", 10)
+    base = params.get("base", 10)
+    divide = params.get("divide", [5, 2])
+    minstep = params.get("minstep", 0)
+    logb = math.log(base)
+    span = (high - low) or abs(low) or 1
+
+    if "step" in params:
+        step = params["step"]
+    elif "steps" in params:
+        steps = params["steps"]
+        i = 0
+        while i < len(steps) and steps[i] < span / maxbins:
+            i += 1
+        step = steps[max(0, i - 1)]
+    else:
+        level = math.ceil(math.log(maxbins) / logb)
+        step = max(minstep, base ** (_js_round(math.log(span) / logb) - level))
+        while math.ceil(span / step) > maxbins:
+            step *= base
+        for d in divide:
+            v = step / d
+            if v >= minstep and span / v <= maxbins:
+                step = v
+
+    v = math.log(step)
+    precision = 0 if v >= 0 else int(-v / logb) + 1
+    eps = base ** (-precision - 1)
+    if params.get("nice", True):
+        v = math.floor(low / step + eps) * step
+        low = v - step if low < v else v
+        high = math.ceil(high / step) * step
+
+    return low, high if high != low else low + step, step
+
+
+def _js_round(x: float) -> int:
+    # Math.round rounds halves up, python's round to even
+    return math.floor(x + 0.5)
+
+
+def _bin(df: pl.DataFrame, t: dict[str, Any]) -> pl.DataFrame:
+    if set(t) - {"bin", "field", "as"}:
+        raise Unsupported(f"bin {t!r}")
+
+    params = {} if t["bin"] is True else t["bin"]
+    if not isinstance(params, dict) or set(params) - {
+        "maxbins", "base", "divide", "minstep", "step", "steps", "nice", "anchor", "extent"
+    }:
+        raise Unsupported(f"bin {t!r}")
+
+    name = _column(df, t.get("field"))
+    if not df.schema[name].is_numeric():
+        raise Unsupported(f"bin of {name!r}")
+    alias = t["as"]
+    start_name, end_name = (alias, f"{alias}_end") if isinstance(alias, str) else alias
+
+    col = pl.col(name).cast(pl.Float64).fill_nan(None)
+    if "extent" in params:
+        low, high = (_literal(v) for v in params["extent"])
+    else:
+        low, high = df.select(col.min().alias("low"), col.max().alias("high")).row(0)
+    if not isinstance(low, (int, float)) or not isinstance(high, (int, float)):
+        raise Unsupported(f"bin of {name!r} without an extent")
+
+    start, stop, step = _bin_extent(params, low, high)
+    stop = start + math.ceil((stop - start) / step) * step
+    if (anchor := params.get("anchor")) is not None:
+        d = anchor - (start + step * math.floor((anchor - start) / step))
+        start += d
+        stop += d
+
+    # same as vega's Bin transform, values outside the extent end up in infinite bins
+    clamped = pl.max_horizontal(pl.lit(start), pl.min_horizontal(col, pl.lit(stop - step)))
+    bin_start = (
+        pl.when(col.is_null())
+        .then(None)
+        .when(col < start)
+        .then(-math.inf)
+        .when(col > stop)
+        .then(math.inf)
+        .otherwise(start + step * (1e-14 + (clamped - start) / step).floor())
+    )
+    return df.with_columns(bin_start.alias(start_name)).with_columns(
+        (pl.col(start_name) + step).alias(end_name)
+    )
+
+
+def _fold(df: pl.DataFrame, t: dict[str, Any]) -> pl.DataFrame:
+    if set(t) - {"fold", "as"}:
+        raise Unsupported(f"fold {t!r}")
+
+    key, value = t.get("as", ["key", "value"])
+    names = [_column(df, f) for f in t["fold"]]
+    dtypes = {df.schema[n] for n in names}
+    if len(dtypes) > 1:
+        if not all(d.is_numeric() for d in dtypes):
+            raise Unsupported(f"fold of {names!r} with different types")
+        dtypes = {pl.Float64}
+    dtype = dtypes.pop()
+
+    # one row per input row and folded field, in the order of the input rows
+    index = "__fold_row"
+    parts = [
+        df.with_row_index(index).with_columns(
+            pl.lit(t["fold"][i]).alias(key), pl.col(n).cast(dtype).alias(value), pl.lit(i).alias("__fold_field")
+        )
+        for i, n in enumerate(names)
+    ]
+    return pl.concat(parts).sort(index, "__fold_field").drop(index, "__fold_field")
+
+
+_transforms: dict[str, Callable[[pl.DataFrame, dict[str, Any]], pl.DataFrame]] = {
+    "filter": _filter,
+    "aggregate": _aggregate,
+    "bin": _bin,
+    "fold": _fold,
+}
+
+
+def _references(spec: Any, fields: set[str]) -> None:
+    if isinstance(spec, list):
+        for s in spec:
+            _references(s, fields)
+    elif isinstance(spec, dict):
+        for key, value in spec.items():
+            if key in ("data", "datasets"):
+                continue
+            if key in ("transform", "test", "expr"):
+                # derived fields or expressions can use any field
+                raise Unsupported(key)
+            if key == "tooltip" and (value is True or isinstance(value, dict) and value.get("content") == "data"):
+                # the tooltip shows all fields
+                raise Unsupported(key)
+            if key == "field":
+                if not isinstance(value, str):
+                    raise Unsupported(f"field {value!r}")
+                fields.add(value)
+            elif key == "fields" and isinstance(value, list):
+                fields.update(value)
+            else:
+                _references(value, fields)
+
+
+def _project(spec: dict[str, Any], df: pl.DataFrame) -> pl.DataFrame:
+    fields: set[str] = set()
+    _references(spec, fields)
+
+    names = []
+    for field in fields:
+        try:
+            names.append(_column(df, field))
+        except Unsupported:
+            # nested access, only the outer field is a column
+            outer = field.split(".")[0].split("[")[0]
+            names.append(_column(df, outer))
+
+    if not names:
+        # e.g. only counts, the rows still matter
+        return df
+    return df.select(c for c in df.columns if c in names)
+
+
+def evaluate_transforms(spec: dict[str, Any], df: pl.DataFrame) -> tuple[dict[str, Any], pl.DataFrame]:
+    """
+    evaluate_transforms evaluates the leading filter, aggregate, bin and fold transforms of a vega-lite
+    specification on the DataFrame and returns the specification without them. Transforms are evaluated in order
+    up to the first one that can't be evaluated here, it and all following transforms are left to vega.
+    """
+    transforms = spec.get("transform", [])
+    done = 0
+    for t in transforms:
+        kinds = [k for k in _transforms if k in t]
+        if len(kinds) != 1:
+            break
+        try:
+            df = _transforms[kinds[0]](df, t)
+        except (Unsupported, pl.exceptions.PolarsError, KeyError, TypeError, ValueError):
+            # malformed transforms are left to vega to complain about as well
+            break
+        done += 1
+
+    spec = {k: v for k, v in spec.items() if k != "transform"}
+    if done < len(transforms):
+        spec["transform"] = transforms[done:]
+
+    return spec, df
+
+
+def project(spec: dict[str, Any], df: pl.DataFrame) -> pl.DataFrame:
+    """
+    project drops the columns a vega-lite specification doesn't use. If it can't tell which ones are used, e.g.
+    because of transforms or expressions, all of them are kept.
+    """
+    try:
+        return _project(spec, df)
+    except Unsupported:
+        return df
@@ -1,12 +1,17 @@
 import contextlib
 import os
 import sys
+from contextvars import ContextVar
+from typing import Annotated, Any, AsyncIterator
 
 from alembic.command import upgrade
 from alembic.config import Config
 from alembic.migration import MigrationContext
 from alembic.script import ScriptDirectory
+from fastapi import Depends
+from sqlalchemy import URL, event, make_url
 from sqlalchemy.exc import MissingGreenlet
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
@@ -14,6 +19,9 @@ from sqlalchemy.ext.asyncio import (
     async_sessionmaker,
     create_async_engine,
 )
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from edea_ms.core.cache import clear_caches
 
 dbfile = "edea-ms.sqlite"
 default_db = f"sqlite+aiosqlite:///{dbfile}"
@@ -22,17 +30,227 @@ DATABASE_URL = os.getenv("DATABASE_URL", default_db)
 if "pytest" in sys.modules:
     DATABASE_URL = "sqlite+aiosqlite:///test.db"
 
+# named sets of pragmas applied to every SQLite connection, "sqlite" keeps the SQLite defaults
+PRAGMA_PROFILES: dict[str, dict[str, str | int]] = {
+    "sqlite": {},
+    "wal": {
+        # readers don't block the writer and vice versa, NORMAL is durable enough with WAL
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # negative values are KiB
+        "temp_store": "MEMORY",
+        # wait for locks instead of failing with "database is locked" right away
+        "busy_timeout": 5000,
+    },
+}
+
+PRAGMA_PROFILE = os.getenv("DB_PRAGMA_PROFILE", "wal")
+
+
+def sqlite_pragmas(profile: str = PRAGMA_PROFILE) -> dict[str, str | int]:
+    """
+    sqlite_pragmas returns the pragmas of a profile, single values can be overridden with
+    DB_PRAGMA_<NAME> environment variables, e.g. DB_PRAGMA_BUSY_TIMEOUT=10000.
+    """
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f"unknown DB_PRAGMA_PROFILE {profile!r}, use one of {list(PRAGMA_PROFILES)}")
+
+    pragmas = dict(PRAGMA_PROFILES[profile])
+    for name in PRAGMA_PROFILES["wal"]:
+        if (value := os.getenv(f"DB_PRAGMA_{name.upper()}")) is not None:
+            pragmas[name] = value
+
+    return pragmas
+
+
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+WRITE_TIMEOUT = float(os.getenv("DB_WRITE_TIMEOUT", "30"))
+
+
+def configure_engine(db: AsyncEngine, read_only: bool = False) -> AsyncEngine:
+    """
+    configure_engine applies the configured pragma profile to every new connection of an engine,
+    connections of read_only engines additionally refuse to write.
+    """
+    if db.dialect.name != "sqlite":
+        return db
+
+    pragmas = sqlite_pragmas()
+    if read_only:
+        pragmas["query_only"] = 1
+
+    @event.listens_for(db.sync_engine, "connect")
+    def apply_pragmas(dbapi_connection: Any, _connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return db
+
+
+def _is_file_db(url: str | URL) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def create_writer_engine(url: str | URL) -> AsyncEngine:
+    """
+    create_writer_engine creates the engine used for writes. SQLite only allows one writer at a time,
+    so the engine only has a single connection and writers queue up for it in the pool instead of
+    retrying on "database is locked". aiosqlite would otherwise open a new connection (and thread)
+    for every session.
+    """
+    if not _is_file_db(url):
+        return configure_engine(create_async_engine(url))
+
+    return configure_engine(
+        create_async_engine(
+            url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=WRITE_TIMEOUT,
+        )
+    )
+
+
+def create_reader_engine(url: str | URL, writer: AsyncEngine) -> AsyncEngine:
+    """
+    create_reader_engine creates a pool of read-only connections for SQLite database files, reads
+    then run concurrently with the writer. Other databases handle this themselves, the writer is used
+    for both there.
+    """
+    if not _is_file_db(url):
+        return writer
+
+    return configure_engine(
+        create_async_engine(
+            url, poolclass=AsyncAdaptedQueuePool, pool_size=READ_POOL_SIZE, max_overflow=0
+        ),
+        read_only=True,
+    )
+
+
 print(f"using DB from {DATABASE_URL}")
-engine = create_async_engine(DATABASE_URL)
+engine = create_writer_engine(DATABASE_URL)
+reader_engine = create_reader_engine(DATABASE_URL, engine)
 
+writer_sessions = async_sessionmaker(engine, expire_on_commit=False)
+reader_sessions = async_sessionmaker(reader_engine, expire_on_commit=False)
 
-def override_db(db: AsyncEngine) -> None:
-    global engine
-    engine = db
+
+def override_db(db: AsyncEngine, reader: AsyncEngine | None = None) -> None:
+    """
+    override_db switches to another database, the reader engine is created from the URL of db if
+    none is passed.
+    """
+    global engine, reader_engine
+    engine = configure_engine(db)
+    reader_engine = (
+        configure_engine(reader, read_only=True)
+        if reader is not None
+        else create_reader_engine(db.url, engine)
+    )
+    writer_sessions.configure(bind=engine)
+    reader_sessions.configure(bind=reader_engine)
+    # anything cached from the previous database is no longer valid
+    clear_caches()
 
 
 def async_session() -> AsyncSession:
-    return async_sessionmaker(engine, expire_on_commit=False)()
+    """
+    async_session returns a session on the writer engine, use it for everything that writes.
+    """
+    return writer_sessions()
+
+
+def read_session() -> AsyncSession:
+    """
+    read_session returns a session on the read-only engine, it can't be used to write.
+    """
+    return reader_sessions()
+
+
+class SessionScope:
+    """
+    SessionScope holds the sessions of a single request. They're only opened once something asks
+    for them and closed together at the end of the request.
+    """
+
+    def __init__(self) -> None:
+        self._reader: AsyncSession | None = None
+        self._writer: AsyncSession | None = None
+
+    def reader(self) -> AsyncSession:
+        if self._reader is None:
+            self._reader = read_session()
+        return self._reader
+
+    def writer(self) -> AsyncSession:
+        if self._writer is None:
+            self._writer = async_session()
+        return self._writer
+
+    async def close(self) -> None:
+        for session in (self._reader, self._writer):
+            if session is not None:
+                await session.close()
+
+
+_session_scope_ctx_var: ContextVar[SessionScope | None] = ContextVar(
+    "session_scope", default=None
+)
+
+
+@contextlib.asynccontextmanager
+async def session_scope() -> AsyncIterator[SessionScope]:
+    scope = SessionScope()
+    ctx_token = _session_scope_ctx_var.set(scope)
+    try:
+        yield scope
+    finally:
+        await scope.close()
+        _session_scope_ctx_var.reset(ctx_token)
+
+
+def current_session_scope() -> SessionScope:
+    scope = _session_scope_ctx_var.get()
+    if scope is None:
+        raise RuntimeError("no session scope, is the SessionScopeMiddleware installed?")
+    return scope
+
+
+class SessionScopeMiddleware:
+    """
+    SessionScopeMiddleware opens a session scope for each request, the routers and the
+    authentication get their sessions from it.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ["http", "websocket"]:
+            await self.app(scope, receive, send)
+            return
+
+        async with session_scope():
+            await self.app(scope, receive, send)
+
+
+def get_session() -> AsyncSession:
+    return current_session_scope().writer()
+
+
+def get_read_session() -> AsyncSession:
+    return current_session_scope().reader()
+
+
+# annotated dependencies for the routers, DbSession writes and ReadSession only reads
+DbSession = Annotated[AsyncSession, Depends(get_session)]
+ReadSession = Annotated[AsyncSession, Depends(get_read_session)]
 
 
 async def run_migrations() -> None:
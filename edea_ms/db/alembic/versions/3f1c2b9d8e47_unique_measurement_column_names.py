@@ -0,0 +1,55 @@
+"""unique measurement column names per project
+
+Revision ID: 3f1c2b9d8e47
+Revises: a73209e4df83
+Create Date: 2024-05-21 10:12:31.118412
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2b9d8e47'
+down_revision: Union[str, None] = 'a73209e4df83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# lowest column id for each (project_id, name) pair, that's the one we keep
+canonical_column = """
+    SELECT min(mc2.id) FROM measurement_columns mc1
+    JOIN measurement_columns mc2 ON mc1.project_id = mc2.project_id AND mc1.name = mc2.name
+    WHERE mc1.id = {table}.column_id
+"""
+
+duplicate_columns = """
+    SELECT mc.id FROM measurement_columns mc
+    WHERE mc.id != (
+        SELECT min(m.id) FROM measurement_columns m WHERE m.project_id = mc.project_id AND m.name = mc.name
+    )
+"""
+
+
+def upgrade() -> None:
+    # concurrent ingest could create the same column twice, point all values to the first one
+    for table in ["measurement_entries", "forcing_conditions"]:
+        op.execute(
+            f"UPDATE {table} SET column_id = ({canonical_column.format(table=table)}) "
+            f"WHERE column_id IN ({duplicate_columns})"
+        )
+
+    # keep a specification which was only linked to one of the duplicates
+    op.execute(
+        "UPDATE measurement_columns SET specification_id = ("
+        "  SELECT max(m.specification_id) FROM measurement_columns m"
+        "  WHERE m.project_id = measurement_columns.project_id AND m.name = measurement_columns.name"
+        ") WHERE specification_id IS NULL"
+    )
+    op.execute(f"DELETE FROM measurement_columns WHERE id IN ({duplicate_columns})")
+
+    op.create_index('ix_measurement_columns_project_id_name', 'measurement_columns', ['project_id', 'name'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_measurement_columns_project_id_name', table_name='measurement_columns')
@@ -0,0 +1,37 @@
+"""indexes for hot query paths
+
+Revision ID: b5e0d6a1c2f9
+Revises: 3f1c2b9d8e47
+Create Date: 2024-05-23 16:40:02.731950
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5e0d6a1c2f9'
+down_revision: Union[str, None] = '3f1c2b9d8e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # exports and ingest: find the entries/conditions of a run in step order. These aren't covering indexes,
+    # numeric_value and string_value are read from the table rows, including them would duplicate the tables
+    op.create_index('ix_measurement_entries_testrun_id_sequence_number', 'measurement_entries', ['testrun_id', 'sequence_number', 'column_id'], unique=False)
+    op.create_index('ix_forcing_conditions_testrun_id_sequence_number', 'forcing_conditions', ['testrun_id', 'value_hidden', 'sequence_number', 'column_id'], unique=False)
+    # testrun lists and the overview, filtered by owner or project and sorted by creation date
+    op.create_index('ix_testruns_project_id_created_at', 'testruns', ['project_id', 'created_at'], unique=False)
+    op.create_index('ix_testruns_user_id_created_at', 'testruns', ['user_id', 'created_at'], unique=False)
+    # workers polling for new jobs
+    op.create_index('ix_jobqueue_user_id_state', 'jobqueue', ['user_id', 'state'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_jobqueue_user_id_state', table_name='jobqueue')
+    op.drop_index('ix_testruns_user_id_created_at', table_name='testruns')
+    op.drop_index('ix_testruns_project_id_created_at', table_name='testruns')
+    op.drop_index('ix_forcing_conditions_testrun_id_sequence_number', table_name='forcing_conditions')
+    op.drop_index('ix_measurement_entries_testrun_id_sequence_number', table_name='measurement_entries')
@@ -0,0 +1,50 @@
+"""project groups table
+
+Revision ID: d41e7b3a9c05
+Revises: b5e0d6a1c2f9
+Create Date: 2024-05-27 09:18:44.502117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41e7b3a9c05'
+down_revision: Union[str, None] = 'b5e0d6a1c2f9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+backfill = {
+    "sqlite": """
+        INSERT INTO project_groups (project_id, "group")
+        SELECT DISTINCT projects.id, groups.value FROM projects, json_each(projects.groups) AS groups
+        WHERE groups.value IS NOT NULL
+    """,
+    "postgresql": """
+        INSERT INTO project_groups (project_id, "group")
+        SELECT DISTINCT projects.id, groups.value FROM projects, json_array_elements_text(projects.groups) AS groups
+        WHERE groups.value IS NOT NULL
+    """,
+}
+
+
+def upgrade() -> None:
+    op.create_table('project_groups',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('group', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id', 'group')
+    )
+    op.create_index('ix_project_groups_group', 'project_groups', ['group', 'project_id'], unique=False)
+    op.create_index('ix_projects_user_id', 'projects', ['user_id'], unique=False)
+
+    op.execute(backfill[op.get_bind().dialect.name])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_projects_user_id', table_name='projects')
+    op.drop_index('ix_project_groups_group', table_name='project_groups')
+    op.drop_table('project_groups')
@@ -0,0 +1,33 @@
+"""indexes for list filters
+
+Revision ID: e2b7c4f19a63
+Revises: d41e7b3a9c05
+Create Date: 2024-05-29 11:02:37.184529
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b7c4f19a63'
+down_revision: Union[str, None] = 'd41e7b3a9c05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # testrun lists filtered by one of these, paginated by id
+    op.create_index('ix_testruns_state_id', 'testruns', ['state', 'id'], unique=False)
+    op.create_index('ix_testruns_dut_id_id', 'testruns', ['dut_id', 'id'], unique=False)
+    op.create_index('ix_testruns_test_name_id', 'testruns', ['test_name', 'id'], unique=False)
+    # forcing conditions of a run, paginated by id
+    op.create_index('ix_forcing_conditions_testrun_id_id', 'forcing_conditions', ['testrun_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_forcing_conditions_testrun_id_id', table_name='forcing_conditions')
+    op.drop_index('ix_testruns_test_name_id', table_name='testruns')
+    op.drop_index('ix_testruns_dut_id_id', table_name='testruns')
+    op.drop_index('ix_testruns_state_id', table_name='testruns')
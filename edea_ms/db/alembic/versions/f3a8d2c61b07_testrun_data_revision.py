@@ -0,0 +1,26 @@
+"""testrun data revision
+
+Revision ID: f3a8d2c61b07
+Revises: e2b7c4f19a63
+Create Date: 2024-05-31 09:14:52.301846
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a8d2c61b07'
+down_revision: Union[str, None] = 'e2b7c4f19a63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('testruns', sa.Column('data_revision', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('testruns', 'data_revision')
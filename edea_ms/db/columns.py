@@ -0,0 +1,114 @@
+import os
+from typing import Any, Iterable, Tuple
+
+from sqlalchemy import Select, and_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from edea_ms.core.cache import LRUCache
+from edea_ms.db import models
+
+# (project_id, column name) -> column id, only ever filled with committed rows. Changes are only invalidated
+# in this process, the ttl bounds how long other workers can use ids of deleted or recreated columns.
+column_cache: LRUCache[tuple[int, str], int] = LRUCache(
+    "measurement_columns",
+    maxsize=int(os.getenv("COLUMN_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("COLUMN_CACHE_TTL", "60")),
+)
+
+
+def invalidate_columns(project_id: int | None = None) -> None:
+    """
+    invalidate_columns drops the cached column ids of a project or of all projects if no
+    project_id is given.
+    """
+    if project_id is None:
+        column_cache.clear()
+    else:
+        column_cache.invalidate(lambda key: key[0] == project_id)
+
+
+def _columns_query(project_id: int, names: Iterable[str]) -> Select[Tuple[int, str]]:
+    return select(models.MeasurementColumn.id, models.MeasurementColumn.name).where(
+        and_(
+            models.MeasurementColumn.project_id == project_id,
+            models.MeasurementColumn.name.in_(names),
+        )
+    )
+
+
+async def _select_columns(
+    session: AsyncSession, project_id: int, names: Iterable[str]
+) -> dict[str, int]:
+    return {
+        name: column_id
+        for column_id, name in await session.execute(_columns_query(project_id, names))
+    }
+
+
+async def get_or_create_columns(
+    session: AsyncSession,
+    project_id: int,
+    names: Iterable[str],
+    defaults: dict[str, dict[str, Any]] | None = None,
+) -> dict[str, int]:
+    """
+    get_or_create_columns resolves column names of a project to column ids. Names which aren't
+    cached are fetched with a single query and the ones which don't exist yet are created with
+    one INSERT ... ON CONFLICT DO NOTHING so that concurrent requests can't create duplicates.
+
+    defaults optionally contains the field values (description, unit, etc.) for new columns.
+    Nothing gets committed here, that's up to the caller.
+    """
+    columns: dict[str, int] = {}
+    missing: set[str] = set()
+
+    for name in names:
+        if (column_id := column_cache.get((project_id, name))) is not None:
+            columns[name] = column_id
+        else:
+            missing.add(name)
+
+    if not missing:
+        return columns
+
+    existing = await _select_columns(session, project_id, missing)
+    for name, column_id in existing.items():
+        column_cache.put((project_id, name), column_id)
+    columns.update(existing)
+    missing.difference_update(existing)
+
+    if not missing:
+        return columns
+
+    defaults = defaults or {}
+    fields = {k for name in missing for k in defaults.get(name, {})}
+    rows = [
+        {
+            **{k: None for k in fields},
+            **defaults.get(name, {}),
+            "name": name,
+            "project_id": project_id,
+        }
+        for name in sorted(missing)
+    ]
+
+    insert = (
+        postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+    )
+    stmt = (
+        insert(models.MeasurementColumn)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["project_id", "name"])
+        .returning(models.MeasurementColumn.id, models.MeasurementColumn.name)
+    )
+    # new columns are only cached after a later lookup, the transaction could still be rolled back
+    for column_id, name in await session.execute(stmt):
+        columns[name] = column_id
+        missing.discard(name)
+
+    # whatever is left was created by a concurrent request in the meantime
+    if missing:
+        columns.update(await _select_columns(session, project_id, missing))
+
+    return columns
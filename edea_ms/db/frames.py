@@ -0,0 +1,119 @@
+import asyncio
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Sequence
+
+import polars as pl
+import pyarrow as pa
+from sqlalchemy import Select, Table, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from edea_ms.db import _is_file_db, sqlite_pragmas
+
+FETCH_BATCH_SIZE = int(os.getenv("DB_FETCH_BATCH_SIZE", "65536"))
+
+_arrow_types = {int: pa.int64(), float: pa.float64(), str: pa.large_utf8(), bool: pa.bool_()}
+
+
+async def insert_frame(session: AsyncSession, table: Table, df: pl.DataFrame) -> int:
+    """
+    insert_frame writes all rows of a DataFrame into a table with a single executemany. The rows
+    are handed to the driver as plain tuples (or dicts for drivers with named parameters), which
+    skips building ORM objects or per-row insert parameters in SQLAlchemy.
+
+    The column names of the DataFrame need to match the table columns, columns with client side
+    defaults need to be part of the DataFrame too.
+    """
+    if df.is_empty():
+        return 0
+
+    compiled = insert(table).compile(dialect=session.bind.dialect, column_keys=df.columns)
+    conn = await session.connection()
+
+    if compiled.positional and compiled.positiontup is not None:
+        await conn.exec_driver_sql(str(compiled), df.select(compiled.positiontup).rows())
+    else:
+        await conn.exec_driver_sql(str(compiled), df.to_dicts())  # type: ignore[arg-type]
+
+    return df.height
+
+
+def _arrow_schema(query: Select[Any]) -> pa.Schema:
+    fields = []
+    for c in query.selected_columns:
+        try:
+            python_type = c.type.python_type
+        except NotImplementedError:
+            python_type = None
+        # null columns get their type inferred from the values
+        fields.append(pa.field(c.name, _arrow_types.get(python_type, pa.null())))  # type: ignore[arg-type]
+
+    return pa.schema(fields)
+
+
+def _batch_table(rows: Sequence[Sequence[Any]], schema: pa.Schema) -> pa.Table:
+    if pa.null() not in schema.types:
+        # pyarrow converts the row tuples into a struct array in one go, much faster than per column
+        return pa.Table.from_struct_array(pa.array(rows, type=pa.struct(list(schema))))
+
+    arrays = [
+        pa.array([row[i] for row in rows], type=None if field.type == pa.null() else field.type)
+        for i, field in enumerate(schema)
+    ]
+    return pa.Table.from_arrays(arrays, names=schema.names)
+
+
+def _concat(tables: list[pa.Table], schema: pa.Schema) -> pa.Table:
+    return pa.concat_tables([schema.empty_table(), *tables], promote_options="permissive")
+
+
+def _read_sqlite(path: str, queries: list[tuple[str, pa.Schema]], batch_size: int) -> list[pa.Table]:
+    # a read-only connection of its own, so the fetching doesn't need the event loop for each batch
+    conn = sqlite3.connect(f"{Path(path).absolute().as_uri()}?mode=ro", uri=True, isolation_level=None)
+    try:
+        for name, value in sqlite_pragmas().items():
+            if name != "journal_mode":
+                conn.execute(f"PRAGMA {name}={value}")
+
+        # all queries see the same snapshot
+        conn.execute("BEGIN")
+        tables = []
+        for sql, schema in queries:
+            cursor = conn.execute(sql)
+            batches = [_batch_table(rows, schema) for rows in iter(lambda: cursor.fetchmany(batch_size), [])]
+            tables.append(_concat(batches, schema))
+        conn.execute("COMMIT")
+
+        return tables
+    finally:
+        conn.close()
+
+
+async def read_frames(
+    session: AsyncSession, queries: Sequence[Select[Any]], batch_size: int = FETCH_BATCH_SIZE
+) -> list[pl.DataFrame]:
+    """
+    read_frames fetches the results of queries in batches of Arrow arrays and hands them to polars,
+    only the rows of the current batch exist as Python objects.
+
+    For SQLite database files the queries run in a worker thread on a read-only connection of their
+    own, they only see committed data. Other databases stream the results through the session.
+    """
+    schemas = [_arrow_schema(query) for query in queries]
+    bind = session.get_bind()
+
+    if _is_file_db(bind.engine.url):
+        compiled = [
+            (str(query.compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True})), schema)
+            for query, schema in zip(queries, schemas)
+        ]
+        tables = await asyncio.to_thread(_read_sqlite, bind.engine.url.database, compiled, batch_size)
+    else:
+        tables = []
+        for query, schema in zip(queries, schemas):
+            result = await session.stream(query)
+            batches = [_batch_table(list(map(tuple, rows)), schema) async for rows in result.partitions(batch_size)]
+            tables.append(_concat(batches, schema))
+
+    return [pl.from_arrow(table) for table in tables]  # type: ignore[misc]
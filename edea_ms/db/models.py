@@ -5,7 +5,7 @@ from datetime import datetime
 from typing import Any, Self
 
 from pydantic import BaseModel
-from sqlalchemy import JSON, ForeignKey, LargeBinary, UniqueConstraint, func
+from sqlalchemy import JSON, ForeignKey, Index, LargeBinary, UniqueConstraint, func
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy.orm import (
     DeclarativeBase,
@@ -96,6 +96,23 @@ class Project(Model, ProvidesUserMixin):
     name: Mapped[str]
     groups: Mapped[MutableList[str]] = mapped_column(JSON)
 
+    __table_args__ = (
+        Index("ix_projects_user_id", "user_id"),
+    )
+
+
+# the groups of a project as rows, so access checks can use an index instead of json_each.
+# projects.groups stays the source for the API, the projects router keeps both in sync.
+class ProjectGroup(Model):
+    __tablename__: str = "project_groups"
+
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"), primary_key=True)
+    group: Mapped[str] = mapped_column(primary_key=True)
+
+    __table_args__ = (
+        Index("ix_project_groups_group", "group", "project_id"),
+    )
+
 
 class Specification(Model, ProvidesProjectMixin):
     __tablename__: str = "specifications"
@@ -131,12 +148,24 @@ class TestRun(Model, ProvidesProjectMixin, ProvidesUserMixin):
     completed_at: Mapped[datetime | None]
     state: Mapped[TestRunState] = mapped_column(default=TestRunState.NEW)
     data: Mapped[dict[Any, Any] | None] = mapped_column(JSON)
-
+    # bumped when measurements or conditions are changed in place, part of the data version of snapshots
+    data_revision: Mapped[int] = mapped_column(default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_testruns_project_id_created_at", "project_id", "created_at"),
+        Index("ix_testruns_user_id_created_at", "user_id", "created_at"),
+        Index("ix_testruns_state_id", "state", "id"),
+        Index("ix_testruns_dut_id_id", "dut_id", "id"),
+        Index("ix_testruns_test_name_id", "test_name", "id"),
+    )
     __mapper_args__ = {"eager_defaults": True}
 
 
 class MeasurementColumn(Model, ProvidesProjectMixin, ProvidesSpecificationMixin):
     __tablename__: str = "measurement_columns"
+    __table_args__ = (
+        Index("ix_measurement_columns_project_id_name", "project_id", "name", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
@@ -151,6 +180,14 @@ class MeasurementEntry(
     Model, ProvidesTestRunColumnMixin, ProvidesMeasurementColumnMixin
 ):
     __tablename__ = "measurement_entries"
+    __table_args__ = (
+        Index(
+            "ix_measurement_entries_testrun_id_sequence_number",
+            "testrun_id",
+            "sequence_number",
+            "column_id",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     sequence_number: Mapped[int]
@@ -164,6 +201,16 @@ class ForcingCondition(
     Model, ProvidesMeasurementColumnMixin, ProvidesTestRunColumnMixin
 ):
     __tablename__: str = "forcing_conditions"
+    __table_args__ = (
+        Index(
+            "ix_forcing_conditions_testrun_id_sequence_number",
+            "testrun_id",
+            "value_hidden",
+            "sequence_number",
+            "column_id",
+        ),
+        Index("ix_forcing_conditions_testrun_id_id", "testrun_id", "id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     sequence_number: Mapped[int]
@@ -191,6 +238,7 @@ class JobState(int, enum.Enum):
 
 class Job(Model, ProvidesUserMixin):
     __tablename__: str = "jobqueue"
+    __table_args__ = (Index("ix_jobqueue_user_id_state", "user_id", "state"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     state: Mapped[JobState] = mapped_column(default=JobState.NEW)
@@ -1,77 +1,89 @@
-from typing import Any, Tuple
+import os
+from typing import Tuple
+from edea_ms.core.cache import LRUCache
 from edea_ms.core.helpers import prj_unique_field
 from edea_ms.db import models
 
 
-from sqlalchemy import Select, and_, column, func, select, true
+from sqlalchemy import ColumnElement, Select, and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+# (user id, groups) -> ids of all projects the user can access. other workers may change projects
+# too, the ttl bounds how long a removed access goes unnoticed there.
+project_access_cache: LRUCache[tuple[int, tuple[str, ...]], frozenset[int]] = LRUCache(
+    "project_access",
+    maxsize=int(os.getenv("PROJECT_ACCESS_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PROJECT_ACCESS_CACHE_TTL", "60")),
+)
+_project_access_generation = 0
 
-from operator import or_
 
+def invalidate_project_access() -> None:
+    """
+    invalidate_project_access drops the cached project ids of all users, any project change can
+    affect the access of any user through its groups.
+    """
+    global _project_access_generation
+    _project_access_generation += 1
+    project_access_cache.clear()
 
-def all_projects(user: models.User) -> Select[Tuple[models.Project]]:
-    return (
-        select(models.Project)
-        .distinct()
-        .join_from(
-            models.Project,
-            func.json_each(models.Project.groups).table_valued(column("value")).alias("groups"),
-            true(),
-            isouter=True,
-        )
-        .where(
-            or_(
-                column("value").in_(user.groups),
-                models.Project.user_id == user.id,
+
+def _user_has_access(user: models.User) -> ColumnElement[bool]:
+    # semi-join on the indexed project_groups instead of expanding the groups of every project
+    return or_(
+        models.Project.user_id == user.id,
+        models.Project.id.in_(
+            select(models.ProjectGroup.project_id).where(
+                models.ProjectGroup.group.in_(user.groups)
             )
-        )
+        ),
     )
 
 
+def all_projects(user: models.User) -> Select[Tuple[models.Project]]:
+    return select(models.Project).where(_user_has_access(user))
+
+
 def single_project(
     user: models.User, ident: int | str
 ) -> Select[Tuple[models.Project]]:
-    return (
-        select(models.Project)
-        .distinct()
-        .join_from(
-            models.Project,
-            func.json_each(models.Project.groups).table_valued(column("value")).alias("groups"),
-            true(),
-            isouter=True,
-        )
-        .where(
-            and_(
-                prj_unique_field(ident) == ident,
-                or_(
-                    column("value").in_(user.groups),
-                    models.Project.user_id == user.id,
-                ),
-            )
+    return select(models.Project).where(
+        and_(
+            prj_unique_field(ident) == ident,
+            _user_has_access(user),
         )
     )
 
 
 def _common_project_ids(user: models.User) -> Select[Tuple[int]]:
-    return (
-        select(models.Project.id)
-        .distinct()
-        .join_from(
-            models.Project,
-            func.json_each(models.Project.groups).table_valued(column("value")).alias("groups"),
-            true(),
-            isouter=True,
-        )
-        .where(
-            or_(
-                column("value").in_(user.groups),
-                models.Project.user_id == user.id,
-            )
-        )
-    )
+    return select(models.Project.id).where(_user_has_access(user))
+
+
+async def accessible_project_ids(
+    session: AsyncSession, user: models.User, refresh: bool = False
+) -> frozenset[int]:
+    """
+    accessible_project_ids returns the ids of the projects a user created or shares a group with.
+    """
+    key = (user.id, tuple(sorted(user.groups)))
+    if not refresh and (ids := project_access_cache.get(key)) is not None:
+        return ids
+
+    generation = _project_access_generation
+    ids = frozenset(await session.scalars(_common_project_ids(user)))
+
+    # don't cache what we've read if projects were changed in the meantime
+    if generation == _project_access_generation:
+        project_access_cache.put(key, ids)
+
+    return ids
+
 
+async def has_project_access(
+    session: AsyncSession, user: models.User, project_id: int
+) -> bool:
+    if project_id in await accessible_project_ids(session, user):
+        return True
 
-def common_project_ids(
-    user: models.User, alias: str = "common_project_ids"
-) -> Select[Tuple[Any]]:
-    return select(_common_project_ids(user).cte(alias).c.id)
+    # the cached ids can miss a project another worker just created, check before denying access
+    return project_id in await accessible_project_ids(session, user, refresh=True)
@@ -0,0 +1,159 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Tuple
+
+import polars as pl
+from sqlalchemy import ColumnElement, Select, func, select, true, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from edea_ms.core.cache import register_cache
+from edea_ms.db import models
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "edea-ms-snapshots")
+SNAPSHOT_MAX_BYTES = int(os.getenv("SNAPSHOT_MAX_BYTES", str(1024**3)))
+
+if "pytest" in sys.modules:
+    SNAPSHOT_DIR = os.path.join(tempfile.gettempdir(), "edea-ms-test-snapshots")
+
+# runs in these states don't get new data anymore
+FINISHED_STATES = {
+    models.TestRunState.COMPLETE,
+    models.TestRunState.FAILED,
+    models.TestRunState.INTERRUPTED,
+}
+
+
+class SnapshotCache:
+    """
+    SnapshotCache keeps the computed frames of testruns as Parquet files in a directory. The files are
+    named by testrun id and data version, so a snapshot of data which changed since is never found again,
+    and several workers can share the directory. The least recently used files are deleted once all of
+    them take up more than max_bytes.
+    """
+
+    def __init__(self, name: str, directory: str | Path, max_bytes: int) -> None:
+        self.name = name
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        register_cache(self)
+
+    def path(self, run_id: int, version: str) -> Path | None:
+        """
+        path returns the snapshot file of a run, or None if there's no snapshot of this data version.
+        """
+        path = self.directory / f"{run_id}-{version}.parquet"
+        try:
+            # the modification time orders the files for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def get(self, run_id: int, version: str) -> pl.DataFrame | None:
+        path = self.path(run_id, version)
+        try:
+            return pl.read_parquet(path) if path else None
+        except FileNotFoundError:
+            # evicted in the meantime
+            return None
+
+    def put(self, run_id: int, version: str, df: pl.DataFrame) -> None:
+        """
+        put stores the snapshot of a run. The version needs to be read before the data, in case the data
+        changes meanwhile the snapshot is stored under an outdated version and never found.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in self.directory.glob(f"{run_id}-*.parquet"):
+            path.unlink(missing_ok=True)
+
+        # readers only ever see complete files
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        df.write_parquet(tmp)
+        os.replace(tmp, self.directory / f"{run_id}-{version}.parquet")
+
+        self._evict()
+
+    def invalidate(self, run_id: int) -> None:
+        """
+        invalidate deletes the snapshots of a run to free their space early, the data version of a run
+        changes with its data anyway.
+        """
+        for path in self.directory.glob(f"{run_id}-*.parquet"):
+            path.unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*.parquet"):
+            path.unlink(missing_ok=True)
+
+    def _files(self) -> list[tuple[float, int, Path]]:
+        files = []
+        for path in self.directory.glob("*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        return sorted(files)
+
+    def _evict(self) -> None:
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def stats(self) -> dict[str, int]:
+        files = self._files()
+        return {
+            "size": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+testrun_snapshots = SnapshotCache("testrun_snapshots", SNAPSHOT_DIR, SNAPSHOT_MAX_BYTES)
+
+
+def _data_version_query(run_id: int) -> Select[Tuple[Any, ...]]:
+    me = models.MeasurementEntry
+    fc = models.ForcingCondition
+    revision = select(models.TestRun.data_revision).where(models.TestRun.id == run_id).scalar_subquery()
+    entries = select(func.count(me.id), func.max(me.id)).where(me.testrun_id == run_id).subquery()
+    conditions = select(func.count(fc.id), func.max(fc.id)).where(fc.testrun_id == run_id).subquery()
+
+    # both have a single row
+    return select(revision, entries, conditions).select_from(entries.join(conditions, true()))
+
+
+async def data_version(session: AsyncSession, run_id: int) -> str:
+    """
+    data_version stamps the measurement entries and forcing conditions of a run, inserting rows changes it.
+    Rows changed or deleted in place change it through the data revision of the run, see bump_data_revision.
+    It only depends on the database, so workers sharing the snapshot directory agree on it.
+    """
+    row = (await session.execute(_data_version_query(run_id))).one()
+    return "_".join(str(v or 0) for v in row)
+
+
+async def bump_data_revision(session: AsyncSession, *where: ColumnElement[bool]) -> None:
+    """
+    bump_data_revision changes the data version of the selected runs, in the transaction which changes
+    their measurements or conditions in place.
+    """
+    await session.execute(
+        update(models.TestRun).where(*where).values(data_revision=models.TestRun.data_revision + 1)
+    )
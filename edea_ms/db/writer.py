@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy import Table, insert
+
+import edea_ms.db as db
+
+
+@dataclass
+class _PendingWrite:
+    table: Table
+    rows: list[dict[str, Any]]
+    future: "asyncio.Future[int]" = field(repr=False)
+
+
+class WriteCoalescer:
+    """
+    WriteCoalescer collects rows from concurrent requests and writes them with a single writer task,
+    one transaction per flush. With many stations writing into the same SQLite database, this turns
+    one lock acquisition and fsync per request into one per flush.
+
+    A flush starts when the first rows arrive and waits up to flush_interval seconds for more, or
+    until max_batch_rows rows are pending. submit only returns once the rows are committed.
+    The writer task only runs while there's something to write, it's started again on demand.
+    """
+
+    def __init__(self, flush_interval: float, max_batch_rows: int) -> None:
+        self.flush_interval = flush_interval
+        self.max_batch_rows = max_batch_rows
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue[_PendingWrite] | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._pending_rows = 0
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._total_flush_seconds = 0.0
+
+    def _ensure_running(self) -> asyncio.Queue[_PendingWrite]:
+        loop = asyncio.get_running_loop()
+
+        # queues are bound to an event loop, start over if we're called from a different one
+        if self._queue is None or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = None
+            self._pending_rows = 0
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run(self._queue))
+
+        return self._queue
+
+    async def submit(self, table: Table, rows: list[dict[str, Any]]) -> int:
+        """
+        submit queues rows for insertion into table and waits until they're committed.
+        """
+        if not rows:
+            return 0
+
+        item = _PendingWrite(table, rows, asyncio.get_running_loop().create_future())
+        queue = self._ensure_running()
+        queue.put_nowait(item)
+        self._pending_rows += len(rows)
+
+        return await item.future
+
+    async def _run(self, queue: asyncio.Queue[_PendingWrite]) -> None:
+        # exits once everything is written, there's no await between the check and returning
+        while not queue.empty():
+            batch = [queue.get_nowait()]
+            rows = len(batch[0].rows)
+
+            # give concurrent requests the chance to join this flush
+            if self.flush_interval > 0 and rows < self.max_batch_rows:
+                await asyncio.sleep(self.flush_interval)
+
+            while rows < self.max_batch_rows and not queue.empty():
+                item = queue.get_nowait()
+                batch.append(item)
+                rows += len(item.rows)
+
+            try:
+                await self._flush(batch)
+            finally:
+                self._pending_rows -= rows
+                for _ in batch:
+                    queue.task_done()
+
+    async def _flush(self, batch: list[_PendingWrite]) -> None:
+        start = time.monotonic()
+
+        try:
+            async with db.engine.begin() as conn:
+                for item in batch:
+                    await conn.execute(insert(item.table), item.rows)
+        except Exception:
+            # don't let one bad request fail the others, retry them one by one to find the culprit
+            for item in batch:
+                try:
+                    async with db.engine.begin() as conn:
+                        await conn.execute(insert(item.table), item.rows)
+                except Exception as e:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                else:
+                    if not item.future.done():
+                        item.future.set_result(len(item.rows))
+        else:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(len(item.rows))
+
+        elapsed = time.monotonic() - start
+        self.flushes += 1
+        self.rows_written += sum(len(item.rows) for item in batch)
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self._total_flush_seconds += elapsed
+
+    async def stop(self) -> None:
+        """
+        stop waits until all queued rows are written.
+        """
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+        self._loop = None
+        self._queue = None
+        self._task = None
+
+    def stats(self) -> dict[str, float | int]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "pending_rows": self._pending_rows,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "avg_flush_seconds": self._total_flush_seconds / self.flushes if self.flushes else 0.0,
+            "flush_interval": self.flush_interval,
+            "max_batch_rows": self.max_batch_rows,
+        }
+
+
+write_coalescer = WriteCoalescer(
+    flush_interval=float(os.getenv("INGEST_FLUSH_INTERVAL", "0.005")),
+    max_batch_rows=int(os.getenv("INGEST_MAX_BATCH_ROWS", "50000")),
+)
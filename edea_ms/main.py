@@ -9,8 +9,10 @@ from fastapi.responses import JSONResponse
 from starlette.middleware.sessions import SessionMiddleware
 
 from edea_ms.core.auth import AuthenticationMiddleware
+from edea_ms.core.charts import chart_renderer
 from edea_ms.core.staticfiles import get_asset
-from edea_ms.db import run_migrations
+from edea_ms.db import SessionScopeMiddleware, run_migrations
+from edea_ms.db.writer import write_coalescer
 from .routers import (
     auth_oidc,
     config,
@@ -20,6 +22,7 @@ from .routers import (
     jobs,
     measurement_columns,
     measurement_entries,
+    metrics,
     projects,
     specifications,
     testruns,
@@ -64,13 +67,20 @@ tags_metadata = [
         "name": "configuration",
         "description": "Simple key:value store to store application configuration.",
     },
+    {
+        "name": "metrics",
+        "description": "Internal counters of this server process, e.g. cache efficiency.",
+    },
 ]
 
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
     await run_migrations()
-    yield  # cleanup here
+    yield
+    # make sure everything that was acknowledged is also written before shutting down
+    await write_coalescer.stop()
+    chart_renderer.shutdown()
 
 
 api_prefix = "/api"
@@ -88,6 +98,7 @@ app = FastAPI(
 )
 
 app.add_middleware(AuthenticationMiddleware)
+app.add_middleware(SessionScopeMiddleware)
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("SESSION_SECRET", secrets.token_hex(16)))
 
 api = APIRouter(prefix=api_prefix)
@@ -103,6 +114,7 @@ api.include_router(config.router)
 api.include_router(files.router)
 api.include_router(users.router)
 api.include_router(auth_oidc.router)
+api.include_router(metrics.router)
 
 app.include_router(api)
 
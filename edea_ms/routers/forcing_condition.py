@@ -1,12 +1,16 @@
-from typing import List
+from typing import Iterable, List, Tuple
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel, ConfigDict
-from sqlalchemy import and_, select
+from sqlalchemy import Select, and_, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from edea_ms.core.auth import CurrentUser
-from edea_ms.db import async_session, models
+from edea_ms.core.charts import chart_renderer
+from edea_ms.core.pagination import After, Limit, next_page, paginate
+from edea_ms.db import DbSession, ReadSession, models
+from edea_ms.db.queries import accessible_project_ids
+from edea_ms.db.snapshots import bump_data_revision, testrun_snapshots
 
 
 class ForcingCondition(BaseModel):
@@ -36,32 +40,67 @@ async def get_user_testrun(
     return (await session.scalars(q)).one()
 
 
+def _conditions_query(
+    current_user: models.User,
+    project_ids: Iterable[int],
+    testrun_id: int | None,
+    after: int | None = None,
+    limit: int | None = None,
+) -> Select[Tuple[models.ForcingCondition]]:
+    fc = models.ForcingCondition
+    # only conditions of the runs the user can see
+    runs = select(models.TestRun.id).where(
+        or_(
+            models.TestRun.user_id == current_user.id,
+            models.TestRun.project_id.in_(project_ids),
+        )
+    )
+    q = select(fc).where(fc.testrun_id.in_(runs))
+    if testrun_id is not None:
+        q = q.where(fc.testrun_id == testrun_id)
+    return paginate(q, fc.id, after, limit)
+
+
 @router.get("/forcing_conditions", tags=["forcing_condition"])
 async def get_forcing_conditions(
     current_user: CurrentUser,
+    session: ReadSession,
+    request: Request,
+    response: Response,
+    testrun_id: int | None = None,
+    limit: Limit = None,
+    after: After = None,
 ) -> List[ForcingCondition]:
-    async with async_session() as session:
-        items: List[ForcingCondition] = [
-            ForcingCondition.model_validate(item)
-            for item in (await session.scalars(select(models.ForcingCondition))).all()
-        ]
-        return items
+    """
+    Lists the forcing conditions of the testruns the user has access to, ordered by id, optionally only those of
+    a single testrun. With limit they're returned in pages, see the list of testruns.
+    """
+    project_ids = await accessible_project_ids(session, current_user)
+    q = _conditions_query(current_user, project_ids, testrun_id, after, limit)
+    conditions = (await session.scalars(q)).all()
+
+    return [
+        ForcingCondition.model_validate(item)
+        for item in next_page(request, response, conditions, limit, lambda c: c.id)
+    ]
 
 
 @router.post("/forcing_conditions", tags=["forcing_condition"])
 async def create_forcing_conditions(
     condition: ForcingCondition,
     current_user: CurrentUser,
+    session: DbSession,
 ) -> ForcingCondition:
-    async with async_session() as session:
-        await get_user_testrun(condition.testrun_id, current_user, session)
+    await get_user_testrun(condition.testrun_id, current_user, session)
 
-        cond = models.ForcingCondition()
-        session.add(cond.update_from_model(condition))
+    cond = models.ForcingCondition()
+    session.add(cond.update_from_model(condition))
 
-        await session.commit()
+    await session.commit()
+    testrun_snapshots.invalidate(condition.testrun_id)
+    chart_renderer.invalidate(condition.testrun_id)
 
-        return ForcingCondition.model_validate(cond)
+    return ForcingCondition.model_validate(cond)
 
 
 @router.put("/forcing_conditions/{id}", tags=["forcing_condition"])
@@ -69,40 +108,45 @@ async def update_forcing_condition(
     id: int,
     condition: ForcingCondition,
     current_user: CurrentUser,
+    session: DbSession,
 ) -> ForcingCondition:
-    async with async_session() as session:
-        cur = (
-            await session.scalars(
-                select(models.ForcingCondition).where(models.ForcingCondition.id == id)
-            )
-        ).one()
+    cur = (
+        await session.scalars(
+            select(models.ForcingCondition).where(models.ForcingCondition.id == id)
+        )
+    ).one()
 
-        await get_user_testrun(cur.id, current_user, session)
-        if condition.testrun_id != cur.testrun_id:
-            raise HTTPException(
-                429, "changing testrun id of forcing condition is not allowed"
-            )
+    await get_user_testrun(cur.testrun_id, current_user, session)
+    if condition.testrun_id != cur.testrun_id:
+        raise HTTPException(
+            429, "changing testrun id of forcing condition is not allowed"
+        )
 
-        cur.update_from_model(condition)
-        await session.commit()
+    cur.update_from_model(condition)
+    await bump_data_revision(session, models.TestRun.id == cur.testrun_id)
+    await session.commit()
+    testrun_snapshots.invalidate(cur.testrun_id)
+    chart_renderer.invalidate(cur.testrun_id)
 
-        return ForcingCondition.model_validate(cur)
+    return ForcingCondition.model_validate(cur)
 
 
 @router.delete("/forcing_conditions/{id}", tags=["forcing_condition"])
 async def delete_forcing_condition(
-    id: int, current_user: CurrentUser
+    id: int, current_user: CurrentUser, session: DbSession
 ) -> dict[str, int]:
-    async with async_session() as session:
-        cur = (
-            await session.scalars(
-                select(models.ForcingCondition).where(models.ForcingCondition.id == id)
-            )
-        ).one()
+    cur = (
+        await session.scalars(
+            select(models.ForcingCondition).where(models.ForcingCondition.id == id)
+        )
+    ).one()
 
-        await get_user_testrun(cur.id, current_user, session)
+    await get_user_testrun(cur.testrun_id, current_user, session)
 
-        await session.delete(models.ForcingCondition(id=id))
-        await session.commit()
+    await session.delete(cur)
+    await bump_data_revision(session, models.TestRun.id == cur.testrun_id)
+    await session.commit()
+    testrun_snapshots.invalidate(cur.testrun_id)
+    chart_renderer.invalidate(cur.testrun_id)
 
     return {"deleted_rows": 1}
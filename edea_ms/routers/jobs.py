@@ -1,14 +1,16 @@
 from datetime import datetime, timezone
-from typing import Any, List
+from typing import Any, List, Tuple
 
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Request, Response
 from pydantic import BaseModel, ConfigDict
-from sqlalchemy import and_
+from sqlalchemy import Select, and_
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.sql import select
 
 from edea_ms.core.auth import get_current_active_user
-from edea_ms.db import async_session, models
+from edea_ms.core.pagination import After, Limit, next_page, paginate
+from edea_ms.core.rows import Rows
+from edea_ms.db import DbSession, ReadSession, models
 from edea_ms.db.models import JobState, User
 
 router = APIRouter()
@@ -25,140 +27,152 @@ class Job(BaseModel):
     parameters: dict[Any, Any]
 
 
+job_rows = Rows(Job, models.Job)
+
+
 class NewJob(BaseModel):
     function_call: str
     parameters: dict[Any, Any]
 
 
-@router.get("/jobs/all", tags=["jobqueue"])
+def _jobs_query(
+    user_id: int, state: JobState | None, after: int | None = None, limit: int | None = None
+) -> Select[Tuple[models.Job]]:
+    q = select(models.Job).where(models.Job.user_id == user_id)
+    if state is not None:
+        q = q.where(models.Job.state == state)
+    return paginate(q, models.Job.id, after, limit)
+
+
+@router.get("/jobs/all", tags=["jobqueue"], response_model=List[Job])
 async def get_all_jobs(
+    session: ReadSession,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_active_user),
-) -> List[Job]:
-    async with async_session() as session:
-        jobs: List[Job] = [
-            Job.model_validate(job)
-            for job in (
-                await session.scalars(
-                    select(models.Job).where(models.Job.user_id == current_user.id)
-                )
-            ).all()
-        ]
-        return jobs
+    state: JobState | None = None,
+    limit: Limit = None,
+    after: After = None,
+) -> Response:
+    """
+    Lists the jobs of the user ordered by id, optionally only those in a state. With limit they're returned in
+    pages, see the list of testruns.
+    """
+    jobs = await job_rows.all(session, _jobs_query(current_user.id, state, after, limit))
+
+    return job_rows.response(next_page(request, response, jobs, limit, lambda job: job["id"]), response)
+
+
+def _new_job_query(user_id: int) -> Select[Tuple[models.Job]]:
+    return select(models.Job).where(
+        and_(
+            models.Job.state == JobState.NEW,
+            models.Job.user_id == user_id,
+        ),
+    )
 
 
 @router.get("/jobs/new", tags=["jobqueue"])
 async def get_new_job(
-    request: Request, current_user: User = Depends(get_current_active_user)
+    request: Request, session: DbSession, current_user: User = Depends(get_current_active_user)
 ) -> Job | None:
-    async with async_session() as session:
-        try:
-            res = await session.scalars(
-                select(models.Job).where(
-                    and_(
-                        models.Job.state == JobState.NEW,
-                        models.Job.user_id == current_user.id,
-                    ),
-                )
-            )
-            item = res.first()
-            if item is None:
-                return None
+    try:
+        res = await session.scalars(_new_job_query(current_user.id))
+        item = res.first()
+        if item is None:
+            return None
 
-            if request.client is not None:
-                item.worker = request.client.host
-            item.state = JobState.PENDING
-            item.updated_at = datetime.now(timezone.utc)
+        if request.client is not None:
+            item.worker = request.client.host
+        item.state = JobState.PENDING
+        item.updated_at = datetime.now(timezone.utc)
 
-            await session.commit()
-        except NoResultFound:
-            item = None
+        await session.commit()
+    except NoResultFound:
+        item = None
 
-        return Job.model_validate(item)
+    return Job.model_validate(item)
 
 
 @router.get("/jobs/{job_id}", tags=["jobqueue"])
 async def get_specific_job(
-    job_id: int, current_user: User = Depends(get_current_active_user)
+    job_id: int, session: ReadSession, current_user: User = Depends(get_current_active_user)
 ) -> Job:
-    async with async_session() as session:
-        return Job.model_validate(
-            (
-                await session.scalars(
-                    select(models.Job).where(
-                        and_(
-                            models.Job.id == job_id,
-                            models.Job.user_id == current_user.id,
-                        )
+    return Job.model_validate(
+        (
+            await session.scalars(
+                select(models.Job).where(
+                    and_(
+                        models.Job.id == job_id,
+                        models.Job.user_id == current_user.id,
                     )
                 )
-            ).one()
-        )
+            )
+        ).one()
+    )
 
 
 @router.post("/jobs/new", tags=["jobqueue"])
 async def create_job(
-    new_task: NewJob, current_user: User = Depends(get_current_active_user)
+    new_task: NewJob, session: DbSession, current_user: User = Depends(get_current_active_user)
 ) -> Job:
-    async with async_session() as session:
-        task = models.Job(
-            state=JobState.NEW,
-            updated_at=datetime.now(timezone.utc),
-            function_call=new_task.function_call,
-            parameters=new_task.parameters,
-            user_id=current_user.id,
-        )
+    task = models.Job(
+        state=JobState.NEW,
+        updated_at=datetime.now(timezone.utc),
+        function_call=new_task.function_call,
+        parameters=new_task.parameters,
+        user_id=current_user.id,
+    )
 
-        session.add(task)
-        await session.commit()
+    session.add(task)
+    await session.commit()
 
-        return Job.model_validate(task)
+    return Job.model_validate(task)
 
 
 @router.put("/jobs/{job_id}", tags=["jobqueue"])
 async def update_specific_job(
-    job_id: int, task: Job, current_user: User = Depends(get_current_active_user)
+    job_id: int, task: Job, session: DbSession, current_user: User = Depends(get_current_active_user)
 ) -> Job:
-    async with async_session() as session:
-        job = (
-            await session.scalars(
-                select(models.Job).where(
-                    and_(models.Job.id == job_id, models.Job.user_id == current_user.id)
-                )
+    job = (
+        await session.scalars(
+            select(models.Job).where(
+                and_(models.Job.id == job_id, models.Job.user_id == current_user.id)
             )
-        ).one()
+        )
+    ).one()
 
-        session.add(job.update_from_model(task))
-        await session.commit()
+    session.add(job.update_from_model(task))
+    await session.commit()
 
-        return Job.model_validate(job)
+    return Job.model_validate(job)
 
 
 @router.delete("/jobs/{job_id}", tags=["jobqueue"])
 async def delete_job(
-    job_id: int, request: Request, current_user: User = Depends(get_current_active_user)
+    job_id: int, request: Request, session: DbSession, current_user: User = Depends(get_current_active_user)
 ) -> Job | None:
-    async with async_session() as session:
-        try:
-            item = (
-                await session.scalars(
-                    select(models.Job).where(
-                        and_(
-                            models.Job.id == job_id,
-                            models.Job.user_id == current_user.id,
-                        )
+    try:
+        item = (
+            await session.scalars(
+                select(models.Job).where(
+                    and_(
+                        models.Job.id == job_id,
+                        models.Job.user_id == current_user.id,
                     )
                 )
-            ).one()
-            if item is None:
-                return None
-
-            item.state = JobState.COMPLETE
-            item.updated_at = datetime.now()
-            if request.client is not None:
-                item.worker = request.client.host
-
-            session.add(item)
-            await session.commit()
-        except NoResultFound:
-            item = None
-        return Job.model_validate(item)
+            )
+        ).one()
+        if item is None:
+            return None
+
+        item.state = JobState.COMPLETE
+        item.updated_at = datetime.now()
+        if request.client is not None:
+            item.worker = request.client.host
+
+        session.add(item)
+        await session.commit()
+    except NoResultFound:
+        item = None
+    return Job.model_validate(item)
@@ -5,7 +5,10 @@ from pydantic import BaseModel, ConfigDict
 from sqlalchemy import select
 
 from edea_ms.core.auth import CurrentUser
-from edea_ms.db import async_session, models
+from edea_ms.core.charts import chart_renderer
+from edea_ms.db import DbSession, ReadSession, models
+from edea_ms.db.columns import invalidate_columns
+from edea_ms.db.snapshots import bump_data_revision, testrun_snapshots
 
 
 class MeasurementColumn(BaseModel):
@@ -33,54 +36,64 @@ TODO: whole router subject to removal, not sure if we need this.
 @router.get("/measurement_columns", tags=["measurement_column"])
 async def get_measurement_columns(
     current_user: CurrentUser,
+    session: ReadSession,
 ) -> List[MeasurementColumn]:
-    async with async_session() as session:
-        columns: List[MeasurementColumn] = [
-            MeasurementColumn.model_validate(column)
-            for column in (
-                await session.scalars(select(models.MeasurementColumn))
-            ).all()
-        ]
-        return columns
+    columns: List[MeasurementColumn] = [
+        MeasurementColumn.model_validate(column)
+        for column in (
+            await session.scalars(select(models.MeasurementColumn))
+        ).all()
+    ]
+    return columns
 
 
 @router.post("/measurement_columns", tags=["measurement_column"])
 async def create_measurement_column(
     column: MeasurementColumn,
     current_user: CurrentUser,
+    session: DbSession,
 ) -> MeasurementColumn:
-    async with async_session() as session:
-        cur = models.MeasurementColumn()
-        cur.update_from_model(column)
+    cur = models.MeasurementColumn()
+    cur.update_from_model(column)
 
-        session.add(cur)
-        await session.commit()
+    session.add(cur)
+    await session.commit()
+    invalidate_columns(cur.project_id)
 
-        return MeasurementColumn.model_validate(cur)
+    return MeasurementColumn.model_validate(cur)
 
 
 @router.put("/measurement_columns/{id}", tags=["measurement_column"])
 async def get_measurement_column(
-    id: int, current_user: CurrentUser
+    id: int, current_user: CurrentUser, session: DbSession
 ) -> MeasurementColumn:
-    async with async_session() as session:
-        return MeasurementColumn.model_validate(
-            (
-                await session.scalars(
-                    select(models.MeasurementColumn).where(
-                        models.MeasurementColumn.id == id
-                    )
+    return MeasurementColumn.model_validate(
+        (
+            await session.scalars(
+                select(models.MeasurementColumn).where(
+                    models.MeasurementColumn.id == id
                 )
-            ).one()
-        )
+            )
+        ).one()
+    )
 
 
 @router.delete("/measurement_columns/{id}", tags=["measurement_column"])
 async def delete_measurement_column(
-    id: int, current_user: CurrentUser
+    id: int, current_user: CurrentUser, session: DbSession
 ) -> dict[str, int]:
-    async with async_session() as session:
-        await session.delete(models.MeasurementColumn(id=id))
-        await session.commit()
+    cur = (
+        await session.scalars(
+            select(models.MeasurementColumn).where(models.MeasurementColumn.id == id)
+        )
+    ).one()
+
+    await session.delete(cur)
+    # snapshots of any run of the project could include the column
+    await bump_data_revision(session, models.TestRun.project_id == cur.project_id)
+    await session.commit()
+    invalidate_columns(cur.project_id)
+    testrun_snapshots.clear()
+    chart_renderer.clear()
 
     return {"deleted_rows": 1}
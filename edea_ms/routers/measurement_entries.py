@@ -1,15 +1,31 @@
+import asyncio
+import os
+import time
 from datetime import datetime
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, ConfigDict
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from pydantic import BaseModel, ConfigDict, TypeAdapter, ValidationError
 from sqlalchemy import and_, select
 from sqlalchemy.exc import NoResultFound
-
-from edea_ms.core.auth import CurrentUser
-from edea_ms.db import async_session, models
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import ClientDisconnect
+
+from edea_ms.core.auth import CurrentUser, get_current_active_user
+from edea_ms.core.charts import chart_renderer
+from edea_ms.db import DbSession, models
+from edea_ms.db.columns import get_or_create_columns
+from edea_ms.db.snapshots import bump_data_revision, testrun_snapshots
+from edea_ms.db.writer import write_coalescer
 from edea_ms.routers.measurement_columns import MeasurementColumn
-from edea_ms.routers.testruns import TestRun
 
 
 class MeasurementEntry(BaseModel):
@@ -27,126 +43,307 @@ class MeasurementEntry(BaseModel):
 
 router = APIRouter()
 
+# defaults for committing streamed measurement entries in chunks
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "1000"))
+INGEST_CHUNK_SECONDS = float(os.getenv("INGEST_CHUNK_SECONDS", "5"))
+
 
-class BatchInput(BaseModel):
+class StepInput(BaseModel):
     sequence_number: int
-    testrun_id: int
     payload: dict[str, Any]  # mapping of column name to result value
 
 
+class BatchInput(StepInput):
+    testrun_id: int
+
+
+class BulkInput(BaseModel):
+    testrun_id: int
+    steps: list[StepInput]
+
+
+_websocket_steps: TypeAdapter[StepInput | list[StepInput]] = TypeAdapter(
+    StepInput | list[StepInput]
+)
+
+
+async def _get_running_testrun(
+    session: AsyncSession, testrun_id: int, current_user: models.User
+) -> models.TestRun:
+    run = (
+        await session.scalars(
+            select(models.TestRun).where(
+                and_(
+                    models.TestRun.id == testrun_id,
+                    models.TestRun.user_id == current_user.id,
+                )
+            )
+        )
+    ).one()
+
+    # check first if the run is in the right state
+    if run.state != models.TestRunState.RUNNING:
+        raise HTTPException(
+            status_code=400, detail=f"run {run.id} is not set to RUNNING state"
+        )
+
+    return run
+
+
+def _entry_rows(
+    run: models.TestRun, columns: dict[str, int], steps: list[StepInput]
+) -> list[dict[str, Any]]:
+    rows: list[dict[str, Any]] = []
+
+    for step in steps:
+        for k, v in step.payload.items():
+            numeric = type(v) in [float, int]
+            rows.append(
+                {
+                    "sequence_number": step.sequence_number,
+                    "testrun_id": run.id,
+                    "column_id": columns[k],
+                    "numeric_value": v if numeric else None,
+                    "string_value": None if numeric else str(v),
+                }
+            )
+
+    return rows
+
+
+async def _store_steps(
+    session: AsyncSession, run: models.TestRun, steps: list[StepInput]
+) -> int:
+    """
+    _store_steps resolves the columns of all steps and hands the entries to the write coalescer,
+    it returns once they're committed together with the rows of other concurrent requests.
+    """
+    names = {k for step in steps for k in step.payload.keys()}
+    if not names:
+        return 0
+
+    columns = await get_or_create_columns(session, run.project_id, names)
+    # new columns need to be visible to the writer before the entries referencing them
+    await session.commit()
+
+    return await write_coalescer.submit(
+        models.MeasurementEntry.__table__,  # type: ignore[arg-type]
+        _entry_rows(run, columns, steps),
+    )
+
+
 @router.post("/measurement_entries/batch", tags=["measurement_entry"], status_code=201)
 async def batch_create_measurement_entries(
     batch_input: BatchInput,
     current_user: CurrentUser,
+    session: DbSession,
 ) -> None:
-    async with async_session() as session:
-        test_run = TestRun.model_validate(
-            (
-                await session.scalars(
-                    select(models.TestRun).where(
-                        and_(
-                            models.TestRun.id == batch_input.testrun_id,
-                            models.TestRun.user_id == current_user.id,
-                        )
-                    )
-                )
-            ).one()
-        )
+    run = await _get_running_testrun(session, batch_input.testrun_id, current_user)
+    await _store_steps(session, run, [batch_input])
 
-        # check first if the run is in the right state
-        if test_run.state != models.TestRunState.RUNNING:
-            raise HTTPException(
-                status_code=400, detail=f"run {test_run.id} is not set to RUNNING state"
-            )
 
-        for k, v in batch_input.payload.items():
-            res = await session.scalars(
-                select(models.MeasurementColumn).where(
-                    and_(
-                        models.MeasurementColumn.name == k,
-                        models.MeasurementColumn.project_id == test_run.project_id,
-                    )
-                )
-            )
+@router.post("/measurement_entries/bulk", tags=["measurement_entry"], status_code=201)
+async def bulk_create_measurement_entries(
+    bulk_input: BulkInput,
+    current_user: CurrentUser,
+    session: DbSession,
+) -> dict[str, int]:
+    """
+    Store the results of many steps of a testrun at once. The run state is checked once and all
+    entries are written in a single transaction.
+    """
+    run = await _get_running_testrun(session, bulk_input.testrun_id, current_user)
+    inserted = await _store_steps(session, run, bulk_input.steps)
+
+    return {"inserted_rows": inserted}
+
+
+def _parse_step(line: bytes, line_number: int, inserted: int) -> StepInput:
+    try:
+        return StepInput.model_validate_json(line)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "msg": f"invalid step in line {line_number}",
+                "errors": e.errors(include_url=False, include_context=False),
+                "inserted_rows": inserted,
+            },
+        ) from e
+
+
+@router.post(
+    "/measurement_entries/stream/{testrun_id}",
+    tags=["measurement_entry"],
+    status_code=201,
+)
+async def stream_measurement_entries(
+    testrun_id: int,
+    request: Request,
+    current_user: CurrentUser,
+    session: DbSession,
+    chunk_rows: int = Query(default=INGEST_CHUNK_ROWS, gt=0),
+    chunk_seconds: float = Query(default=INGEST_CHUNK_SECONDS, gt=0),
+) -> dict[str, int]:
+    """
+    Store steps of a testrun from a newline delimited JSON stream, one step (sequence_number and
+    payload) per line. The steps get committed in chunks once chunk_rows steps were received or
+    chunk_seconds passed since the last commit, whatever comes first, also while the client sends
+    nothing. If the client disconnects the complete lines received so far are still committed.
+    """
+    inserted = 0
+    commits = 0
+    line_number = 0
+    pending: list[StepInput] = []
+    buf = b""
+
+    run = await _get_running_testrun(session, testrun_id, current_user)
+    # don't hold on to the writer connection while waiting for the client
+    await session.commit()
+    last_commit = time.monotonic()
+
+    async def flush() -> None:
+        nonlocal inserted, commits, last_commit
+        inserted += await _store_steps(session, run, pending)
+        pending.clear()
+        commits += 1
+        last_commit = time.monotonic()
+
+    chunks = request.stream()
+    # the receive keeps running while pending steps are committed, cancelling it would end the stream
+    next_chunk: asyncio.Future[bytes] | None = None
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(anext(chunks))
+            timeout = max(chunk_seconds - (time.monotonic() - last_commit), 0) if pending else None
+            if not (await asyncio.wait({next_chunk}, timeout=timeout))[0]:
+                await flush()
+                continue
 
             try:
-                column = res.one()
-            except NoResultFound:
-                column = None
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                break
+            except ClientDisconnect:
+                # an incomplete last line is dropped, it could be cut off anywhere
+                buf = b""
+                break
+            next_chunk = None
+
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    pending.append(_parse_step(line, line_number, inserted))
+
+            if len(pending) >= chunk_rows or (
+                pending and time.monotonic() - last_commit >= chunk_seconds
+            ):
+                await flush()
+    finally:
+        if next_chunk is not None:
+            next_chunk.cancel()
+
+    # the last line doesn't need a trailing newline
+    if buf.strip():
+        pending.append(_parse_step(buf, line_number + 1, inserted))
+
+    if pending:
+        await flush()
+
+    return {"inserted_rows": inserted, "commits": commits}
+
+
+@router.websocket("/measurement_entries/ws/{testrun_id}")
+async def measurement_entries_websocket(
+    websocket: WebSocket, testrun_id: int, session: DbSession
+) -> None:
+    """
+    Persistent channel for a running testrun. Each message is a step or a list of steps
+    (sequence_number and payload), every message gets committed and acknowledged with the highest
+    sequence number committed so far. Ownership and run state are only checked once on connect.
+    """
+    try:
+        current_user = get_current_active_user()
+        run = await _get_running_testrun(session, testrun_id, current_user)
+    except (HTTPException, NoResultFound) as e:
+        reason = e.detail if isinstance(e, HTTPException) else "testrun not found"
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(reason))
+        return
+
+    # don't hold on to the writer connection while waiting for messages
+    await session.commit()
+    await websocket.accept()
+
+    inserted = 0
+    committed: int | None = None
+
+    try:
+        while True:
+            message = await websocket.receive_text()
 
-            if column is None:
-                column = models.MeasurementColumn(
-                    name=k, project_id=test_run.project_id
+            try:
+                steps = _websocket_steps.validate_json(message)
+            except ValidationError as e:
+                await websocket.send_json(
+                    {"error": e.errors(include_url=False, include_context=False)}
                 )
-                session.add(column)
-                await session.commit()
+                continue
 
-            entry = models.MeasurementEntry(
-                sequence_number=batch_input.sequence_number,
-                testrun_id=test_run.id,
-                column_id=column.id,
-            )
+            if isinstance(steps, StepInput):
+                steps = [steps]
+            if not steps:
+                continue
 
-            if type(v) in [float, int]:
-                entry.numeric_value = v
-            else:
-                entry.string_value = str(v)
-            session.add(entry)
+            inserted += await _store_steps(session, run, steps)
 
-        await session.commit()
+            highest = max(step.sequence_number for step in steps)
+            committed = highest if committed is None else max(committed, highest)
+            await websocket.send_json({"committed": committed, "inserted_rows": inserted})
+    except WebSocketDisconnect:
+        pass
 
 
 @router.post("/measurement_entries", tags=["measurement_entry"])
 async def create_measurement_entry(
     entry: MeasurementEntry,
     current_user: CurrentUser,
+    session: DbSession,
 ) -> MeasurementEntry:
-    async with async_session() as session:
-        testrun = (
-            await session.scalars(
-                select(models.TestRun).where(
-                    and_(
-                        models.TestRun.id == entry.testrun_id,
-                        models.TestRun.user_id == current_user.id,
-                    )
-                )
-            )
-        ).one()
-
-        res = await session.scalars(
-            select(models.MeasurementColumn).where(
+    testrun = (
+        await session.scalars(
+            select(models.TestRun).where(
                 and_(
-                    models.MeasurementColumn.name == entry.column.name,
-                    models.MeasurementColumn.project_id == testrun.project_id,
+                    models.TestRun.id == entry.testrun_id,
+                    models.TestRun.user_id == current_user.id,
                 )
             )
         )
-
-        try:
-            column = res.one()
-        except NoResultFound:
-            column = None
-
-        if column is None:
-            column = models.MeasurementColumn(
-                name=entry.column.name, project_id=testrun.project_id
-            )
-            session.add(column)
-            await session.commit()
-
-        new_entry = models.MeasurementEntry(
-            sequence_number=entry.sequence_number,
-            testrun_id=testrun.id,
-            column_id=column.id,
-        )
-
-        if entry.numeric_value is not None:
-            new_entry.numeric_value = entry.numeric_value
-        else:
-            new_entry.string_value = entry.string_value
-        session.add(new_entry)
-
-        await session.commit()
+    ).one()
+
+    columns = await get_or_create_columns(
+        session, testrun.project_id, {entry.column.name}
+    )
+
+    await session.commit()
+
+    await write_coalescer.submit(
+        models.MeasurementEntry.__table__,  # type: ignore[arg-type]
+        [
+            {
+                "sequence_number": entry.sequence_number,
+                "testrun_id": testrun.id,
+                "column_id": columns[entry.column.name],
+                "numeric_value": entry.numeric_value,
+                "string_value": None
+                if entry.numeric_value is not None
+                else entry.string_value,
+            }
+        ],
+    )
 
     return MeasurementEntry.model_validate(entry)
 
@@ -156,26 +353,38 @@ async def update_measurement_entry(
     id: int,
     entry: MeasurementEntry,
     current_user: CurrentUser,
+    session: DbSession,
 ) -> MeasurementEntry:
-    async with async_session() as session:
-        cur = (
-            await session.scalars(
-                select(models.MeasurementEntry).where(models.MeasurementEntry.id == id)
-            )
-        ).one()
+    cur = (
+        await session.scalars(
+            select(models.MeasurementEntry).where(models.MeasurementEntry.id == id)
+        )
+    ).one()
 
-        cur.update_from_model(entry)
-        await session.commit()
+    cur.update_from_model(entry)
+    await bump_data_revision(session, models.TestRun.id == cur.testrun_id)
+    await session.commit()
+    testrun_snapshots.invalidate(cur.testrun_id)
+    chart_renderer.invalidate(cur.testrun_id)
 
-        return MeasurementEntry.model_validate(cur)
+    return MeasurementEntry.model_validate(cur)
 
 
 @router.delete("/measurement_entries/{id}", tags=["measurement_entry"])
 async def delete_measurement_entry(
-    id: int, current_user: CurrentUser
+    id: int, current_user: CurrentUser, session: DbSession
 ) -> dict[str, int]:
-    async with async_session() as session:
-        await session.delete(models.MeasurementEntry(id=id))
-        await session.commit()
+    cur = (
+        await session.scalars(
+            select(models.MeasurementEntry).where(models.MeasurementEntry.id == id)
+        )
+    ).one()
+
+    await session.delete(cur)
+    # a deleted id can be used again by the next insert, which wouldn't change the data version otherwise
+    await bump_data_revision(session, models.TestRun.id == cur.testrun_id)
+    await session.commit()
+    testrun_snapshots.invalidate(cur.testrun_id)
+    chart_renderer.invalidate(cur.testrun_id)
 
     return {"deleted_rows": 1}
@@ -0,0 +1,41 @@
+from typing import Any
+
+from fastapi import APIRouter
+
+from edea_ms.core.auth import CurrentUser
+from edea_ms.core.cache import cache_stats
+from edea_ms.db import PRAGMA_PROFILE, PRAGMA_PROFILES, ReadSession
+from edea_ms.db.writer import write_coalescer
+
+router = APIRouter()
+
+
+@router.get("/metrics/caches", tags=["metrics"])
+async def get_cache_metrics(current_user: CurrentUser) -> dict[str, dict[str, int]]:
+    """
+    Size, hit and miss counters of the in-process caches of this worker.
+    """
+    return cache_stats()
+
+
+@router.get("/metrics/writer", tags=["metrics"])
+async def get_writer_metrics(current_user: CurrentUser) -> dict[str, float | int]:
+    """
+    Queue depth and flush latency of the write coalescer used for ingest.
+    """
+    return write_coalescer.stats()
+
+
+@router.get("/metrics/db", tags=["metrics"])
+async def get_db_settings(current_user: CurrentUser, session: ReadSession) -> dict[str, Any]:
+    """
+    The pragma profile and the effective pragma values of a database connection.
+    """
+    pragmas: dict[str, Any] = {}
+
+    if session.bind.dialect.name == "sqlite":
+        conn = await session.connection()
+        for name in PRAGMA_PROFILES["wal"]:
+            pragmas[name] = (await conn.exec_driver_sql(f"PRAGMA {name}")).scalar()
+
+    return {"profile": PRAGMA_PROFILE, "pragmas": pragmas}
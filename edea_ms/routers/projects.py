@@ -1,14 +1,16 @@
 from typing import Annotated, List
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from pydantic import BaseModel, ConfigDict
-from sqlalchemy import and_, select
+from sqlalchemy import and_, delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.mutable import MutableList
 
 from edea_ms.core.auth import CurrentUser
 from edea_ms.core.helpers import prj_unique_field, tryint
-from edea_ms.db import async_session, models
-from edea_ms.db.queries import all_projects, single_project
+from edea_ms.core.rows import Rows
+from edea_ms.db import DbSession, ReadSession, models
+from edea_ms.db.queries import all_projects, invalidate_project_access, single_project
 
 router = APIRouter()
 
@@ -30,42 +32,56 @@ class Project(BaseModel):
     groups: list[str]
 
 
-@router.get("/projects", tags=["projects"])
+project_rows = Rows(Project, models.Project)
+
+
+async def _sync_groups(session: AsyncSession, project: models.Project) -> None:
+    """
+    _sync_groups replaces the project_groups rows of a project with its current groups.
+    """
+    await session.execute(
+        delete(models.ProjectGroup).where(models.ProjectGroup.project_id == project.id)
+    )
+    if project.groups:
+        await session.execute(
+            insert(models.ProjectGroup),
+            [{"project_id": project.id, "group": group} for group in set(project.groups)],
+        )
+
+
+@router.get("/projects", tags=["projects"], response_model=List[Project])
 async def get_projects(
     current_user: CurrentUser,
-) -> List[Project]:
-    async with async_session() as session:
-        projects: List[Project] = [
-            Project.model_validate(project)
-            for project in (await session.scalars(all_projects(current_user))).all()
-        ]
-        return projects
+    session: ReadSession,
+) -> Response:
+    return project_rows.response(await project_rows.all(session, all_projects(current_user)))
 
 
 @router.get("/projects/{ident}", tags=["testrun"])
 async def get_specific_project(
-    ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser
+    ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser, session: ReadSession
 ) -> Project:
-    async with async_session() as session:
-        return Project.model_validate(
-            (await session.scalars(single_project(current_user, ident))).one()
-        )
+    return Project.model_validate(
+        (await session.scalars(single_project(current_user, ident))).one()
+    )
 
 
 @router.post("/projects", tags=["projects"])
-async def create_project(project: NewProject, current_user: CurrentUser) -> Project:
-    async with async_session() as session:
-        cur = models.Project(user_id=current_user.id)
-        cur.update_from_model(project)
+async def create_project(project: NewProject, current_user: CurrentUser, session: DbSession) -> Project:
+    cur = models.Project(user_id=current_user.id)
+    cur.update_from_model(project)
 
-        # explicitely set to empty list of groups if it's not set
-        if project.groups is None:
-            cur.groups = MutableList()
+    # explicitely set to empty list of groups if it's not set
+    if project.groups is None:
+        cur.groups = MutableList()
 
-        session.add(cur)
-        await session.commit()
+    session.add(cur)
+    await session.flush()
+    await _sync_groups(session, cur)
+    await session.commit()
+    invalidate_project_access()
 
-        return Project.model_validate(cur)
+    return Project.model_validate(cur)
 
 
 @router.put("/projects/{ident}", tags=["projects"])
@@ -73,41 +89,46 @@ async def update_project(
     ident: Annotated[int | str, Depends(tryint)],
     project: Project,
     current_user: CurrentUser,
+    session: DbSession,
 ) -> Project:
-    async with async_session() as session:
-        cur = (
-            await session.scalars(
-                select(models.Project).where(
-                    and_(
-                        prj_unique_field(ident) == ident,
-                        models.Project.user_id == current_user.id,
-                    )
+    cur = (
+        await session.scalars(
+            select(models.Project).where(
+                and_(
+                    prj_unique_field(ident) == ident,
+                    models.Project.user_id == current_user.id,
                 )
             )
-        ).one()
+        )
+    ).one()
 
-        cur.update_from_model(project)
-        await session.commit()
+    cur.update_from_model(project)
+    await _sync_groups(session, cur)
+    await session.commit()
+    invalidate_project_access()
 
-        return Project.model_validate(cur)
+    return Project.model_validate(cur)
 
 
 @router.delete("/projects/{ident}", tags=["projects"])
 async def delete_project(
-    ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser
+    ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser, session: DbSession
 ) -> dict[str, int]:
-    async with async_session() as session:
-        cur = (
-            await session.scalars(
-                select(models.Project).where(
-                    and_(
-                        prj_unique_field(ident) == ident,
-                        models.Project.user_id == current_user.id,
-                    )
+    cur = (
+        await session.scalars(
+            select(models.Project).where(
+                and_(
+                    prj_unique_field(ident) == ident,
+                    models.Project.user_id == current_user.id,
                 )
             )
-        ).one()
-        await session.delete(cur)
-        await session.commit()
+        )
+    ).one()
+    await session.execute(
+        delete(models.ProjectGroup).where(models.ProjectGroup.project_id == cur.id)
+    )
+    await session.delete(cur)
+    await session.commit()
+    invalidate_project_access()
 
     return {"deleted_rows": 1}
@@ -1,16 +1,16 @@
-from operator import or_
 from typing import List
 
 import sqlalchemy
 import sqlalchemy.exc
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
 from pydantic import BaseModel, ConfigDict
 from sqlalchemy import and_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from edea_ms.core.auth import CurrentUser
-from edea_ms.db import async_session, models
-from edea_ms.db.queries import common_project_ids
+from edea_ms.core.rows import Rows
+from edea_ms.db import DbSession, ReadSession, models
+from edea_ms.db.queries import accessible_project_ids, has_project_access
 
 
 class Specification(BaseModel):
@@ -25,68 +25,45 @@ class Specification(BaseModel):
     maximum: float | None = None
 
 
+specification_rows = Rows(Specification, models.Specification)
+
 router = APIRouter()
 
 
 async def has_user_project_access(
     project_id: int, current_user: models.User, session: AsyncSession
 ) -> None:
-    try:
-        (
-            await session.scalars(
-                select(models.Project).where(
-                    and_(
-                        models.Project.id == project_id,
-                        or_(
-                            models.Project.user_id == current_user.id,
-                            models.Project.id.in_(common_project_ids(current_user)),
-                        ),
-                    )
-                )
-            )
-        ).one()
-    except sqlalchemy.exc.NoResultFound as e:
+    if not await has_project_access(session, current_user, project_id):
         # TODO: handle user access exception
-        raise e
+        raise sqlalchemy.exc.NoResultFound("No row was found when one was required")
 
 
-@router.get("/specifications/project/{project_id}", tags=["specification"])
+@router.get("/specifications/project/{project_id}", tags=["specification"], response_model=List[Specification])
 async def get_project_specifications(
-    project_id: int, current_user: CurrentUser
-) -> list[Specification]:
-    async with async_session() as session:
-        # check if project is owned by the user
-        await has_user_project_access(project_id, current_user, session)
-
-        specs: List[Specification] = [
-            Specification.model_validate(spec)
-            for spec in (
-                (
-                    await session.scalars(
-                        select(models.Specification).where(
-                            models.Specification.project_id == project_id
-                        )
-                    )
-                ).all()
-            )
-        ]
-        return specs
+    project_id: int, current_user: CurrentUser, session: ReadSession
+) -> Response:
+    # check if project is owned by the user
+    await has_user_project_access(project_id, current_user, session)
+
+    specs = await specification_rows.all(
+        session, select(models.Specification).where(models.Specification.project_id == project_id)
+    )
+    return specification_rows.response(specs)
 
 
 @router.post("/specifications", tags=["specification"], status_code=201)
 async def create_specification(
-    spec: Specification, current_user: CurrentUser
+    spec: Specification, current_user: CurrentUser, session: DbSession
 ) -> Specification:
-    async with async_session() as session:
-        await has_user_project_access(spec.project_id, current_user, session)
+    await has_user_project_access(spec.project_id, current_user, session)
 
-        cur = models.Specification()
-        cur.update_from_model(spec)
+    cur = models.Specification()
+    cur.update_from_model(spec)
 
-        session.add(cur)
-        await session.commit()
+    session.add(cur)
+    await session.commit()
 
-        return Specification.model_validate(cur)
+    return Specification.model_validate(cur)
 
 
 @router.put("/specifications/{id}", tags=["specification"])
@@ -94,39 +71,38 @@ async def update_specification(
     id: int,
     spec: Specification,
     current_user: CurrentUser,
+    session: DbSession,
 ) -> Specification:
-    async with async_session() as session:
-        await has_user_project_access(spec.project_id, current_user, session)
+    await has_user_project_access(spec.project_id, current_user, session)
 
-        cur = (
-            await session.scalars(
-                select(models.Specification).where(models.Specification.id == id)
-            )
-        ).one()
+    cur = (
+        await session.scalars(
+            select(models.Specification).where(models.Specification.id == id)
+        )
+    ).one()
 
-        cur.update_from_model(spec)
-        await session.commit()
+    cur.update_from_model(spec)
+    await session.commit()
 
-        return Specification.model_validate(cur)
+    return Specification.model_validate(cur)
 
 
 @router.delete("/specifications/{id}", tags=["specification"])
-async def delete_specification(id: int, current_user: CurrentUser) -> dict[str, int]:
-    async with async_session() as session:
-        spec = (
-            await session.scalars(
-                select(models.Specification).where(
-                    and_(
-                        models.Specification.id == id,
-                        models.Specification.project_id.in_(
-                            common_project_ids(current_user)
-                        ),
-                    )
+async def delete_specification(id: int, current_user: CurrentUser, session: DbSession) -> dict[str, int]:
+    spec = (
+        await session.scalars(
+            select(models.Specification).where(
+                and_(
+                    models.Specification.id == id,
+                    models.Specification.project_id.in_(
+                        await accessible_project_ids(session, current_user)
+                    ),
                 )
             )
-        ).one()
+        )
+    ).one()
 
-        await session.delete(spec)
-        await session.commit()
+    await session.delete(spec)
+    await session.commit()
 
     return {"deleted_rows": 1}
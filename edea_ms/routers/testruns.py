@@ -1,31 +1,39 @@
-import contextlib
+import asyncio
 import io
-from collections.abc import Iterator
+import os
+from collections.abc import AsyncIterator
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Annotated, Any, List
+from typing import Annotated, Any, Iterable, List, Tuple
 
 import polars as pl
-from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
+import pyarrow.parquet as pq
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, ConfigDict
-from sqlalchemy import and_, or_, select
+from sqlalchemy import ColumnElement, Integer, Select, and_, func, insert, or_, select, type_coerce, union_all
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
 
 from edea_ms.core.auth import CurrentUser
+from edea_ms.core.charts import ChartKey, chart_renderer, has_altair, has_vl_convert, spec_hash
+from edea_ms.core.downsample import decimate
+from edea_ms.core.pagination import After, Limit, next_page, paginate
+from edea_ms.core.rows import Rows
 from edea_ms.core.helpers import tr_unique_field, tryint
-from edea_ms.db import async_session, models
+from edea_ms.db import DbSession, ReadSession, models
+from edea_ms.db.columns import get_or_create_columns, invalidate_columns
+from edea_ms.db.frames import insert_frame, read_frames
 from edea_ms.db.models import TestRunState
-from edea_ms.db.queries import common_project_ids
-
-with contextlib.suppress(ImportError):
-    import altair as alt
-    import vl_convert as vlc  # type: ignore
+from edea_ms.db.queries import accessible_project_ids, has_project_access
+from edea_ms.db.snapshots import FINISHED_STATES, data_version, testrun_snapshots
 
 router = APIRouter()
 
+# number of sequence numbers read, pivoted and sent at once by streaming exports
+EXPORT_WINDOW_STEPS = int(os.getenv("EXPORT_WINDOW_STEPS", "10000"))
+
 
 class NewTestRun(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -49,6 +57,9 @@ class TestRun(NewTestRun):
     state: TestRunState
 
 
+testrun_rows = Rows(TestRun, models.TestRun)
+
+
 class TestColumn(BaseModel):
     """
     MeasurementColumn with a few fields omitted
@@ -70,6 +81,12 @@ class TestSetup(BaseModel):
 class DataExportFormat(Enum):
     CSV = "csv"
     JSON = "json"
+    NDJSON = "ndjson"
+    PARQUET = "parquet"
+
+
+class DataImportFormat(Enum):
+    ARROW = "arrow"
     PARQUET = "parquet"
 
 
@@ -79,63 +96,107 @@ class ChartExportFormat(Enum):
     HTML = "html"
 
 
-class WrappedIO:
-    """WrappedIO is a minimal wrapper to allow string or bytes writes to the same
-    underlying buffer.
+class ChunkedIO(io.RawIOBase):
+    """ChunkedIO collects writes until they're drained, it keeps counting the position so
+    writers which record offsets (like parquet) keep working.
     """
 
     def __init__(self) -> None:
-        self.buf = io.BytesIO()
+        self.chunks: list[bytes] = []
+        self.position = 0
 
-    def write(self, b: bytes | str) -> int:
-        return self.buf.write(b.encode()) if isinstance(b, str) else self.write(b)
+    def writable(self) -> bool:
+        return True
 
-    def seek(self, offset: int) -> int:
-        return self.buf.seek(offset)
+    def write(self, b: bytes) -> int:  # type: ignore[override]
+        self.chunks.append(bytes(b))
+        self.position += len(b)
+        return len(b)
 
-    def __iter__(self) -> Iterator[bytes]:
-        return self.buf.__iter__()
+    def tell(self) -> int:
+        return self.position
 
-    def __next__(self) -> bytes:
-        return self.buf.__next__()
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
 
 
-@router.get("/testruns", tags=["testrun"])
-async def get_all_testruns(
-        current_user: CurrentUser,
-) -> List[TestRun]:
-    async with async_session() as session:
-        items: List[TestRun] = [
-            TestRun.model_validate(item)
-            for item in (
-                await session.scalars(
-                    select(models.TestRun).where(
-                        or_(
-                            models.TestRun.user_id == current_user.id,
-                            models.TestRun.project_id.in_(
-                                common_project_ids(current_user)
-                            ),
-                        )
-                    )
-                )
-            ).all()
-        ]
-        return items
+def testrun_filters(
+        state: TestRunState | None = None,
+        dut_id: str | None = None,
+        test_name: str | None = None,
+        created_after: datetime | None = None,
+        created_before: datetime | None = None,
+) -> list[ColumnElement[bool]]:
+    """
+    Filters for testrun lists, only runs matching all of the given ones are returned.
+    """
+    filters = []
+    if state is not None:
+        filters.append(models.TestRun.state == state)
+    if dut_id is not None:
+        filters.append(models.TestRun.dut_id == dut_id)
+    if test_name is not None:
+        filters.append(models.TestRun.test_name == test_name)
+    if created_after is not None:
+        filters.append(models.TestRun.created_at >= created_after)
+    if created_before is not None:
+        filters.append(models.TestRun.created_at < created_before)
+    return filters
 
 
-@router.get("/testruns/overview", tags=["testrun"])
-async def testruns_overview(
+TestRunFilters = Annotated[list[ColumnElement[bool]], Depends(testrun_filters)]
+
+
+def _testruns_query(
+        current_user: models.User,
+        project_ids: Iterable[int],
+        filters: list[ColumnElement[bool]],
+        after: int | None = None,
+        limit: int | None = None,
+) -> Select[Tuple[models.TestRun]]:
+    q = select(models.TestRun).where(
+        or_(
+            models.TestRun.user_id == current_user.id,
+            models.TestRun.project_id.in_(project_ids),
+        ),
+        *filters,
+    )
+    return paginate(q, models.TestRun.id, after, limit)
+
+
+@router.get("/testruns", tags=["testrun"], response_model=List[TestRun])
+async def get_all_testruns(
         current_user: CurrentUser,
-) -> List[TestRun]:
+        session: ReadSession,
+        request: Request,
+        response: Response,
+        filters: TestRunFilters,
+        limit: Limit = None,
+        after: After = None,
+) -> Response:
     """
-    testruns_overview returns up to the five most recent testruns from the last 7 days.
+    Lists the testruns of the user and of the projects the user has access to, ordered by id.
+
+    With limit, the runs are returned in pages of that many runs. The Link header (rel="next") and X-Next-Cursor
+    header point to the next page, the cursor is passed to it as after.
     """
-    q = (
+    project_ids = await accessible_project_ids(session, current_user)
+    runs = await testrun_rows.all(session, _testruns_query(current_user, project_ids, filters, after, limit))
+
+    return testrun_rows.response(next_page(request, response, runs, limit, lambda run: run["id"]), response)
+
+
+def _overview_query(
+        current_user: models.User, project_ids: Iterable[int]
+) -> Select[Tuple[models.TestRun]]:
+    return (
         select(models.TestRun)
         .where(
             or_(
                 models.TestRun.user_id == current_user.id,
-                models.TestRun.project_id.in_(common_project_ids(current_user)),
+                models.TestRun.project_id.in_(project_ids),
             )
         )
         .where(models.TestRun.created_at >= datetime.now() - timedelta(days=7))
@@ -143,16 +204,26 @@ async def testruns_overview(
         .limit(5)
     )
 
-    async with async_session() as session:
-        items: List[TestRun] = [
-            TestRun.model_validate(item) for item in (await session.scalars(q)).all()
-        ]
-        return items
+
+@router.get("/testruns/overview", tags=["testrun"])
+async def testruns_overview(
+        current_user: CurrentUser,
+        session: ReadSession,
+) -> List[TestRun]:
+    """
+    testruns_overview returns up to the five most recent testruns from the last 7 days.
+    """
+    q = _overview_query(current_user, await accessible_project_ids(session, current_user))
+
+    items: List[TestRun] = [
+        TestRun.model_validate(item) for item in (await session.scalars(q)).all()
+    ]
+    return items
 
 
 @router.get("/testruns/{ident}", tags=["testrun"])
 async def get_testrun(
-        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser
+        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser, session: ReadSession
 ) -> TestRun:
     """
     Get a testrun by numeric id or short-code string
@@ -165,72 +236,68 @@ async def get_testrun(
             tr_unique_field(ident) == ident,
             or_(
                 models.TestRun.user_id == current_user.id,
-                models.TestRun.project_id.in_(common_project_ids(current_user)),
+                models.TestRun.project_id.in_(await accessible_project_ids(session, current_user)),
             ),
         )
     )
 
-    async with async_session() as session:
-        return TestRun.model_validate((await session.scalars(q)).one())
+    return TestRun.model_validate((await session.scalars(q)).one())
 
 
-@router.get("/testruns/project/{ident}", tags=["testrun"])
+@router.get("/testruns/project/{ident}", tags=["testrun"], response_model=List[TestRun])
 async def get_project_testruns(
-        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser
-) -> list[TestRun]:
+        ident: Annotated[int | str, Depends(tryint)],
+        current_user: CurrentUser,
+        session: ReadSession,
+        request: Request,
+        response: Response,
+        filters: TestRunFilters,
+        limit: Limit = None,
+        after: After = None,
+) -> Response:
     """
-    Retrieve all testruns for a project
+    Retrieve all testruns for a project, paginated and filtered like the list of all testruns
 
     - **id**: project id or project number string
     """
 
-    async with async_session() as session:
-        # check if it's a project short code and iff, get the project id
-        if isinstance(ident, str):
-            project_q = select(models.Project).where(models.Project.short_code == ident)
-            ident = (await session.scalars(project_q)).one().id
+    # check if it's a project short code and iff, get the project id
+    if isinstance(ident, str):
+        project_q = select(models.Project).where(models.Project.short_code == ident)
+        ident = (await session.scalars(project_q)).one().id
+
+    project_ids = await accessible_project_ids(session, current_user)
+    q = _testruns_query(current_user, project_ids, [models.TestRun.project_id == ident, *filters], after, limit)
+    runs = await testrun_rows.all(session, q)
 
-        q = select(models.TestRun).where(
+    return testrun_rows.response(next_page(request, response, runs, limit, lambda run: run["id"]), response)
+
+
+@router.post("/testruns", tags=["testrun"], status_code=201)
+async def create_testrun(new_run: NewTestRun, current_user: CurrentUser, session: DbSession) -> TestRun:
+    res = await session.scalars(
+        select(models.TestRun).where(
             and_(
-                models.TestRun.project_id == ident,
+                models.TestRun.short_code == new_run.short_code,
                 or_(
                     models.TestRun.user_id == current_user.id,
-                    models.TestRun.project_id.in_(common_project_ids(current_user)),
+                    models.TestRun.project_id.in_(await accessible_project_ids(session, current_user)),
                 ),
             )
         )
-        specs: List[TestRun] = [
-            TestRun.model_validate(run) for run in ((await session.scalars(q)).all())
-        ]
-        return specs
-
-
-@router.post("/testruns", tags=["testrun"], status_code=201)
-async def create_testrun(new_run: NewTestRun, current_user: CurrentUser) -> TestRun:
-    async with async_session() as session:
-        res = await session.scalars(
-            select(models.TestRun).where(
-                and_(
-                    models.TestRun.short_code == new_run.short_code,
-                    or_(
-                        models.TestRun.user_id == current_user.id,
-                        models.TestRun.project_id.in_(common_project_ids(current_user)),
-                    ),
-                )
-            )
-        )
-        try:
-            run = res.one()
-        except NoResultFound:
-            run = None
-
-        if run is None:
-            run = models.TestRun(user_id=current_user.id)
-            run.update_from_model(new_run)
-            session.add(run)
-            await session.commit()
+    )
+    try:
+        run = res.one()
+    except NoResultFound:
+        run = None
+
+    if run is None:
+        run = models.TestRun(user_id=current_user.id)
+        run.update_from_model(new_run)
+        session.add(run)
+        await session.commit()
 
-        return TestRun.model_validate(run)
+    return TestRun.model_validate(run)
 
 
 @router.put("/testruns/{ident}", tags=["testrun"])
@@ -238,23 +305,23 @@ async def update_testrun(
         ident: Annotated[int | str, Depends(tryint)],
         run: TestRun,
         current_user: CurrentUser,
+        session: DbSession,
 ) -> TestRun:
-    async with async_session() as session:
-        cur = (
-            await session.scalars(
-                select(models.TestRun).where(
-                    and_(
-                        tr_unique_field(ident) == ident,
-                        models.TestRun.user_id == current_user.id,
-                    )
+    cur = (
+        await session.scalars(
+            select(models.TestRun).where(
+                and_(
+                    tr_unique_field(ident) == ident,
+                    models.TestRun.user_id == current_user.id,
                 )
             )
-        ).one()
+        )
+    ).one()
 
-        cur.update_from_model(run)
-        await session.commit()
+    cur.update_from_model(run)
+    await session.commit()
 
-        return TestRun.model_validate(cur)
+    return TestRun.model_validate(cur)
 
 
 @router.put("/testruns/{ident}/field/{field_name}", tags=["testrun"])
@@ -263,29 +330,29 @@ async def update_testrun_field(
         field_name: str,
         field_value: Annotated[str | int | list[Any] | dict[Any, Any] | None, Body()],
         current_user: CurrentUser,
+        session: DbSession,
 ) -> TestRun:
-    async with async_session() as session:
-        cur = (
-            await session.scalars(
-                select(models.TestRun).where(
-                    and_(
-                        tr_unique_field(ident) == ident,
-                        models.TestRun.user_id == current_user.id,
-                    )
+    cur = (
+        await session.scalars(
+            select(models.TestRun).where(
+                and_(
+                    tr_unique_field(ident) == ident,
+                    models.TestRun.user_id == current_user.id,
                 )
             )
-        ).one()
+        )
+    ).one()
 
-        if cur.data is None:
-            cur.data = {field_name: field_value}
-        else:
-            cur.data = (
-                cur.data.copy()
-            )  # sqlalchemy can't detect value changes within a dict
-            cur.data[field_name] = field_value
+    if cur.data is None:
+        cur.data = {field_name: field_value}
+    else:
+        cur.data = (
+            cur.data.copy()
+        )  # sqlalchemy can't detect value changes within a dict
+        cur.data[field_name] = field_value
 
-        await session.commit()
-        return TestRun.model_validate(cur)
+    await session.commit()
+    return TestRun.model_validate(cur)
 
 
 @router.delete("/testruns/{ident}/field/{field_name}", tags=["testrun"])
@@ -293,161 +360,335 @@ async def delete_testrun_field(
         ident: Annotated[int | str, Depends(tryint)],
         field_name: str,
         current_user: CurrentUser,
+        session: DbSession,
 ) -> Response:
-    async with async_session() as session:
-        cur = (
-            await session.scalars(
-                select(models.TestRun).where(
-                    and_(
-                        tr_unique_field(ident) == ident,
-                        models.TestRun.user_id == current_user.id,
-                    )
+    cur = (
+        await session.scalars(
+            select(models.TestRun).where(
+                and_(
+                    tr_unique_field(ident) == ident,
+                    models.TestRun.user_id == current_user.id,
                 )
             )
-        ).one()
+        )
+    ).one()
 
-        if cur.data is None:
-            return Response(status_code=410)
+    if cur.data is None:
+        return Response(status_code=410)
 
-        cur.data = (
-            cur.data.copy()
-        )  # sqlalchemy can't detect value changes within a dict
-        cur.data[field_name] = None
+    cur.data = (
+        cur.data.copy()
+    )  # sqlalchemy can't detect value changes within a dict
+    cur.data[field_name] = None
 
-        await session.commit()
-        return Response(status_code=200)
+    await session.commit()
+    return Response(status_code=200)
 
 
 @router.delete("/testruns/{ident}", tags=["testrun"])
 async def delete_testrun(
-        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser
+        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser, session: DbSession
 ) -> dict[str, int]:
-    async with async_session() as session:
-        cur = (
-            await session.scalars(
-                select(models.TestRun).where(
-                    and_(
-                        tr_unique_field(ident) == ident,
-                        models.TestRun.user_id == current_user.id,
-                    )
+    cur = (
+        await session.scalars(
+            select(models.TestRun).where(
+                and_(
+                    tr_unique_field(ident) == ident,
+                    models.TestRun.user_id == current_user.id,
                 )
             )
-        ).one()
-        await session.delete(cur)
-        await session.commit()
+        )
+    ).one()
+    await session.delete(cur)
+    await session.commit()
+    testrun_snapshots.invalidate(cur.id)
+    chart_renderer.invalidate(cur.id)
 
     return {"deleted_rows": 1}
 
 
-async def _get_testrun_df(run: models.TestRun) -> pl.DataFrame:
-    async with async_session() as session:
-        # aliases allow for more compact queries
-        me = aliased(models.MeasurementEntry)
-        mc = aliased(models.MeasurementColumn)
-        fc = aliased(models.ForcingCondition)
-        sp = aliased(models.Specification)
-
-        query_conditions = (
-            select(
-                fc.sequence_number,
-                mc.measurement_unit.label("unit"),
-                mc.name,
-                fc.numeric_value,
-                fc.string_value,
-            )
-            .join(mc, mc.id == fc.column_id)
-            .where(and_(fc.testrun_id == run.id, fc.value_hidden == 0))
+# aliases allow for more compact queries
+me = aliased(models.MeasurementEntry)
+mc = aliased(models.MeasurementColumn)
+fc = aliased(models.ForcingCondition)
+sp = aliased(models.Specification)
+
+
+def _conditions_query(run_id: int, steps: tuple[int, int] | None = None) -> Select[Tuple[Any, ...]]:
+    query = (
+        select(
+            fc.sequence_number,
+            mc.measurement_unit.label("unit"),
+            mc.name,
+            mc.id.label("column_id"),
+            fc.numeric_value,
+            fc.string_value,
         )
+        .join(mc, mc.id == fc.column_id)
+        .where(and_(fc.testrun_id == run_id, fc.value_hidden == 0))
+    )
 
-        conditions = [list(e) for e in await session.execute(query_conditions)]
-        schema_cond = {
-            c.name: c.type.python_type for c in query_conditions.selected_columns
-        }
-        cond_df = pl.DataFrame(conditions, schema=schema_cond).pivot(
-            values=["string_value", "numeric_value"],
-            index="sequence_number",
-            columns=["name"],
-            aggregate_function="first",
+    return query.where(fc.sequence_number.between(*steps)) if steps else query
+
+
+def _measurements_query(run_id: int, steps: tuple[int, int] | None = None) -> Select[Tuple[Any, ...]]:
+    query = (
+        select(
+            mc.name,
+            mc.id.label("column_id"),
+            me.sequence_number,
+            me.numeric_value,
+            me.string_value,
+            sp.name.label("sp_name"),
+            sp.minimum.label("sp_min"),
+            sp.typical.label("sp_typ"),
+            sp.maximum.label("sp_max"),
         )
+        .join(mc, mc.id == me.column_id)
+        .join(sp, sp.id == mc.specification_id, isouter=True)
+        .where(me.testrun_id == run_id)
+    )
 
-        # drop columns which are all nulls
-        cond_df = cond_df[[s.name for s in cond_df if s.null_count() != cond_df.height]]
-
-        # strip field types from forcing condition column names, they're always either or
-        mapping = {
-            col: f'fc{col.removeprefix("string_value_name").removeprefix("numeric_value_name")}'
-            for col in cond_df.schema.keys()
-            if col.startswith("string_value_") or col.startswith("numeric_value_")
-        }
-
-        cond_df = cond_df.rename(mapping)
-
-        query_measured_entries = (
-            select(
-                mc.name,
-                me.sequence_number,
-                me.numeric_value,
-                me.string_value,
-                sp.name.label("sp_name"),
-                sp.minimum.label("sp_min"),
-                sp.typical.label("sp_typ"),
-                sp.maximum.label("sp_max"),
-            )
-            .join(mc, mc.id == me.column_id)
-            .join(sp, sp.id == mc.specification_id, isouter=True)
-            .where(me.testrun_id == run.id)
+    return query.where(me.sequence_number.between(*steps)) if steps else query
+
+
+def _column_kinds_query(entries: Any, *where: Any) -> Select[Tuple[Any, ...]]:
+    """
+    _column_kinds_query finds which kinds of values the columns of forcing conditions or measurement
+    entries have like _column_kinds, but in the database. SQLite sorts all rows for a GROUP BY, DISTINCT
+    only keeps the few different combinations around.
+    """
+    values = (
+        select(
+            entries.column_id,
+            entries.numeric_value.is_not(None).label("numeric"),
+            entries.string_value.is_not(None).label("string"),
         )
+        .where(*where)
+        .distinct()
+        .subquery()
+    )
 
-        measured_entries = [
-            list(e) for e in await session.execute(query_measured_entries)
-        ]
-        schema_meas = {
-            c.name: c.type.python_type for c in query_measured_entries.selected_columns
-        }
-        meas_df = (
-            pl.DataFrame(measured_entries, schema=schema_meas)
-            .pivot(
-                values=["string_value", "numeric_value"],
-                index="sequence_number",
-                columns=["name"],
-                aggregate_function="first",
-            )
-            .drop("sequence_number")
+    return (
+        select(
+            mc.name,
+            mc.id.label("column_id"),
+            type_coerce(func.max(values.c.numeric), Integer).label("numeric"),
+            type_coerce(func.max(values.c.string), Integer).label("string"),
+        )
+        .join(mc, mc.id == values.c.column_id)
+        .group_by(mc.id)
+    )
+
+
+def _column_kinds(entries: pl.DataFrame) -> pl.DataFrame:
+    return (
+        entries.lazy()
+        .group_by("name", "column_id")
+        .agg(
+            pl.col("numeric_value").is_not_null().sum().alias("numeric"),
+            pl.col("string_value").is_not_null().sum().alias("string"),
         )
+        .collect()
+    )
+
+
+def _next_step_query(run_id: int, after: int | None) -> Select[Tuple[Any, ...]]:
+    conditions = select(func.min(fc.sequence_number).label("sequence_number")).where(
+        and_(fc.testrun_id == run_id, fc.value_hidden == 0)
+    )
+    measurements = select(func.min(me.sequence_number).label("sequence_number")).where(me.testrun_id == run_id)
+    if after is not None:
+        conditions = conditions.where(fc.sequence_number > after)
+        measurements = measurements.where(me.sequence_number > after)
+
+    steps = union_all(conditions, measurements).subquery()
+    return select(func.min(steps.c.sequence_number))
+
+
+def _pivot_steps(entries: pl.DataFrame, prefix: str, kinds: pl.DataFrame) -> pl.DataFrame:
+    """
+    _pivot_steps turns rows of (sequence_number, name, value) into one row per step with a column per
+    name, in the order the columns were created. Only the names in kinds that have values get a column,
+    names with both numeric and string values get a string column. Entries of other columns, e.g. created
+    after kinds was read, are left out.
+
+    Each entry has a cell in a single flat series per value type, column by column and step by step. The
+    first value of each cell is scattered into it, the columns are slices of the flat series. Unlike a
+    group_by with an aggregation per name this is linear in the number of names, and it needs less memory
+    than a pivot.
+    """
+    kinds = kinds.filter((pl.col("numeric") > 0) | (pl.col("string") > 0)).sort("column_id")
+    steps = entries["sequence_number"].unique().sort()
+    text = pl.coalesce(pl.col("string_value"), pl.col("numeric_value").cast(pl.Utf8))
+
+    columns: dict[int, pl.Series] = {}
+    for of_kind, value, dtype in (
+        (kinds.filter(pl.col("string") == 0), pl.col("numeric_value"), pl.Float64),
+        (kinds.filter(pl.col("string") > 0), text, pl.Utf8),
+    ):
+        if of_kind.is_empty():
+            continue
+
+        ids = of_kind["column_id"]
+        # search_sorted would put entries of any other column into the cells of the next one
+        selected = entries.filter(pl.col("column_id").is_in(ids))
+
+        cells = ids.search_sorted(selected["column_id"]).cast(pl.Int64) * steps.len() + steps.search_sorted(
+            selected["sequence_number"]
+        )
+        # string columns can only be scattered in order of the cells
+        scattered = (
+            pl.DataFrame([cells.alias("cell"), selected.select(value.cast(dtype).alias("value")).to_series()])
+            .filter(pl.col("cell").is_first_distinct())
+            .sort("cell")
+        )
+        flat = pl.repeat(None, ids.len() * steps.len(), dtype=dtype, eager=True)
+        flat.scatter(scattered["cell"], scattered["value"])
+
+        for i, column_id in enumerate(ids):
+            columns[column_id] = flat.slice(i * steps.len(), steps.len())
+
+    names = kinds.select("name", "column_id").iter_rows()
+    return pl.DataFrame([steps, *(columns[column_id].alias(f"{prefix}_{name}") for name, column_id in names)])
+
+
+def _join_steps(
+        conditions: pl.DataFrame,
+        measured_entries: pl.DataFrame,
+        cond_kinds: pl.DataFrame,
+        meas_kinds: pl.DataFrame,
+) -> pl.DataFrame:
+    # steps without measurements and measurements without a step setup are both kept
+    return (
+        _pivot_steps(conditions, "fc", cond_kinds)
+        .join(_pivot_steps(measured_entries, "mc", meas_kinds), on="sequence_number", how="outer_coalesce")
+        .sort("sequence_number")
+    )
+
+
+async def _get_testrun_df(run: models.TestRun, session: AsyncSession) -> pl.DataFrame:
+    """
+    _get_testrun_df returns the conditions and measurements of a run with one row per step. The frames of
+    finished runs are kept as snapshots and only computed again once their data changes.
+    """
+    version = None
+    if run.state in FINISHED_STATES:
+        version = await data_version(session, run.id)
+        if (df := await asyncio.to_thread(testrun_snapshots.get, run.id, version)) is not None:
+            return df
+
+    conditions, measured_entries = await read_frames(
+        session, [_conditions_query(run.id), _measurements_query(run.id)]
+    )
+    df = _join_steps(conditions, measured_entries, _column_kinds(conditions), _column_kinds(measured_entries))
+
+    if version is not None:
+        await asyncio.to_thread(testrun_snapshots.put, run.id, version, df)
+
+    return df
+
+
+async def _iter_testrun_df(
+        run: models.TestRun, session: AsyncSession, window_steps: int = EXPORT_WINDOW_STEPS
+) -> AsyncIterator[pl.DataFrame]:
+    """
+    _iter_testrun_df yields the same frame as _get_testrun_df in parts of at most window_steps sequence
+    numbers, only one part is in memory at a time. The columns are determined for the whole run first so
+    that all parts have the same schema, empty ranges of sequence numbers are skipped.
+
+    A snapshot of a finished run is read in parts of window_steps rows instead.
 
-        meas_df = meas_df[[s.name for s in meas_df if s.null_count() != meas_df.height]]
+    The transaction of the session is ended before each part is yielded, so a slow download neither holds
+    a pooled connection nor keeps SQLite from checkpointing the WAL while the part is sent.
+    """
+    if run.state in FINISHED_STATES:
+        path = testrun_snapshots.path(run.id, await data_version(session, run.id))
+        if path is not None:
+            await session.commit()
+            # an open snapshot stays readable even if it gets evicted meanwhile
+            snapshot = await asyncio.to_thread(pq.ParquetFile, path)
+            batches = snapshot.iter_batches(batch_size=window_steps)
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                yield pl.from_arrow(snapshot.schema_arrow.empty_table())  # type: ignore[misc]
+            while batch is not None:
+                yield pl.from_arrow(batch)  # type: ignore[misc]
+                batch = await asyncio.to_thread(next, batches, None)
+            return
+
+    cond_kinds, meas_kinds = await read_frames(
+        session,
+        [
+            _column_kinds_query(fc, fc.testrun_id == run.id, fc.value_hidden == 0),
+            _column_kinds_query(me, me.testrun_id == run.id),
+        ],
+    )
+
+    start = await session.scalar(_next_step_query(run.id, None))
+    if start is None:
+        # no steps at all, still yield the (empty) frame so the output has a valid structure
+        start = 0
+
+    while start is not None:
+        end = start + window_steps - 1
+        conditions, measured_entries = await read_frames(
+            session, [_conditions_query(run.id, (start, end)), _measurements_query(run.id, (start, end))]
+        )
+        start = await session.scalar(_next_step_query(run.id, end))
+        await session.commit()
 
-        # strip field types from forcing condition column names, they're always either or
-        mapping = {
-            col: f'mc{col.removeprefix("string_value_name").removeprefix("numeric_value_name")}'
-            for col in meas_df.schema.keys()
-            if col.startswith("string_value_") or col.startswith("numeric_value_")
-        }
+        yield await asyncio.to_thread(_join_steps, conditions, measured_entries, cond_kinds, meas_kinds)
 
-        meas_df = meas_df.rename(mapping)
 
-        return pl.concat([cond_df, meas_df], how="horizontal")
+async def _stream_export(frames: AsyncIterator[pl.DataFrame], data_format: DataExportFormat) -> AsyncIterator[bytes]:
+    """
+    _stream_export encodes the frames one after another, CSV gets a single header line, JSON a single array
+    and Parquet a row group per frame.
+    """
+    if data_format == DataExportFormat.PARQUET:
+        sink = ChunkedIO()
+        writer: pq.ParquetWriter | None = None
+        async for df in frames:
+            table = df.to_arrow()
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            yield sink.drain()
+        if writer is not None:
+            writer.close()
+        yield sink.drain()
+    elif data_format == DataExportFormat.JSON:
+        separator = b"["
+        async for df in frames:
+            if not df.is_empty():
+                yield separator + df.write_json(row_oriented=True)[1:-1].encode()
+                separator = b","
+        yield b"]" if separator == b"," else b"[]"
+    else:
+        header = True
+        async for df in frames:
+            if data_format == DataExportFormat.CSV:
+                yield df.write_csv(include_header=header).encode()
+                header = False
+            else:
+                yield df.write_ndjson().encode()
 
 
 async def _get_user_testrun(
-        ident: str | int, current_user: CurrentUser
+        ident: str | int, current_user: CurrentUser, session: AsyncSession
 ) -> models.TestRun:
-    async with async_session() as session:
-        run = (
-            await session.scalars(
-                select(models.TestRun).where(
-                    and_(
-                        tr_unique_field(ident) == ident,
-                        or_(
-                            models.TestRun.user_id == current_user.id,
-                            models.TestRun.project_id.in_(
-                                common_project_ids(current_user)
-                            ),
-                        ),
-                    )
-                )
-            )
-        ).one()
+    run = (
+        await session.scalars(
+            select(models.TestRun).where(tr_unique_field(ident) == ident)
+        )
+    ).one()
+
+    if run.user_id != current_user.id and not await has_project_access(
+            session, current_user, run.project_id
+    ):
+        # same as for runs that don't exist
+        raise NoResultFound("No row was found when one was required")
 
     return run
 
@@ -456,107 +697,267 @@ async def _get_user_testrun(
 async def testrun_measurements(
         ident: Annotated[int | str, Depends(tryint)],
         current_user: CurrentUser,
-        data_format: DataExportFormat | None = Query(
+        session: ReadSession,
+        data_format: DataExportFormat = Query(
             default=DataExportFormat.JSON, alias="format"
         ),
-) -> StreamingResponse:
+        stream: bool = Query(default=False),
+        max_points: int | None = Query(default=None, ge=4),
+        x: str = Query(default="sequence_number"),
+) -> Response:
     """
     This returns the results for a specific measurement run. It first retrieves the conditions, pivots them and then
     merges them together with the results. As a last step, all columns only consisting of null values get removed.
+
+    With stream set the run is read and sent in parts of EXPORT_WINDOW_STEPS sequence numbers, the memory needed
+    then doesn't depend on the size of the run and the first bytes are sent right away.
+
+    For charts, max_points decimates the results to at most that many rows along the x field, keeping the first and
+    last rows and the minimum and maximum values of every numeric series of each part. X-Decimated-Rows tells how
+    many rows were left out.
     """
 
     # check if the run exists before we do other more expensive tasks
-    run = await _get_user_testrun(ident, current_user)
+    run = await _get_user_testrun(ident, current_user, session)
+
+    media_types = {
+        DataExportFormat.JSON: "application/json",
+        DataExportFormat.NDJSON: "application/x-ndjson",
+        DataExportFormat.PARQUET: "application/octet-stream",
+        DataExportFormat.CSV: "text/csv",
+    }
+
+    headers = {}
+    if data_format != DataExportFormat.JSON:
+        headers["Content-Disposition"] = (
+            f'attachment; filename="{run.short_code}_{run.dut_id}.{data_format}"'
+        )
+
+    if stream and max_points:
+        raise HTTPException(status_code=400, detail="max_points needs the whole run, it can't be streamed")
+
+    if stream:
+        return StreamingResponse(
+            _stream_export(_iter_testrun_df(run, session, EXPORT_WINDOW_STEPS), data_format),
+            headers=headers,
+            media_type=media_types[data_format],
+        )
+
+    df = await _get_testrun_df(run, session)
 
-    df = await _get_testrun_df(run)
+    if max_points:
+        try:
+            decimated = decimate(df, max_points, x)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+        headers["X-Decimated-Rows"] = str(df.height - decimated.height)
+        df = decimated
 
     f = io.BytesIO()
 
     # polars can directly export a variety of formats which works nicely here
     if data_format == DataExportFormat.JSON:
         df.write_json(f, row_oriented=True)
-        media_type = "application/json"
+    elif data_format == DataExportFormat.NDJSON:
+        df.write_ndjson(f)
     elif data_format == DataExportFormat.PARQUET:
         df.write_parquet(f)
-        media_type = "application/octet-stream"
     elif data_format == DataExportFormat.CSV:
         df.write_csv(f)
-        media_type = "text/csv"
-    else:
-        raise HTTPException(423, "unknown export format")
 
-    f.seek(0)
+    # the export is complete anyway, iterating the buffer would send it line by line
+    return Response(f.getvalue(), headers=headers, media_type=media_types[data_format])
 
-    headers = {}
-    if data_format != DataExportFormat.JSON:
-        headers["Content-Disposition"] = (
-            f'attachment; filename="{run.short_code}_{run.dut_id}.{data_format}"'
+
+# like the JSON ingest paths, which insert through SQLAlchemy and get the column default
+_ENTRY_FLAGS = models.MeasurementEntry.__table__.c.flags.default.arg  # type: ignore[attr-defined]
+
+
+def _storable(dtype: pl.DataType) -> bool:
+    return dtype.is_numeric() or dtype in (pl.Boolean, pl.Utf8, pl.Categorical, pl.Null)
+
+
+def _check_upload(df: pl.DataFrame) -> None:
+    """
+    _check_upload raises a 422 for uploaded frames which can't be stored as measurement entries.
+    """
+    if "sequence_number" not in df.columns:
+        raise HTTPException(422, "data has no 'sequence_number' column")
+    if not df.schema["sequence_number"].is_integer():
+        raise HTTPException(422, f"'sequence_number' needs to be an integer column, not {df.schema['sequence_number']}")
+    if df["sequence_number"].null_count():
+        raise HTTPException(422, "'sequence_number' has missing values")
+
+    unsupported = [
+        f"{name} ({dtype})" for name, dtype in df.schema.items() if name != "sequence_number" and not _storable(dtype)
+    ]
+    if unsupported:
+        raise HTTPException(
+            422, f"columns need to be numbers, booleans or strings, unsupported: {', '.join(unsupported)}"
+        )
+
+
+def _long_entries(
+    df: pl.DataFrame, run: models.TestRun, columns: dict[str, int]
+) -> pl.DataFrame:
+    """
+    _long_entries turns a wide frame with one column per measurement into measurement_entries rows,
+    with the values stored like the JSON ingest paths store them.
+    """
+    frames: list[pl.DataFrame] = []
+
+    for name, dtype in df.schema.items():
+        if name == "sequence_number":
+            continue
+
+        numeric = dtype.is_numeric()
+        if dtype == pl.Boolean:
+            # str() of a Python bool
+            text = pl.when(pl.col(name)).then(pl.lit("True")).otherwise(pl.lit("False"))
+        else:
+            text = pl.col(name).cast(pl.Utf8)
+        frames.append(
+            df.filter(pl.col(name).is_not_null()).select(
+                pl.col("sequence_number").cast(pl.Int64),
+                pl.lit(run.id, pl.Int64).alias("testrun_id"),
+                pl.lit(columns[name], pl.Int64).alias("column_id"),
+                (pl.col(name) if numeric else pl.lit(None))
+                .cast(pl.Float64)
+                .alias("numeric_value"),
+                (pl.lit(None) if numeric else text)
+                .cast(pl.Utf8)
+                .alias("string_value"),
+                pl.lit(_ENTRY_FLAGS, pl.Int64).alias("flags"),
+            )
+        )
+
+    return pl.concat(frames) if frames else pl.DataFrame()
+
+
+@router.post("/testruns/{ident}/measurements", tags=["testrun"], status_code=201)
+async def upload_testrun_measurements(
+        ident: Annotated[int | str, Depends(tryint)],
+        request: Request,
+        current_user: CurrentUser,
+        session: DbSession,
+        data_format: DataImportFormat = Query(
+            default=DataImportFormat.ARROW, alias="format"
+        ),
+) -> dict[str, int]:
+    """
+    Upload measurement results as an Arrow IPC stream or a Parquet file. The data needs a
+    sequence_number column and one column per measurement. It's reshaped into entries with polars
+    and inserted with a single executemany, without ORM objects, but the driver still gets a
+    tuple of Python values per entry.
+    """
+
+    body = await request.body()
+
+    try:
+        if data_format == DataImportFormat.ARROW:
+            df = pl.read_ipc_stream(body)
+        else:
+            df = pl.read_parquet(io.BytesIO(body))
+    except (pl.exceptions.PolarsError, OSError) as e:
+        raise HTTPException(422, f"could not read {data_format.value} data: {e}") from e
+
+    _check_upload(df)
+
+    run = (
+        await session.scalars(
+            select(models.TestRun).where(
+                and_(
+                    tr_unique_field(ident) == ident,
+                    models.TestRun.user_id == current_user.id,
+                )
+            )
         )
+    ).one()
+
+    if run.state != TestRunState.RUNNING:
+        raise HTTPException(400, f"run {run.id} is not set to RUNNING state")
+
+    names = [name for name in df.columns if name != "sequence_number"]
+    columns = await get_or_create_columns(session, run.project_id, names)
+    try:
+        entries = _long_entries(df, run, columns)
+    except pl.exceptions.PolarsError as e:
+        raise HTTPException(422, f"could not convert the data to measurements: {e}") from e
+    inserted = await insert_frame(
+        session,
+        models.MeasurementEntry.__table__,  # type: ignore[arg-type]
+        entries,
+    )
+    await session.commit()
 
-    return StreamingResponse(f, headers=headers, media_type=media_type)
+    return {"inserted_rows": inserted}
 
 
 @router.get("/testruns/plot/{ident}", tags=["testrun"])
 async def testrun_plot_charts(
         ident: Annotated[int | str, Depends(tryint)],
         current_user: CurrentUser,
-        data_format: ChartExportFormat | None = Query(
+        session: ReadSession,
+        data_format: ChartExportFormat = Query(
             default=ChartExportFormat.SVG, alias="format"
         ),
-        dpi: int = Query(default=150),
-) -> StreamingResponse:
+        dpi: int = Query(default=150, gt=0, le=1200),
+        max_points: int | None = Query(default=None, ge=4),
+        x: str = Query(default="sequence_number"),
+) -> Response:
     """
-    This returns the results for a specific measurement run. It first retrieves the conditions, pivots them and then
-    merges them together with the results. As a last step, all columns only consisting of null values get removed.
+    This renders the vega-lite chart specification of a run with the results of the run as data. Charts are rendered
+    in separate worker processes and cached until the data of the run changes.
+
+    With max_points the plotted data is decimated to at most that many rows along the x field, keeping the first and
+    last rows and the minimum and maximum values of every numeric series of each part. X-Decimated-Rows tells how
+    many rows were left out.
     """
 
-    if not alt:
+    if not has_altair:
         raise HTTPException(
             status_code=400, detail="Plotting dependency 'altair' is not available"
         )
-    if not vlc and data_format in [ChartExportFormat.PNG, ChartExportFormat.SVG]:
+    if not has_vl_convert and data_format in [ChartExportFormat.PNG, ChartExportFormat.SVG]:
         raise HTTPException(
             status_code=400,
             detail="Plotting to PNG or SVG requires the vl-convert-python library",
         )
 
     # check if the run exists before we do other more expensive tasks
-    run = await _get_user_testrun(ident, current_user)
+    run = await _get_user_testrun(ident, current_user, session)
 
-    if run.data and "vega_lite" in run.data:
-        chart_spec = alt.Chart.from_dict(run.data["vega_lite"])
-    else:
+    if not run.data or "vega_lite" not in run.data:
         raise HTTPException(
             status_code=400, detail="testrun has no 'vega_lite' chart specification"
         )
 
-    df = await _get_testrun_df(run)
-    chart_spec.data = df
-
-    f = WrappedIO()
-
-    # polars can directly export a variety of formats which works nicely here
-    if data_format == ChartExportFormat.HTML:
-        chart_spec.save(fp=f, format="html")
-        media_type = "text/html"
-    elif data_format == ChartExportFormat.SVG:
-        chart_spec.save(fp=f, format="svg")
-        media_type = "image/svg"
-    elif data_format == ChartExportFormat.PNG:
-        chart_spec.save(fp=f, format="png", ppi=dpi)
-        media_type = "image/png"
-    else:
-        raise HTTPException(423, "unknown export format")
-
-    f.seek(0)
+    spec = run.data["vega_lite"]
+    # only the dpi of PNGs changes the output
+    key = ChartKey(
+        run.id,
+        spec_hash(spec),
+        await data_version(session, run.id),
+        data_format.value,
+        dpi if data_format == ChartExportFormat.PNG else 0,
+        max_points or 0,
+        x if max_points else "",
+    )
+    try:
+        chart = await chart_renderer.render(key, spec, lambda: _get_testrun_df(run, session))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
 
-    headers = {}
-    if data_format != DataExportFormat.JSON:
-        headers["Content-Disposition"] = (
-            f'attachment; filename="{run.short_code}_{run.dut_id}.{data_format}"'
-        )
+    media_types = {
+        ChartExportFormat.HTML: "text/html",
+        ChartExportFormat.SVG: "image/svg",
+        ChartExportFormat.PNG: "image/png",
+    }
+    headers = {"Content-Disposition": f'attachment; filename="{run.short_code}_{run.dut_id}.{data_format.value}"'}
+    if max_points:
+        headers["X-Decimated-Rows"] = str(chart.decimated_rows)
 
-    return StreamingResponse(f, headers=headers, media_type=media_type)
+    return Response(chart.content, headers=headers, media_type=media_types[data_format])
 
 
 @router.post("/testruns/setup/{ident}", tags=["testrun"])
@@ -564,96 +965,65 @@ async def setup_testrun(
         ident: Annotated[int | str, Depends(tryint)],
         setup: TestSetup,
         current_user: CurrentUser,
+        session: DbSession,
 ) -> Response:
-    unique_field = tr_unique_field(ident)
-
-    async with async_session() as session:
-        run = (
-            await session.scalars(
-                select(models.TestRun).where(
-                    and_(
-                        unique_field == ident,
-                        models.TestRun.user_id == current_user.id,
-                    )
-                )
-            )
-        ).one()
-
-        # check if the TestRun is already set up or in progress
-        if run.state != TestRunState.NEW:
-            raise HTTPException(
-                400,
-                f"run already in state {run.state}, started at {run.started_at} "
-                f"by {run.user_name} on {run.machine_hostname}",
-            )
-
-        meas_cols: dict[str, models.MeasurementColumn] = {}
-
-        # create the columns first if they don't exist yet
-        for name, values in setup.columns.items():
-            m_res = await session.scalars(
-                select(models.MeasurementColumn).where(
-                    and_(
-                        models.MeasurementColumn.name == name,
-                        models.MeasurementColumn.project_id == run.project_id,
-                    )
+    run = (
+        await session.scalars(
+            select(models.TestRun).where(
+                and_(
+                    tr_unique_field(ident) == ident,
+                    models.TestRun.user_id == current_user.id,
                 )
             )
+        )
+    ).one()
 
-            try:
-                column = m_res.one()
-            except NoResultFound:
-                column = None
-
-            if column is None:
-                column = models.MeasurementColumn(
-                    name=name,
-                    project_id=run.project_id,
-                    data_source=values.data_source,
-                    description=values.description,
-                    user_note=values.user_note,
-                    measurement_unit=values.measurement_unit,
-                    flags=values.flags,
-                )
-                session.add(column)
-
-            meas_cols[name] = column
+    # check if the TestRun is already set up or in progress
+    if run.state != TestRunState.NEW:
+        raise HTTPException(
+            400,
+            f"run already in state {run.state}, started at {run.started_at} "
+            f"by {run.user_name} on {run.machine_hostname}",
+        )
 
-        await session.commit()
+    # create the columns first if they don't exist yet
+    meas_cols = await get_or_create_columns(
+        session,
+        run.project_id,
+        setup.columns.keys(),
+        {
+            name: values.model_dump(exclude={"value_hidden"})
+            for name, values in setup.columns.items()
+        },
+    )
 
-    # run a second tx to create the forcing conditions too
-    async with async_session() as session:
-        for step in setup.steps:
-            sequence_number = step["sequence_number"]
-            step_names = set(step.keys())
-            step_names.discard("sequence_number")
-            for name in step_names:
-                column = meas_cols[name]
-                fc = models.ForcingCondition(
-                    column_id=column.id,
-                    testrun_id=run.id,
-                    sequence_number=sequence_number,
-                    value_hidden=setup.columns[name].value_hidden,
-                )
-                target_value = step[name]
-                if isinstance(target_value, float):
-                    fc.numeric_value = target_value
-                elif isinstance(target_value, int):
-                    fc.numeric_value = float(target_value)
-                else:
-                    fc.string_value = target_value
+    conditions: list[dict[str, Any]] = []
+    for step in setup.steps:
+        sequence_number = int(step["sequence_number"])
+        for name, target_value in step.items():
+            if name == "sequence_number":
+                continue
+
+            numeric = isinstance(target_value, (float, int))
+            conditions.append(
+                {
+                    "column_id": meas_cols[name],
+                    "testrun_id": run.id,
+                    "sequence_number": sequence_number,
+                    "value_hidden": setup.columns[name].value_hidden,
+                    "numeric_value": float(target_value) if numeric else None,
+                    "string_value": None if numeric else target_value,
+                }
+            )
 
-                session.add(fc)
+    if conditions:
+        await session.execute(insert(models.ForcingCondition), conditions)
 
-        await session.commit()
+    # columns, conditions and the state change are committed together, a failed setup can be retried
+    run.state = TestRunState.SETUP_COMPLETE
+    await session.commit()
 
-    # finally, set the testrun state to SETUP_COMPLETE to accept measurements now
-    async with async_session() as session:
-        run = (
-            await session.scalars(select(models.TestRun).where(unique_field == ident))
-        ).one()
-        run.state = TestRunState.SETUP_COMPLETE
-        await session.commit()
+    invalidate_columns(run.project_id)
 
     return Response(status_code=200)
 
@@ -691,40 +1061,37 @@ async def transition_state(
 
 @router.put("/testruns/start/{ident}", tags=["testrun"])
 async def start_testrun(
-        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser
+        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser, session: DbSession
 ) -> TestRun:
-    async with async_session() as session:
-        cur = await transition_state(session, ident, TestRunState.RUNNING, current_user)
-        cur.started_at = datetime.now()
-        session.add(cur)
-        await session.commit()
+    cur = await transition_state(session, ident, TestRunState.RUNNING, current_user)
+    cur.started_at = datetime.now()
+    session.add(cur)
+    await session.commit()
 
-        return TestRun.model_validate(cur)
+    return TestRun.model_validate(cur)
 
 
 @router.put("/testruns/complete/{ident}", tags=["testrun"])
 async def complete_testrun(
-        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser
+        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser, session: DbSession
 ) -> TestRun:
-    async with async_session() as session:
-        cur = await transition_state(
-            session, ident, TestRunState.COMPLETE, current_user
-        )
-        cur.completed_at = datetime.now()
-        session.add(cur)
-        await session.commit()
+    cur = await transition_state(
+        session, ident, TestRunState.COMPLETE, current_user
+    )
+    cur.completed_at = datetime.now()
+    session.add(cur)
+    await session.commit()
 
-        return TestRun.model_validate(cur)
+    return TestRun.model_validate(cur)
 
 
 @router.put("/testruns/fail/{ident}", tags=["testrun"])
 async def fail_testrun(
-        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser
+        ident: Annotated[int | str, Depends(tryint)], current_user: CurrentUser, session: DbSession
 ) -> TestRun:
-    async with async_session() as session:
-        cur = await transition_state(session, ident, TestRunState.FAILED, current_user)
-        cur.completed_at = datetime.now()
-        session.add(cur)
-        await session.commit()
+    cur = await transition_state(session, ident, TestRunState.FAILED, current_user)
+    cur.completed_at = datetime.now()
+    session.add(cur)
+    await session.commit()
 
-        return TestRun.model_validate(cur)
+    return TestRun.model_validate(cur)
@@ -6,8 +6,10 @@ import pytest
 from httpx import AsyncClient, ASGITransport
 from sqlalchemy.ext.asyncio import create_async_engine
 
-from ..db import DATABASE_URL, override_db, run_migrations
+from .. import db
+from ..db import DATABASE_URL, create_writer_engine, override_db, run_migrations
 from ..db.models import Model
+from ..db.writer import write_coalescer
 from ..main import app
 
 
@@ -37,12 +39,20 @@ async def setup_db() -> AsyncIterable[None]:
     async with engine.begin() as conn:
         await conn.run_sync(Model.metadata.create_all)
 
-    override_db(engine)
+    await engine.dispose()
+
+    override_db(create_writer_engine(DATABASE_URL))
 
     await run_migrations()
 
     yield
 
+    await write_coalescer.stop()
+
+    # pooled connections belong to this module's event loop
+    await db.reader_engine.dispose()
+    await db.engine.dispose()
+
 
 @pytest.fixture(scope="module")
 async def client() -> AsyncIterable[AsyncClient]:
@@ -0,0 +1,221 @@
+import asyncio
+import gc
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+from httpx import AsyncClient
+from jwt.algorithms import ECAlgorithm
+from sqlalchemy import select
+from starlette.requests import HTTPConnection
+
+from .. import db
+from ..core import auth
+from ..core.auth import user_cache
+from ..core.cache import LRUCache
+from ..core.jwks import AsyncJWKSClient
+from ..db.models import User
+
+
+@pytest.mark.anyio
+async def test_user_cache(client: AsyncClient) -> None:
+    headers = {"X-Webauth-User": "cached-user", "X-Webauth-Groups": "group_a"}
+
+    r = await client.get("/api/users/self", headers=headers)
+    assert r.status_code == 200
+    user_id = r.json()["id"]
+
+    hits = user_cache.hits
+    r = await client.get("/api/users/self", headers=headers)
+    assert r.status_code == 200
+    assert r.json()["id"] == user_id
+    assert user_cache.hits == hits + 1
+
+
+@pytest.mark.anyio
+async def test_user_cache_copies(client: AsyncClient) -> None:
+    headers = {"X-Webauth-User": "copied-user", "X-Webauth-Groups": "group_a"}
+    assert (await client.get("/api/users/self", headers=headers)).status_code == 200
+
+    # users built from the cache don't share their groups with it
+    conn = HTTPConnection({"type": "http", "session": {}})
+    first = await auth.get_current_user(conn, x_webauth_user="copied-user", x_webauth_groups=["group_a"])
+    assert first is not None
+    first.groups.append("group_z")
+    second = await auth.get_current_user(conn, x_webauth_user="copied-user", x_webauth_groups=["group_a"])
+    assert second is not None and second.groups == ["group_a"]
+
+
+@pytest.mark.anyio
+async def test_user_cache_identity_change(client: AsyncClient) -> None:
+    headers = {"X-Webauth-User": "changing-user", "X-Webauth-Groups": "group_a"}
+    assert (await client.get("/api/users/self", headers=headers)).status_code == 200
+
+    # new groups are a different identity and get written back
+    headers["X-Webauth-Groups"] = "group_b,group_c"
+    r = await client.get("/api/users/self", headers=headers)
+    assert r.status_code == 200
+    assert r.json()["groups"] == ["group_b", "group_c"]
+
+    async with db.read_session() as session:
+        u = (await session.scalars(select(User).where(User.subject == "changing-user"))).one()
+    assert u.groups == ["group_b", "group_c"]
+
+
+def test_lru_cache_ttl() -> None:
+    cache: LRUCache[str, int] = LRUCache("ttl_test", ttl=-1)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+    cache.ttl = 60
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+
+
+class _JWKSHandler(BaseHTTPRequestHandler):
+    jwks: dict[str, Any] = {"keys": []}
+    delay = 0.0
+
+    def do_GET(self) -> None:
+        time.sleep(self.delay)  # a slow identity provider
+        body = json.dumps(self.jwks).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture(scope="module")
+def signing_key() -> ec.EllipticCurvePrivateKey:
+    key = ec.generate_private_key(ec.SECP256R1())
+    jwk = ECAlgorithm.to_jwk(key.public_key(), as_dict=True)
+    _JWKSHandler.jwks = {"keys": [{**jwk, "kid": "test-key", "alg": "ES256", "use": "sig"}]}
+    return key
+
+
+@pytest.fixture(scope="module")
+def jwks_url() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _JWKSHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/.well-known/jwks.json"
+    server.shutdown()
+
+
+def _token(key: ec.EllipticCurvePrivateKey, sub: str, expires_in: float = 600) -> str:
+    claims = {
+        "iss": "test",
+        "sub": sub,
+        "groups": ["group_a"],
+        "exp": int(time.time() + expires_in),
+    }
+    return jwt.encode(claims, key, algorithm="ES256", headers={"kid": "test-key"})
+
+
+async def _max_loop_lag(done: asyncio.Event) -> float:
+    lag = 0.0
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lag = max(lag, time.perf_counter() - start - 0.005)
+    return lag
+
+
+@pytest.mark.anyio
+async def test_jwt_claims_cache(
+    no_auth_client: AsyncClient,
+    monkeypatch: pytest.MonkeyPatch,
+    signing_key: ec.EllipticCurvePrivateKey,
+    jwks_url: str,
+) -> None:
+    jwks_client = AsyncJWKSClient(jwks_url)
+    monkeypatch.setattr(auth, "jwks_client", jwks_client)
+
+    headers = {"Authorization": f"Bearer {_token(signing_key, 'jwt-user')}"}
+    r = await no_auth_client.get("/api/users/self", headers=headers)
+    assert r.status_code == 200
+    assert r.json()["subject"] == "jwt-user"
+
+    hits = auth.claims_cache.hits
+    r = await no_auth_client.get("/api/users/self", headers=headers)
+    assert r.status_code == 200
+    assert auth.claims_cache.hits == hits + 1
+    assert jwks_client.fetches == 1
+
+    # expired tokens are rejected and not cached
+    headers = {"Authorization": f"Bearer {_token(signing_key, 'jwt-user', expires_in=-10)}"}
+    assert (await no_auth_client.get("/api/users/self", headers=headers)).status_code == 401
+
+    # unknown keys don't make it through either
+    headers = {"Authorization": f"Bearer {_token(ec.generate_private_key(ec.SECP256R1()), 'jwt-user')}"}
+    assert (await no_auth_client.get("/api/users/self", headers=headers)).status_code == 401
+
+
+@pytest.mark.anyio
+async def test_jwks_fetch_does_not_block(
+    no_auth_client: AsyncClient,
+    monkeypatch: pytest.MonkeyPatch,
+    signing_key: ec.EllipticCurvePrivateKey,
+    jwks_url: str,
+) -> None:
+    # keys are always stale, every request starts a background refresh
+    jwks_client = AsyncJWKSClient(jwks_url, refresh_interval=0)
+    monkeypatch.setattr(auth, "jwks_client", jwks_client)
+    monkeypatch.setattr(_JWKSHandler, "delay", 0.3)
+
+    # a full collection of everything the test session imported would show up as lag
+    gc.collect()
+    done = asyncio.Event()
+    lag = asyncio.create_task(_max_loop_lag(done))
+
+    # the first request has to wait for the keys
+    headers = {"Authorization": f"Bearer {_token(signing_key, 'jwks-user-1')}"}
+    assert (await no_auth_client.get("/api/users/self", headers=headers)).status_code == 200
+
+    # later ones use the stale keys while they're refreshed in the background
+    start = time.perf_counter()
+    headers = {"Authorization": f"Bearer {_token(signing_key, 'jwks-user-2')}"}
+    assert (await no_auth_client.get("/api/users/self", headers=headers)).status_code == 200
+    assert time.perf_counter() - start < 0.2
+
+    await jwks_client.refresh()
+    assert jwks_client.fetches == 2
+
+    done.set()
+    assert await lag < 0.1
+
+
+@pytest.mark.anyio
+async def test_jwks_failed_fetch_rate_limited(caplog: pytest.LogCaptureFixture) -> None:
+    requests = 0
+
+    def unavailable(request: httpx.Request) -> httpx.Response:
+        nonlocal requests
+        requests += 1
+        return httpx.Response(503)
+
+    jwks_client = AsyncJWKSClient("https://idp.test/jwks.json", transport=httpx.MockTransport(unavailable))
+
+    for _ in range(3):
+        with pytest.raises(jwt.PyJWKClientError):
+            await jwks_client.get_signing_key("test-key")
+    # the failed attempt counts, only the first unknown key id waits for a fetch
+    assert requests == 1
+    assert jwks_client.fetches == 0
+    assert "could not refresh JWKS from https://idp.test/jwks.json" in caplog.text
+
+    jwks_client.min_refresh_interval = 0
+    with pytest.raises(jwt.PyJWKClientError):
+        await jwks_client.get_signing_key("test-key")
+    assert requests == 2
@@ -0,0 +1,176 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any
+
+import numpy as np
+import polars as pl
+import pytest
+from httpx import AsyncClient
+
+from ..core import charts
+from ..core.cache import LRUCache
+from ..core.charts import Chart, ChartKey, ChartRenderer, chart_renderer
+
+
+def test_lru_cache_maxbytes() -> None:
+    cache: LRUCache[str, bytes] = LRUCache("bytes_test", maxbytes=10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    assert cache.stats()["bytes"] == 10
+
+    # evicts the least recently used entry
+    cache.get("a")
+    cache.put("c", b"1")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+
+    # replacing a value doesn't count it twice
+    cache.put("a", b"123")
+    assert cache.stats()["bytes"] == 4
+
+    # a value which is larger than the cache isn't kept
+    cache.put("d", b"12345678901")
+    assert len(cache) == 0
+    assert cache.stats()["bytes"] == 0
+
+
+@pytest.mark.anyio
+async def test_render_single_flight(monkeypatch: pytest.MonkeyPatch) -> None:
+    def render(spec: dict[str, Any], df: pl.DataFrame, data_format: str, dpi: int) -> bytes:
+        time.sleep(0.1)  # a slow render
+        return f"{data_format} {dpi} {df.height}".encode()
+
+    loads = 0
+
+    async def load() -> pl.DataFrame:
+        nonlocal loads
+        loads += 1
+        return pl.DataFrame({"sequence_number": [0, 1, 2], "a": [1, 2, 3]})
+
+    monkeypatch.setattr(charts, "_render", render)
+    renderer = ChartRenderer(1, 1024)
+    renderer._pool = ThreadPoolExecutor(1)
+
+    key = ChartKey(1, charts.spec_hash({"mark": "point"}), "1_1_1_1", "png", 150)
+    results = await asyncio.gather(*(renderer.render(key, {"mark": "point"}, load) for _ in range(5)))
+    assert results == [Chart(b"png 150 3", 0)] * 5
+    assert renderer.renders == 1
+    assert loads == 1
+
+    # served from the cache until the run changes
+    assert (await renderer.render(key, {"mark": "point"}, load)).content == b"png 150 3"
+    assert renderer.renders == 1
+
+    # decimated data is another chart
+    key = key._replace(max_points=4)
+    assert await renderer.render(key, {"mark": "point"}, load) == Chart(b"png 150 3", 0)
+    assert renderer.renders == 2
+
+    renderer.invalidate(1)
+    await renderer.render(key, {"mark": "point"}, load)
+    assert renderer.renders == 3
+
+    renderer.shutdown()
+
+
+class BrokenPool(ThreadPoolExecutor):
+    def submit(self, *args: Any, **kwargs: Any) -> Any:
+        raise BrokenProcessPool("a worker died")
+
+
+@pytest.mark.anyio
+async def test_render_broken_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def load() -> pl.DataFrame:
+        return pl.DataFrame({"sequence_number": [0, 1, 2], "a": [1, 2, 3]})
+
+    monkeypatch.setattr(charts, "_render", lambda spec, df, data_format, dpi: b"chart")
+    monkeypatch.setattr(charts, "ProcessPoolExecutor", lambda workers, mp_context: ThreadPoolExecutor(workers))
+    renderer = ChartRenderer(1, 1024)
+    broken = renderer._pool = BrokenPool(1)
+
+    # the render is retried in a new pool
+    key = ChartKey(1, charts.spec_hash({"mark": "point"}), "1_1_1_1", "svg", 72)
+    assert (await renderer.render(key, {"mark": "point"}, load)).content == b"chart"
+    assert renderer._pool is not None and renderer._pool is not broken
+
+    # if the new pool breaks too the render fails, the next one gets a new pool again
+    monkeypatch.setattr(charts, "ProcessPoolExecutor", lambda workers, mp_context: BrokenPool(workers))
+    renderer._pool = BrokenPool(1)
+    with pytest.raises(BrokenProcessPool):
+        await renderer.render(key._replace(dpi=96), {"mark": "point"}, load)
+    assert renderer._pool is None
+
+    renderer.shutdown()
+
+
+@pytest.mark.anyio
+async def test_plot_cached(client: AsyncClient) -> None:
+    pytest.importorskip("altair")
+    pytest.importorskip("vl_convert")
+
+    h = {"X-Webauth-User": "chart-user"}
+    r = await client.post("/api/projects", headers=h, json={"short_code": "CHART", "name": "charts"})
+    assert r.status_code == 200
+
+    spec = {
+        "data": {"values": []},
+        "mark": "point",
+        "encoding": {"x": {"field": "sequence_number", "type": "quantitative"}},
+    }
+    r = await client.post(
+        "/api/testruns",
+        headers=h,
+        json={
+            "project_id": r.json()["id"],
+            "short_code": "CHART_RUN",
+            "dut_id": "device_1",
+            "machine_hostname": "test",
+            "user_name": "chart-user",
+            "test_name": "charts",
+            "data": {"vega_lite": spec},
+        },
+    )
+    assert r.status_code == 201
+
+    renders = chart_renderer.renders
+    for _ in range(2):
+        r = await client.get("/api/testruns/plot/CHART_RUN?format=svg", headers=h)
+        assert r.status_code == 200
+        assert r.content.startswith(b"<svg")
+    assert chart_renderer.renders == renders + 1
+
+    r = await client.put("/api/testruns/CHART_RUN/field/vega_lite", headers=h, json={"mark": "point"})
+    assert r.status_code == 200
+    r = await client.get("/api/testruns/plot/CHART_RUN?format=svg", headers=h)
+    assert r.status_code == 400
+
+
+def test_prepare_decimates_plotted_fields() -> None:
+    n, columns = 100_000, 50
+    steps = np.arange(n)
+    rng = np.random.default_rng(1)
+    df = pl.DataFrame(
+        {"sequence_number": steps, **{f"mc_value_{c}": rng.normal(size=n) for c in range(columns)}}
+    )
+    spec = {
+        "mark": "line",
+        "encoding": {
+            "x": {"field": "sequence_number", "type": "quantitative"},
+            "y": {"field": "mc_value_0", "type": "quantitative"},
+        },
+    }
+
+    key = ChartKey(1, "hash", "v1", "svg", 72, max_points=2000)
+    _, out, decimated = charts._prepare(spec, df, key)
+    # the other series don't keep their extremes
+    assert out.columns == ["sequence_number", "mc_value_0"]
+    assert out.height <= 2000
+    assert decimated == n - out.height
+
+    # sequence_number is used for decimation even if the chart doesn't show it
+    spec["encoding"]["x"] = {"field": "mc_value_1", "type": "quantitative"}
+    _, out, _ = charts._prepare(spec, df, key)
+    assert out.columns == ["mc_value_0", "mc_value_1"]
+    assert out.height <= 2000
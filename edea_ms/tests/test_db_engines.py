@@ -0,0 +1,107 @@
+import asyncio
+from typing import Any
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import event, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from .. import db
+from ..db.frames import read_frames
+from ..db.models import Model, Project
+
+
+@pytest.mark.anyio
+async def test_engines() -> None:
+    assert db.engine.pool.size() == 1  # type: ignore[attr-defined]
+    assert db.reader_engine is not db.engine
+
+    async with db.read_session() as session:
+        with pytest.raises(OperationalError, match="readonly"):
+            await session.execute(text("CREATE TABLE read_only_test (id INTEGER)"))
+
+
+@pytest.mark.anyio
+async def test_read_during_write(client: AsyncClient) -> None:
+    # make sure the user exists, creating it would need the writer
+    assert (await client.get("/api/projects")).status_code == 200
+
+    async with db.engine.begin() as conn:
+        # hold the write lock and the only writer connection
+        await conn.execute(text("UPDATE users SET displayname = displayname"))
+
+        r = await asyncio.wait_for(client.get("/api/projects"), timeout=2)
+        assert r.status_code == 200
+
+        await conn.rollback()
+
+
+@pytest.mark.anyio
+async def test_request_session_scope(client: AsyncClient) -> None:
+    checkouts: list[str] = []
+
+    def count_reader(*args: Any) -> None:
+        checkouts.append("reader")
+
+    def count_writer(*args: Any) -> None:
+        checkouts.append("writer")
+
+    event.listen(db.reader_engine.sync_engine, "checkout", count_reader)
+    event.listen(db.engine.sync_engine, "checkout", count_writer)
+    try:
+        # a new user is looked up in the read session the route continues with
+        r = await client.get("/api/projects", headers={"X-Webauth-User": "scope-user"})
+        assert r.status_code == 200
+        assert checkouts == ["reader", "writer"]
+
+        checkouts.clear()
+        r = await client.get("/api/projects", headers={"X-Webauth-User": "scope-user"})
+        assert r.status_code == 200
+        assert checkouts == ["reader"]
+
+        checkouts.clear()
+        r = await client.post(
+            "/api/projects",
+            json={"short_code": "SCOPE_P1", "name": "scope"},
+            headers={"X-Webauth-User": "scope-user"},
+        )
+        assert r.status_code == 200
+        assert checkouts == ["writer"]
+    finally:
+        event.remove(db.reader_engine.sync_engine, "checkout", count_reader)
+        event.remove(db.engine.sync_engine, "checkout", count_writer)
+
+
+@pytest.mark.anyio
+async def test_read_frames(client: AsyncClient) -> None:
+    for i, groups in enumerate([["a"], []]):
+        r = await client.post(
+            "/api/projects", json={"short_code": f"FRAMES_{i}", "name": f"frames {i}", "groups": groups}
+        )
+        assert r.status_code == 200
+
+    query = select(Project.id, Project.short_code, Project.groups).where(Project.short_code.like("FRAMES_%"))
+
+    # SQLite database file, read on a connection of its own in batches
+    async with db.read_session() as session:
+        df, empty = await read_frames(session, [query, query.where(Project.id < 0)], batch_size=1)
+
+    assert df["short_code"].to_list() == ["FRAMES_0", "FRAMES_1"]
+    assert df.schema["id"].is_integer()
+    assert empty.is_empty() and empty.columns == df.columns
+
+    # any other database, streamed through the session
+    memory = create_async_engine("sqlite+aiosqlite://")
+    async with memory.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all)
+        await conn.execute(
+            text("INSERT INTO projects (short_code, name, groups, user_id) VALUES ('FRAMES_M', 'm', '[]', 1)")
+        )
+
+    async with AsyncSession(memory) as session:
+        (streamed,) = await read_frames(session, [query])
+    await memory.dispose()
+
+    assert streamed["short_code"].to_list() == ["FRAMES_M"]
+    assert streamed.columns == df.columns
@@ -0,0 +1,59 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from ..core.downsample import decimate
+
+
+def test_decimate() -> None:
+    n = 10_000
+    steps = np.arange(n)
+    df = pl.DataFrame({"sequence_number": steps, "sine": np.sin(steps / 100), "mode": ["a"] * n})
+    # a single spike has to survive
+    df = df.with_columns(pl.when(pl.col("sequence_number") == 4321).then(10.0).otherwise(pl.col("sine")).alias("sine"))
+
+    out = decimate(df, 400)
+    assert out.height <= 400
+    assert out["sine"].max() == 10.0
+    assert out["sine"].min() == df["sine"].min()
+    # first and last point and the order along x are kept
+    assert out["sequence_number"][0] == 0 and out["sequence_number"][-1] == n - 1
+    assert out["sequence_number"].is_sorted()
+    assert out.columns == df.columns
+
+    # small frames aren't touched
+    assert decimate(df.head(10), 400).equals(df.head(10))
+
+
+def test_decimate_many_series() -> None:
+    n, columns = 100_000, 50
+    rng = np.random.default_rng(2)
+    df = pl.DataFrame({"sequence_number": np.arange(n), **{f"value_{c}": rng.normal(size=n) for c in range(columns)}})
+
+    # max_points bounds the rows, not the points of each series
+    out = decimate(df, 2000)
+    assert 1000 < out.height <= 2000
+    for c in range(columns):
+        assert out[f"value_{c}"].max() == df[f"value_{c}"].max()
+        assert out[f"value_{c}"].min() == df[f"value_{c}"].min()
+
+    # too many series for max_points still keeps one bucket with the extremes of all of them
+    out = decimate(df, 4)
+    assert out.height <= 2 + 2 * columns
+    assert out["value_7"].max() == df["value_7"].max()
+
+
+def test_decimate_x() -> None:
+    df = pl.DataFrame(
+        {
+            "setpoint": [3.0, 1.0, None, 2.0, 0.0, 5.0, 4.0, 6.0, 7.0],
+            "value": [30.0, 10.0, 99.0, 20.0, 0.0, 50.0, 40.0, 60.0, 70.0],
+        }
+    )
+
+    # one bucket, first, last, min and max of value along setpoint, the row without setpoint stays
+    out = decimate(df, 4, x="setpoint")
+    assert out["setpoint"].to_list() == [0.0, 7.0, None]
+
+    with pytest.raises(ValueError):
+        decimate(df, 4, x="unknown")
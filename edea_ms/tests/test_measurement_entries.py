@@ -0,0 +1,418 @@
+import asyncio
+import io
+import json
+from typing import Any, AsyncIterator
+
+import polars as pl
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import select
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from ..db import engine, models
+from ..db.columns import column_cache
+from ..main import app
+
+
+async def _running_testrun(client: AsyncClient, short_code: str) -> int:
+    r = await client.get("/api/projects/ME_P1")
+    if r.status_code == 404:
+        r = await client.post(
+            "/api/projects",
+            json={"short_code": "ME_P1", "name": "measurement entries", "groups": []},
+        )
+        assert r.status_code == 200
+    project_id = r.json()["id"]
+
+    r = await client.post(
+        "/api/testruns",
+        json={
+            "project_id": project_id,
+            "short_code": short_code,
+            "dut_id": "device_1",
+            "machine_hostname": "test",
+            "user_name": "test-user",
+            "test_name": "unit-test",
+        },
+    )
+    assert r.status_code == 201
+    testrun_id: int = r.json()["id"]
+
+    r = await client.post(
+        f"/api/testruns/setup/{testrun_id}",
+        json={
+            "steps": [{"sequence_number": i, "Vin": float(i)} for i in range(10)],
+            "columns": {"Vin": {"measurement_unit": "V"}},
+        },
+    )
+    assert r.status_code == 200
+
+    r = await client.put(f"/api/testruns/start/{testrun_id}")
+    assert r.status_code == 200
+
+    return testrun_id
+
+
+@pytest.mark.anyio
+async def test_bulk_create_measurement_entries(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_BULK")
+
+    steps = [
+        {"sequence_number": i, "payload": {"Iin": i * 0.5, "status": "ok"}}
+        for i in range(10)
+    ]
+    r = await client.post(
+        "/api/measurement_entries/bulk",
+        json={"testrun_id": testrun_id, "steps": steps},
+    )
+    assert r.status_code == 201
+    assert r.json() == {"inserted_rows": 20}
+
+    r = await client.get(f"/api/testruns/measurements/{testrun_id}")
+    assert r.status_code == 200
+
+    rows = r.json()
+    assert len(rows) == 10
+    assert rows[4]["mc_Iin"] == 2.0
+    assert rows[4]["mc_status"] == "ok"
+
+
+@pytest.mark.anyio
+async def test_bulk_create_requires_running_state(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_DONE")
+
+    r = await client.put(f"/api/testruns/complete/{testrun_id}")
+    assert r.status_code == 200
+
+    r = await client.post(
+        "/api/measurement_entries/bulk",
+        json={
+            "testrun_id": testrun_id,
+            "steps": [{"sequence_number": 0, "payload": {"Iin": 1.0}}],
+        },
+    )
+    assert r.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_column_cache(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_CACHE")
+
+    r = await client.get("/api/metrics/caches")
+    assert r.status_code == 200
+    before = r.json()["measurement_columns"]
+
+    for i in range(3):
+        r = await client.post(
+            "/api/measurement_entries/batch",
+            json={"testrun_id": testrun_id, "sequence_number": i, "payload": {"Iin": 1.0}},
+        )
+        assert r.status_code == 201
+
+    # the first lookup of the already existing column fills the cache
+    after = (await client.get("/api/metrics/caches")).json()["measurement_columns"]
+    assert after["hits"] - before["hits"] == 2
+    assert after["misses"] - before["misses"] == 1
+
+    # creating columns in a project drops its cached entries
+    project_id = (await client.get("/api/projects/ME_P1")).json()["id"]
+    r = await client.post(
+        "/api/measurement_columns",
+        json={"project_id": project_id, "name": "Vout"},
+    )
+    assert r.status_code == 200
+    r = await client.get("/api/metrics/caches")
+    assert r.json()["measurement_columns"]["size"] == 0
+
+
+@pytest.mark.anyio
+async def test_column_cache_delete(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_CACHE_DELETE")
+    r = await client.post(
+        "/api/measurement_entries/batch",
+        json={"testrun_id": testrun_id, "sequence_number": 0, "payload": {"Idel": 1.0}},
+    )
+    assert r.status_code == 201
+    project_id = (await client.get("/api/projects/ME_P1")).json()["id"]
+    column = next(c for c in (await client.get("/api/measurement_columns")).json() if c["name"] == "Idel")
+
+    column_cache.put((project_id, "Idel"), column["id"])
+    column_cache.put((project_id + 1000, "Idel"), 1)
+    assert column_cache.ttl is not None
+
+    # only the cached columns of the project of the deleted column are dropped
+    r = await client.delete(f"/api/measurement_columns/{column['id']}")
+    assert r.status_code == 200
+    assert column_cache.get((project_id, "Idel")) is None
+    assert column_cache.get((project_id + 1000, "Idel")) == 1
+    column_cache.pop((project_id + 1000, "Idel"))
+
+
+@pytest.mark.anyio
+async def test_concurrent_column_creation(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_CONC")
+
+    responses = await asyncio.gather(
+        *[
+            client.post(
+                "/api/measurement_entries/batch",
+                json={"testrun_id": testrun_id, "sequence_number": i, "payload": {"Pout": 2.5}},
+            )
+            for i in range(5)
+        ]
+    )
+    assert all(r.status_code == 201 for r in responses)
+
+    r = await client.get("/api/measurement_columns")
+    assert [c["name"] for c in r.json()].count("Pout") == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("data_format", ["arrow", "parquet"])
+async def test_upload_measurements(client: AsyncClient, data_format: str) -> None:
+    testrun_id = await _running_testrun(client, f"ME_{data_format.upper()}")
+
+    df = pl.DataFrame(
+        {
+            "sequence_number": range(10),
+            "Iin": [i * 0.5 for i in range(10)],
+            "status": ["ok"] * 9 + [None],
+        }
+    )
+    buf = io.BytesIO()
+    if data_format == "arrow":
+        df.write_ipc_stream(buf)
+    else:
+        df.write_parquet(buf)
+
+    r = await client.post(
+        f"/api/testruns/{testrun_id}/measurements?format={data_format}",
+        content=buf.getvalue(),
+    )
+    assert r.status_code == 201
+    assert r.json() == {"inserted_rows": 19}
+
+    r = await client.get(f"/api/testruns/measurements/{testrun_id}")
+    rows = r.json()
+    assert len(rows) == 10
+    assert rows[3]["mc_Iin"] == 1.5
+    assert rows[3]["mc_status"] == "ok"
+    assert rows[9]["mc_status"] is None
+
+
+@pytest.mark.anyio
+async def test_upload_measurements_invalid(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_INVALID")
+
+    r = await client.post(f"/api/testruns/{testrun_id}/measurements", content=b"garbage")
+    assert r.status_code == 422
+
+    r = await client.post(f"/api/testruns/{testrun_id}/measurements", content=b"")
+    assert r.status_code == 422
+    r = await client.post(f"/api/testruns/{testrun_id}/measurements?format=parquet", content=b"")
+    assert r.status_code == 422
+
+    for df in (
+        pl.DataFrame({"Iin": [1.0]}),
+        pl.DataFrame({"sequence_number": ["a"], "Iin": [1.0]}),
+        pl.DataFrame({"sequence_number": [1.5], "Iin": [1.0]}),
+        pl.DataFrame({"sequence_number": [None, 1], "Iin": [1.0, 2.0]}),
+        pl.DataFrame({"sequence_number": [1], "Iin": [[1.0, 2.0]]}),
+        pl.DataFrame({"sequence_number": [1], "Iin": [{"a": 1.0}]}),
+    ):
+        buf = io.BytesIO()
+        df.write_ipc_stream(buf)
+        r = await client.post(f"/api/testruns/{testrun_id}/measurements", content=buf.getvalue())
+        assert r.status_code == 422, df
+
+
+@pytest.mark.anyio
+async def test_upload_measurements_like_json(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_LIKE_JSON")
+
+    r = await client.post(
+        "/api/measurement_entries/batch",
+        json={"testrun_id": testrun_id, "sequence_number": 0, "payload": {"passed": True, "Iin": 1}},
+    )
+    assert r.status_code == 201
+
+    buf = io.BytesIO()
+    pl.DataFrame({"sequence_number": [1, 2], "passed": [True, False], "Iin": [2, 3]}).write_ipc_stream(buf)
+    r = await client.post(f"/api/testruns/{testrun_id}/measurements", content=buf.getvalue())
+    assert r.status_code == 201
+
+    async with engine.connect() as conn:
+        rows = (
+            await conn.execute(
+                select(
+                    models.MeasurementEntry.sequence_number,
+                    models.MeasurementEntry.numeric_value,
+                    models.MeasurementEntry.string_value,
+                    models.MeasurementEntry.flags,
+                )
+                .where(models.MeasurementEntry.testrun_id == testrun_id)
+                .order_by(models.MeasurementEntry.sequence_number, models.MeasurementEntry.column_id)
+            )
+        ).all()
+    by_step = {(seq, value if text is None else text) for seq, value, text, _ in rows}
+    assert {(0, "True"), (1, "True"), (2, "False"), (0, 1.0), (1, 2.0), (2, 3.0)} == by_step
+    assert {flags for *_, flags in rows} == {0}
+
+
+@pytest.mark.anyio
+async def test_stream_measurement_entries(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_STREAM")
+
+    async def steps() -> AsyncIterator[bytes]:
+        for i in range(10):
+            line = json.dumps({"sequence_number": i, "payload": {"Iin": i * 0.5}})
+            # split lines over chunk boundaries like a network stream would
+            yield line[:5].encode()
+            yield (line[5:] + "\n").encode()
+
+    r = await client.post(
+        f"/api/measurement_entries/stream/{testrun_id}?chunk_rows=4", content=steps()
+    )
+    assert r.status_code == 201
+    assert r.json() == {"inserted_rows": 10, "commits": 3}
+
+    r = await client.get(f"/api/testruns/measurements/{testrun_id}")
+    assert r.json()[9]["mc_Iin"] == 4.5
+
+
+@pytest.mark.anyio
+async def test_stream_measurement_entries_invalid_line(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_STREAM_INVALID")
+
+    async def steps() -> AsyncIterator[bytes]:
+        yield b'{"sequence_number": 0, "payload": {"Iin": 1.0}}\n'
+        yield b'{"sequence_number": "x"}\n'
+
+    r = await client.post(
+        f"/api/measurement_entries/stream/{testrun_id}?chunk_rows=1", content=steps()
+    )
+    assert r.status_code == 422
+    assert r.json()["detail"]["msg"] == "invalid step in line 2"
+    assert r.json()["detail"]["inserted_rows"] == 1
+
+
+async def _entry_count(testrun_id: int) -> int:
+    async with engine.connect() as conn:
+        return len(
+            (
+                await conn.execute(
+                    select(models.MeasurementEntry.id).where(models.MeasurementEntry.testrun_id == testrun_id)
+                )
+            ).all()
+        )
+
+
+@pytest.mark.anyio
+async def test_stream_measurement_entries_idle(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_STREAM_IDLE")
+    committed_while_idle = False
+
+    async def steps() -> AsyncIterator[bytes]:
+        nonlocal committed_while_idle
+        yield b'{"sequence_number": 0, "payload": {"Iin": 1.0}}\n'
+        # a station that pauses between steps
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if committed_while_idle := await _entry_count(testrun_id) == 1:
+                break
+        yield b'{"sequence_number": 1, "payload": {"Iin": 2.0}}\n'
+
+    r = await client.post(
+        f"/api/measurement_entries/stream/{testrun_id}?chunk_rows=100&chunk_seconds=0.05", content=steps()
+    )
+    assert r.status_code == 201
+    assert r.json() == {"inserted_rows": 2, "commits": 2}
+    assert committed_while_idle
+
+
+@pytest.mark.anyio
+async def test_stream_measurement_entries_disconnect(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_STREAM_DISCONNECT")
+    messages = [
+        {
+            "type": "http.request",
+            "body": b'{"sequence_number": 0, "payload": {"Iin": 1.0}}\n{"sequence_number": 1, "pay',
+            "more_body": True,
+        },
+    ]
+
+    async def receive() -> dict[str, Any]:
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message: dict[str, Any]) -> None:
+        pass
+
+    path = f"/api/measurement_entries/stream/{testrun_id}"
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"chunk_rows=100",
+        "headers": [(b"host", b"test"), (b"x-webauth-user", b"test-user")],
+        "server": ("test", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+    await app(scope, receive, send)
+
+    # the complete line received before the disconnect is kept
+    assert await _entry_count(testrun_id) == 1
+
+
+@pytest.mark.anyio
+async def test_websocket_measurement_entries(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_WS")
+    url = f"/api/measurement_entries/ws/{testrun_id}"
+
+    # not used as context manager, that would run the lifespan (and migrations) again
+    ws_client = TestClient(app, headers={"X-Webauth-User": "test-user"})
+
+    with ws_client.websocket_connect(url) as ws:
+        ws.send_json({"sequence_number": 0, "payload": {"Iin": 0.5}})
+        assert ws.receive_json() == {"committed": 0, "inserted_rows": 1}
+
+        ws.send_json([{"sequence_number": i, "payload": {"Iin": i * 0.5}} for i in range(1, 4)])
+        assert ws.receive_json() == {"committed": 3, "inserted_rows": 4}
+
+        ws.send_json({"sequence_number": "x"})
+        assert "error" in ws.receive_json()
+
+    # other users can't write into the run
+    with pytest.raises(WebSocketDisconnect):
+        with ws_client.websocket_connect(url, headers={"X-Webauth-User": "user-2"}) as ws:
+            ws.receive_json()
+
+    r = await client.get(f"/api/testruns/measurements/{testrun_id}")
+    assert r.json()[3]["mc_Iin"] == 1.5
+
+
+@pytest.mark.anyio
+async def test_concurrent_ingest_is_coalesced(client: AsyncClient) -> None:
+    testrun_id = await _running_testrun(client, "ME_COALESCE")
+    before = (await client.get("/api/metrics/writer")).json()
+
+    responses = await asyncio.gather(
+        *[
+            client.post(
+                "/api/measurement_entries/batch",
+                json={"testrun_id": testrun_id, "sequence_number": i, "payload": {"Iin": 1.0}},
+            )
+            for i in range(20)
+        ]
+    )
+    assert all(r.status_code == 201 for r in responses)
+
+    after = (await client.get("/api/metrics/writer")).json()
+    assert after["rows_written"] - before["rows_written"] == 20
+    assert after["flushes"] - before["flushes"] < 20
+    assert after["pending_rows"] == 0
@@ -1,11 +1,18 @@
+import io
 import itertools
 from typing import Any
 
 import numpy as np
+import polars as pl
 import pytest
 from edea_tmc.remote import AsyncMSRunner  # type: ignore
 from edea_tmc.stepper import Stepper, StepResult, StepStatus  # type: ignore
 from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db import engine
+from ..db.snapshots import data_version, testrun_snapshots
+from ..routers import testruns
 
 
 def flexible_test_condition_generator(test_parameters: dict[str, list[Any]]) -> list[dict[str, Any]]:
@@ -125,7 +132,43 @@ class TestMeasurementFlow:
     async def test_get_run_results(self, client: AsyncClient) -> None:
         r = await client.get("/api/testruns/measurements/1")
         assert r.status_code == 200
-        assert len(r.json()) == 75
+
+        # the runner submits the results of step n with sequence number n + 1, rows are joined on it
+        rows = r.json()
+        assert len(rows) == 76
+        assert rows[0]["sequence_number"] == 0 and rows[0]["mc_DCDC"] is None
+        assert rows[-1]["sequence_number"] == 75 and rows[-1]["fc_Source_V"] is None
+
+        r = await client.get("/api/testruns/measurements/1?max_points=8")
+        assert r.status_code == 200
+        assert int(r.headers["X-Decimated-Rows"]) == 76 - len(r.json())
+        assert len(r.json()) < 76
+
+    @pytest.mark.parametrize("data_format", ["csv", "json", "ndjson", "parquet"])
+    async def test_stream_run_results(
+        self, client: AsyncClient, data_format: str, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        # several parts, the last one only partially filled
+        monkeypatch.setattr(testruns, "EXPORT_WINDOW_STEPS", 10)
+        testrun_snapshots.clear()
+
+        url = f"/api/testruns/measurements/1?format={data_format}"
+        # computed from the database, then from the snapshot the buffered export leaves behind
+        streamed = [await client.get(f"{url}&stream=true")]
+        r = await client.get(url)
+        streamed.append(await client.get(f"{url}&stream=true"))
+        assert r.status_code == 200
+
+        for s in streamed:
+            assert s.status_code == 200
+            if data_format == "parquet":
+                df = pl.read_parquet(io.BytesIO(s.content))
+                assert df.height == 76
+                assert df.equals(pl.read_parquet(io.BytesIO(r.content)))
+            elif data_format == "json":
+                assert s.json() == r.json()
+            else:
+                assert s.text == r.text
 
     async def test_get_project_runs(self, client: AsyncClient) -> None:
         r = await client.get("/api/testruns/project/X5678")
@@ -137,3 +180,36 @@ class TestMeasurementFlow:
 
         tr = r.json()
         assert len(tr) > 0
+
+    async def test_run_results_snapshot(self, client: AsyncClient) -> None:
+        async def snapshot_hits() -> int:
+            r = await client.get("/api/metrics/caches")
+            return int(r.json()["testrun_snapshots"]["hits"])
+
+        # the run is complete, exports after the first one are read from its snapshot
+        r = await client.get("/api/testruns/measurements/1")
+        hits = await snapshot_hits()
+        assert (await client.get("/api/testruns/measurements/1")).json() == r.json()
+        assert await snapshot_hits() == hits + 1
+
+        # changing a forcing condition of the run drops the snapshot
+        conditions = (await client.get("/api/forcing_conditions?testrun_id=1")).json()
+        # conditions are only listed for runs the user can see
+        r = await client.get("/api/forcing_conditions", headers={"X-Webauth-User": "other-user"})
+        assert r.json() == []
+        cond = next(
+            c for c in conditions if c["testrun_id"] == 1 and c["sequence_number"] == 0 and c["numeric_value"] == 3.0
+        )
+        async with AsyncSession(engine) as session:
+            before = await data_version(session, 1)
+        cond["numeric_value"] = 42.0
+        assert (await client.put(f"/api/forcing_conditions/{cond['id']}", json=cond)).status_code == 200
+
+        # the data version changes with the update, a snapshot another worker computes from the data
+        # before the update is stored under the old version and never read
+        async with AsyncSession(engine) as session:
+            assert await data_version(session, 1) != before
+        testrun_snapshots.put(1, before, pl.DataFrame({"stale": [1.0]}))
+
+        rows = (await client.get("/api/testruns/measurements/1")).json()
+        assert rows[0]["fc_Source_V"] == 42.0
@@ -0,0 +1,13 @@
+import pytest
+from httpx import AsyncClient
+
+
+@pytest.mark.anyio
+async def test_db_pragmas(client: AsyncClient) -> None:
+    r = await client.get("/api/metrics/db")
+    assert r.status_code == 200
+
+    settings = r.json()
+    assert settings["profile"] == "wal"
+    assert settings["pragmas"]["journal_mode"] == "wal"
+    assert settings["pragmas"]["busy_timeout"] == 5000
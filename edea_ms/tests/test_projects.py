@@ -90,6 +90,22 @@ async def test_update_project(client: AsyncClient) -> None:
     assert v["name"] == d["name"]
 
 
+@pytest.mark.anyio
+async def test_update_project_groups(client: AsyncClient) -> None:
+    r = await client.get("/api/projects/TLA_P2", headers={"X-Webauth-User": "user-2"})
+    v = r.json()
+    v["groups"] = ["group_e", "group_f"]
+
+    r = await client.put("/api/projects/TLA_P2", json=v, headers={"X-Webauth-User": "user-2"})
+    assert r.status_code == 200
+
+    # access follows the new groups
+    r = await client.get("/api/projects/TLA_P2", headers={"X-Webauth-User": "user-6", "X-Webauth-Groups": "group_e"})
+    assert r.status_code == 200
+    r = await client.get("/api/projects/TLA_P2", headers={"X-Webauth-User": "user-6", "X-Webauth-Groups": "group_c"})
+    assert r.status_code == 404
+
+
 @pytest.mark.anyio
 async def test_delete_project(client: AsyncClient) -> None:
     r = await client.delete("/api/projects/TLA_P2", headers={"X-Webauth-User": "user-2"})
@@ -0,0 +1,73 @@
+from typing import Any
+
+import pytest
+from sqlalchemy import Select
+from sqlalchemy.dialects import sqlite
+
+from .. import db
+from ..db.columns import _columns_query
+from ..db.models import JobState, TestRun, TestRunState, User
+from ..db.queries import _common_project_ids, all_projects, single_project
+from ..routers import forcing_condition
+from ..routers.jobs import _jobs_query, _new_job_query
+from ..routers.testruns import _conditions_query, _measurements_query, _overview_query, _testruns_query
+
+# tables which grow with the number of runs or measurements, these must never be scanned
+HOT_TABLES = (
+    "measurement_entries",
+    "forcing_conditions",
+    "measurement_columns",
+    "testruns",
+    "jobqueue",
+    "projects",
+)
+
+user = User(id=1, subject="plan-user", groups=["group_a"], roles=[])
+
+
+async def _query_plan(q: Select[Any]) -> list[str]:
+    sql = q.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True})
+    async with db.engine.connect() as conn:
+        return [row[3] for row in await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "q",
+    [
+        _conditions_query(1),
+        _measurements_query(1),
+        _overview_query(user, [1, 2]),
+        _new_job_query(1),
+        _columns_query(1, ["a", "b"]),
+        all_projects(user),
+        single_project(user, "P1"),
+        _common_project_ids(user),
+        _testruns_query(user, [1, 2], [TestRun.state == TestRunState.RUNNING], 10, 50),
+        _testruns_query(user, [1, 2], [TestRun.dut_id == "dut"], 10, 50),
+        _testruns_query(user, [1, 2], [TestRun.test_name == "test"], 10, 50),
+        forcing_condition._conditions_query(user, [1, 2], 1, 10, 50),
+        _jobs_query(1, JobState.NEW, 10, 50),
+    ],
+    ids=[
+        "conditions",
+        "measurements",
+        "overview",
+        "new_job",
+        "columns",
+        "all_projects",
+        "single_project",
+        "common_project_ids",
+        "testruns_by_state",
+        "testruns_by_dut_id",
+        "testruns_by_test_name",
+        "forcing_conditions_page",
+        "jobs_page",
+    ],
+)
+async def test_hot_queries_use_indexes(q: Select[Any]) -> None:
+    plan = await _query_plan(q)
+
+    # aliased tables show up with a numeric suffix, e.g. forcing_conditions_1
+    scans = [d for d in plan if d.startswith("SCAN ") and d.split()[1].startswith(HOT_TABLES)]
+    assert not scans, plan
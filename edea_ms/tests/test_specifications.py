@@ -1,5 +1,10 @@
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import select
+
+from .. import db
+from ..db.models import Project, ProjectGroup, User
+from ..db.queries import project_access_cache
 
 
 @pytest.mark.anyio
@@ -52,3 +57,56 @@ async def test_crud_specification(client: AsyncClient) -> None:
     # verify it's gone now
     r = await client.get(f"/api/specifications/project/{p['id']}", headers=h)
     assert len(r.json()) == 0
+
+
+@pytest.mark.anyio
+async def test_specification_project_access(client: AsyncClient) -> None:
+    owner = {"X-Webauth-User": "spec-owner"}
+    member = {"X-Webauth-User": "spec-member", "X-Webauth-Groups": "group_spec"}
+    spec = {"name": "spec_access", "unit": "V", "minimum": 0.0, "typical": 1.0, "maximum": 2.0}
+
+    # fill the access cache of the member before the project exists
+    r = await client.get("/api/testruns", headers=member)
+    assert r.status_code == 200
+    hits = project_access_cache.hits
+
+    r = await client.post(
+        "/api/projects", headers=owner, json={"short_code": "SPEC_ACCESS", "name": "p", "groups": ["group_spec"]}
+    )
+    assert r.status_code == 200
+    project = r.json()
+
+    r = await client.post("/api/specifications", headers=member, json={"project_id": project["id"], **spec})
+    assert r.status_code == 201
+
+    r = await client.get(f"/api/specifications/project/{project['id']}", headers=member)
+    assert r.status_code == 200
+    assert project_access_cache.hits > hits
+
+    # taking the group away takes the access away
+    project["groups"] = []
+    r = await client.put("/api/projects/SPEC_ACCESS", headers=owner, json=project)
+    assert r.status_code == 200
+
+    r = await client.get(f"/api/specifications/project/{project['id']}", headers=member)
+    assert r.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_specification_project_created_elsewhere(client: AsyncClient) -> None:
+    member = {"X-Webauth-User": "spec-member", "X-Webauth-Groups": "group_spec"}
+    spec = {"name": "spec_elsewhere", "unit": "V", "minimum": 0.0, "typical": 1.0, "maximum": 2.0}
+
+    assert (await client.get("/api/testruns", headers=member)).status_code == 200
+
+    # another worker creates a project, this worker's cache doesn't know about it
+    async with db.async_session() as session:
+        owner = (await session.scalars(select(User).where(User.subject == "spec-owner"))).one()
+        project = Project(short_code="SPEC_ELSEWHERE", name="p", groups=["group_spec"], user_id=owner.id)
+        session.add(project)
+        await session.flush()
+        session.add(ProjectGroup(project_id=project.id, group="group_spec"))
+        await session.commit()
+
+    r = await client.post("/api/specifications", headers=member, json={"project_id": project.id, **spec})
+    assert r.status_code == 201
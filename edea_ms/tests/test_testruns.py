@@ -1,5 +1,25 @@
+import os
+import resource
+import sqlite3
+from pathlib import Path
+
+import polars as pl
 import pytest
 from httpx import AsyncClient
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from ..db import models
+from ..db.models import Model
+from ..routers.testruns import (
+    DataExportFormat,
+    TestRun,
+    _column_kinds,
+    _iter_testrun_df,
+    _pivot_steps,
+    _stream_export,
+)
 
 
 @pytest.mark.anyio
@@ -75,3 +95,216 @@ async def test_crud_testrun(client: AsyncClient) -> None:
     # verify it's gone now
     r = await client.get(url, headers=h)
     assert r.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_list_testruns_pages(client: AsyncClient) -> None:
+    h = {"X-Webauth-User": "pages-user"}
+    r = await client.post("/api/projects", headers=h, json={"short_code": "PAGES", "name": "pages"})
+    assert r.status_code == 200
+    project_id = r.json()["id"]
+
+    for i in range(5):
+        r = await client.post(
+            "/api/testruns",
+            headers=h,
+            json={
+                "project_id": project_id,
+                "short_code": f"PAGES_{i}",
+                "dut_id": f"device_{i % 2}",
+                "machine_hostname": "test",
+                "user_name": "pages-user",
+                "test_name": "pages",
+            },
+        )
+        assert r.status_code == 201
+
+    # follow the links to the next pages
+    ids = []
+    url: str | None = f"/api/testruns/project/{project_id}?limit=2"
+    while url:
+        r = await client.get(url, headers=h)
+        assert r.status_code == 200
+        assert len(r.json()) <= 2
+        ids += [run["id"] for run in r.json()]
+        url = r.links.get("next", {}).get("url")
+        if url:
+            assert url.endswith(f"after={ids[-1]}")
+            assert r.headers["X-Next-Cursor"] == str(ids[-1])
+    assert len(ids) == 5 and ids == sorted(ids)
+
+    # without a limit all runs are returned at once
+    r = await client.get("/api/testruns?dut_id=device_0", headers=h)
+    assert [run["id"] for run in r.json()] == ids[::2]
+    assert "Link" not in r.headers
+
+    r = await client.get(f"/api/testruns?dut_id=device_0&limit=1&after={ids[0]}", headers=h)
+    assert [run["id"] for run in r.json()] == [ids[2]]
+    assert r.headers["X-Next-Cursor"] == str(ids[2])
+
+    r = await client.get("/api/testruns?state=5&test_name=pages", headers=h)
+    assert r.json() == []
+    r = await client.get("/api/testruns?created_after=2000-01-01T00:00:00&test_name=pages", headers=h)
+    assert len(r.json()) == 5
+
+
+@pytest.mark.anyio
+async def test_list_testruns_rows(client: AsyncClient) -> None:
+    h = {"X-Webauth-User": "rows-user"}
+    r = await client.post("/api/projects", headers=h, json={"short_code": "ROWS", "name": "rows"})
+    project_id = r.json()["id"]
+    r = await client.post(
+        "/api/testruns",
+        headers=h,
+        json={
+            "project_id": project_id,
+            "short_code": "ROWS_0",
+            "dut_id": "device",
+            "machine_hostname": "test",
+            "user_name": "rows-user",
+            "test_name": "rows",
+            "data": {"a": [1, 2.5, None], "b": {"c": "d"}},
+        },
+    )
+    run = TestRun.model_validate(r.json())
+    await client.post(f"/api/testruns/setup/{run.id}", headers=h, json={"steps": [], "columns": {}})
+    await client.put(f"/api/testruns/start/{run.id}", headers=h)
+
+    # the rows are encoded like the models were before
+    r = await client.get(f"/api/testruns/project/{project_id}", headers=h)
+    assert r.headers["content-type"] == "application/json"
+    single = await client.get(f"/api/testruns/{run.id}", headers=h)
+    assert single.json()["started_at"] is not None
+    assert r.content == TypeAdapter(list[TestRun]).dump_json([TestRun.model_validate(single.json())])
+
+    # the API schema still shows the models
+    schema = (await client.get("/openapi.json")).json()
+    for path in ("/api/testruns", "/api/testruns/project/{ident}", "/api/projects", "/api/jobs/all"):
+        ok = schema["paths"][path]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert ok["type"] == "array" and "$ref" in ok["items"], path
+
+
+def test_pivot_steps() -> None:
+    entries = pl.DataFrame(
+        {
+            "sequence_number": [1, 1, 0, 0, 1, 0, 2, 2, 1],
+            "column_id": [2, 1, 1, 3, 3, 4, 2, 5, 2],
+            "name": ["b", "a", "a", "mixed", "mixed", "empty", "b", "sequence_number", "b"],
+            "numeric_value": [2.0, 1.0, 0.5, 3.0, None, None, None, 7.0, 9.0],
+            "string_value": [None, None, None, None, "x", None, None, None, None],
+        }
+    )
+    kinds = _column_kinds(entries)
+
+    df = _pivot_steps(entries, "mc", kinds)
+    # ordered by column creation, names without values are left out
+    assert df.columns == ["sequence_number", "mc_a", "mc_b", "mc_mixed", "mc_sequence_number"]
+    assert df.sort("sequence_number").to_dicts() == [
+        {"sequence_number": 0, "mc_a": 0.5, "mc_b": None, "mc_mixed": "3.0", "mc_sequence_number": None},
+        # the first value of a step is kept
+        {"sequence_number": 1, "mc_a": 1.0, "mc_b": 2.0, "mc_mixed": "x", "mc_sequence_number": None},
+        {"sequence_number": 2, "mc_a": None, "mc_b": None, "mc_mixed": None, "mc_sequence_number": 7.0},
+    ]
+
+
+@pytest.mark.parametrize("late_column", [False, True])
+def test_pivot_steps_other_columns(late_column: bool) -> None:
+    # a column without values sorted before one with values
+    entries = pl.DataFrame(
+        {
+            "sequence_number": [0, 0, 1],
+            "column_id": [1, 2, 2],
+            "name": ["empty", "zzz", "zzz"],
+            "numeric_value": [None, 10.0, 11.0],
+            "string_value": pl.Series([None, None, None], dtype=pl.Utf8),
+        }
+    )
+    kinds = _column_kinds(entries)
+    if late_column:
+        # created after the kinds were read, it sorts after all known columns
+        entries = pl.concat([entries, pl.DataFrame([(0, 9, "late", 5.0, None)], schema=entries.schema, orient="row")])
+
+    df = _pivot_steps(entries, "mc", kinds)
+    assert df.to_dict(as_series=False) == {"sequence_number": [0, 1], "mc_zzz": [10.0, 11.0]}
+
+
+@pytest.mark.anyio
+async def test_stream_export_releases_connection(tmp_path: Path) -> None:
+    # a single pooled connection like the read pool uses
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'stream.sqlite'}", poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all)
+
+    conn = sqlite3.connect(tmp_path / "stream.sqlite")
+    conn.executemany(
+        "INSERT INTO measurement_columns (id, name, project_id) VALUES (?, ?, 1)", [(0, "setpoint"), (1, "value")]
+    )
+    conn.executemany(
+        "INSERT INTO forcing_conditions (sequence_number, numeric_value, column_id, testrun_id) VALUES (?, ?, 0, 1)",
+        ((i, i * 0.5) for i in range(25)),
+    )
+    conn.executemany(
+        "INSERT INTO measurement_entries (sequence_number, numeric_value, column_id, testrun_id) VALUES (?, ?, 1, 1)",
+        ((i, i * 2.0) for i in range(25)),
+    )
+    conn.commit()
+    conn.close()
+
+    steps = 0
+    async with AsyncSession(engine) as session:
+        async for df in _iter_testrun_df(models.TestRun(id=1), session, 10):
+            # nothing is held while a part is sent
+            assert not session.in_transaction()
+            assert engine.pool.checkedout() == 0  # type: ignore[attr-defined]
+            steps += df.height
+    await engine.dispose()
+
+    assert steps == 25
+
+
+def _rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+@pytest.mark.anyio
+@pytest.mark.skipif(
+    not os.getenv("EDEA_MS_LARGE_TESTS"), reason="exports a run with 10M entries, set EDEA_MS_LARGE_TESTS=1"
+)
+async def test_stream_export_memory(tmp_path: Path) -> None:
+    steps, columns = 500_000, 20
+    path = tmp_path / "large.sqlite"
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all)
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO measurement_columns (id, name, project_id) VALUES (?, ?, 1)",
+        [(c, f"column_{c}") for c in range(columns + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO forcing_conditions (sequence_number, numeric_value, column_id, testrun_id) VALUES (?, ?, 0, 1)",
+        ((i, i * 0.01) for i in range(steps)),
+    )
+    conn.executemany(
+        "INSERT INTO measurement_entries (sequence_number, numeric_value, column_id, testrun_id) VALUES (?, ?, ?, 1)",
+        ((i, i * 0.1 + c, c) for i in range(steps) for c in range(1, columns + 1)),
+    )
+    conn.commit()
+    conn.close()
+
+    rss = peak = _rss()
+    lines = 0
+    async with AsyncSession(engine) as session:
+        frames = _iter_testrun_df(models.TestRun(id=1), session, 10_000)
+        async for chunk in _stream_export(frames, DataExportFormat.CSV):
+            lines += chunk.count(b"\n")
+            peak = max(peak, _rss())
+    await engine.dispose()
+
+    assert lines == steps + 1
+    # the whole CSV is larger than this, a buffered export needs several GB
+    assert peak - rss < 256 * 2**20
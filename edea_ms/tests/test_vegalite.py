@@ -0,0 +1,110 @@
+import polars as pl
+
+from ..core.charts import ChartKey, _prepare
+
+df = pl.DataFrame(
+    {
+        "sequence_number": list(range(6)),
+        "setpoint": [0.3, 1.2, 2.5, 4.0, 7.9, None],
+        "mode": ["a", "b", "a", "b", "a", "a"],
+        "v_in": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        "v_out": [0.5, 1.0, 1.5, 2.0, 2.5, 3.0],
+        "unused": [0] * 6,
+    }
+)
+# charts are prepared for rendering like this, without decimation
+key = ChartKey(1, "hash", "v1", "svg", 72)
+
+
+def test_filter() -> None:
+    spec = {
+        "transform": [
+            {"filter": {"and": [{"field": "mode", "equal": "a"}, {"field": "setpoint", "range": [0, 5]}]}},
+            {"filter": {"not": {"field": "sequence_number", "oneOf": [2]}}},
+        ],
+        "mark": "point",
+        "encoding": {"x": {"field": "setpoint"}, "y": {"field": "v_out"}},
+    }
+    out_spec, out, _ = _prepare(spec, df, key)
+
+    assert "transform" not in out_spec
+    # null compares like 0
+    assert out.to_dict(as_series=False) == {"setpoint": [0.3, None], "v_out": [0.5, 3.0]}
+
+
+def test_aggregate() -> None:
+    spec = {
+        "transform": [
+            {
+                "aggregate": [
+                    {"op": "count", "as": "n"},
+                    {"op": "mean", "field": "v_in", "as": "mean_v_in"},
+                    {"op": "valid", "field": "setpoint", "as": "valid"},
+                ],
+                "groupby": ["mode"],
+            }
+        ],
+        "mark": "bar",
+        "encoding": {"x": {"field": "mode"}, "y": {"field": "mean_v_in"}, "tooltip": [{"field": "n"}]},
+    }
+    _, out, _ = _prepare(spec, df, key)
+
+    assert out.to_dict(as_series=False) == {"mode": ["a", "b"], "n": [4, 2], "mean_v_in": [3.75, 3.0]}
+
+
+def test_bin() -> None:
+    spec = {
+        "transform": [{"bin": True, "field": "setpoint", "as": "bin"}],
+        "mark": "bar",
+        "encoding": {"x": {"field": "bin"}, "x2": {"field": "bin_end"}},
+    }
+    _, out, _ = _prepare(spec, df, key)
+
+    # the extent 0.3 to 7.9 gets bins of width 1 from 0 to 8 in vega
+    assert out["bin"].to_list() == [0.0, 1.0, 2.0, 4.0, 7.0, None]
+    assert out["bin_end"].to_list() == [1.0, 2.0, 3.0, 5.0, 8.0, None]
+
+    spec["transform"] = [{"bin": {"maxbins": 3}, "field": "sequence_number", "as": ["start", "end"]}]
+    spec["encoding"] = {"x": {"field": "start"}, "x2": {"field": "end"}}
+    _, out, _ = _prepare(spec, df, key)
+    assert out["start"].to_list() == [0.0, 0.0, 2.0, 2.0, 4.0, 4.0]
+    assert out["end"].to_list() == [2.0, 2.0, 4.0, 4.0, 6.0, 6.0]
+
+
+def test_fold() -> None:
+    spec = {
+        "transform": [{"fold": ["v_in", "v_out"], "as": ["channel", "voltage"]}],
+        "mark": "line",
+        "encoding": {
+            "x": {"field": "sequence_number"},
+            "y": {"field": "voltage"},
+            "color": {"field": "channel"},
+        },
+    }
+    _, out, _ = _prepare(spec, df.head(2), key)
+
+    assert out.to_dict(as_series=False) == {
+        "sequence_number": [0, 0, 1, 1],
+        "channel": ["v_in", "v_out", "v_in", "v_out"],
+        "voltage": [1.0, 0.5, 2.0, 1.0],
+    }
+
+
+def test_fallback() -> None:
+    # an expression can't be evaluated here, it and everything after it is left to vega
+    transforms = [
+        {"filter": {"field": "mode", "equal": "a"}},
+        {"filter": "datum.v_in > 2"},
+        {"fold": ["v_in", "v_out"]},
+    ]
+    spec = {"transform": transforms, "mark": "point", "encoding": {"x": {"field": "v_in"}}}
+    out_spec, out, _ = _prepare(spec, df, key)
+
+    assert out_spec["transform"] == transforms[1:]
+    # the remaining transforms may use any field
+    assert out.columns == df.columns
+    assert out.height == 4
+
+    # the tooltip shows every field
+    spec = {"mark": {"type": "point", "tooltip": True}, "encoding": {"x": {"field": "v_in"}}}
+    assert _prepare(spec, df, key)[1].columns == df.columns